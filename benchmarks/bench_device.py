@@ -0,0 +1,152 @@
+""" Benchmark: latency percentiles and throughput of discovery, device
+    construction, the getters and get_playback_details() against a local
+    emulated player (see emulator.py), compared with a stored baseline.
+
+    Usage: python benchmarks/bench_device.py [options]
+
+    --iterations N     calls per benchmark (default: 200)
+    --latency SECONDS  response latency of the emulated player (default: 0)
+    --baseline PATH    baseline file (default: benchmarks/baseline.json)
+    --save             store the results as new baseline
+    --tolerance FRAC   allowed p50 increase before a benchmark is reported
+                       as a regression (default: 0.25); the exit status is
+                       1 if there are regressions
+
+    Baselines are specific to the machine they were recorded on.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+from emulator import Emulator  # noqa: E402
+from stream_magic import device, discovery, metrics  # noqa: E402
+
+GETTERS = ('get_power_state', 'get_transport_state', 'get_volume',
+           'get_volume_max', 'get_mute_state', 'get_volume_control',
+           'get_audio_source', 'get_shuffle', 'get_repeat',
+           'get_current_track_info', 'get_preset_list',
+           'get_current_preset', 'get_playback_details', 'get_state',
+           'get_album_art')
+
+
+def percentile(values, fraction):
+    """ Return the nearest-rank percentile of the sorted values. """
+    index = max(0, min(len(values) - 1,
+                       int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def run(func, iterations):
+    """ Call func iterations times (after one warm-up call) and return
+        a dict with latency percentiles in milliseconds and the
+        throughput in calls per second.
+    """
+    func()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {'p50': percentile(latencies, 0.5) * 1000,
+            'p90': percentile(latencies, 0.9) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': latencies[-1] * 1000,
+            'calls_per_s': iterations / elapsed}
+
+
+def benchmarks(emu, iterations):
+    """ Yield (name, result) tuples for all benchmarks. """
+    def discover():
+        search = discovery.StreamMagic(ssdp_group=emu.ssdp_address)
+        if not search.discover(count=1, timeout=1):
+            raise RuntimeError('the emulated player was not discovered')
+    yield 'discover', run(discover, max(1, iterations // 4))
+
+    def construct():
+        device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                 emu.location).close()
+    yield 'construct', run(construct, max(1, iterations // 4))
+
+    dev = device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                   emu.location, pool_size=8)
+    try:
+        for getter in GETTERS:
+            yield getter, run(getattr(dev, getter), iterations)
+    finally:
+        dev.close()
+
+
+def compare(results, baseline, tolerance):
+    """ Print the results next to the baseline and return the names of
+        the benchmarks whose p50 latency regressed.
+    """
+    regressions = []
+    print('%-24s %9s %9s %9s %9s %10s %9s' % (
+        'benchmark', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'calls/s',
+        'vs base'))
+    for name, result in results.items():
+        delta = ''
+        base = baseline.get(name)
+        if base and base['p50'] > 0:
+            change = result['p50'] / base['p50'] - 1
+            delta = '%+.0f%%' % (change * 100)
+            if change > tolerance:
+                delta += ' !'
+                regressions.append(name)
+        print('%-24s %9.3f %9.3f %9.3f %9.3f %10.0f %9s' % (
+            name, result['p50'], result['p90'], result['p99'],
+            result['max'], result['calls_per_s'], delta))
+    return regressions
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description='Benchmark stream_magic against an emulated player.')
+    args.add_argument('--iterations', type=int, default=200)
+    args.add_argument('--latency', type=float, default=0.0)
+    args.add_argument('--baseline',
+                      default=os.path.join(HERE, 'baseline.json'))
+    args.add_argument('--save', action='store_true')
+    args.add_argument('--tolerance', type=float, default=0.25)
+    args = args.parse_args()
+
+    # requests shouldn't be slowed down by recording metrics
+    device.StreamMagicDevice.metrics_registry = metrics.Metrics()
+    discovery.StreamMagic.metrics_registry = None
+
+    emu = Emulator(latency=args.latency, presets=20, seed=1)
+    emu.start(ssdp_port=0)
+    try:
+        results = dict(benchmarks(emu, args.iterations))
+    finally:
+        emu.stop()
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file).get('results', {})
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'iterations': args.iterations,
+                       'latency': args.latency,
+                       'python': sys.version.split()[0],
+                       'results': results},
+                      baseline_file, indent=1, sort_keys=True)
+        print('baseline saved to %s' % args.baseline)
+    elif regressions:
+        print('regressions: %s' % ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
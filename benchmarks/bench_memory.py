@@ -0,0 +1,89 @@
+""" Benchmark: memory footprint of device objects holding the service and
+    action tables of players with the same firmware, measured with
+    tracemalloc against a local emulated player (see emulator.py).
+
+    Usage: python benchmarks/bench_memory.py [options]
+
+    --devices N   number of device objects (default: 200)
+
+    The tables are loaded from a cache.DescriptionCache, like a controller
+    does for players it has seen before. The action tables are compared
+    with nested per-device dicts, the format they are cached in.
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+from emulator import Emulator  # noqa: E402
+from stream_magic import cache, device, metrics, registry  # noqa: E402
+
+
+def measure(func, count):
+    """ Call func count times, keeping the results, and return the number
+        of bytes allocated per call.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [func() for _ in range(count)]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return (after - before) / count
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description='Measure the memory footprint of device objects.')
+    args.add_argument('--devices', type=int, default=200)
+    args = args.parse_args()
+
+    device.StreamMagicDevice.metrics_registry = metrics.Metrics()
+
+    emu = Emulator(seed=1)
+    emu.start()
+    headers = {'usn': '%s::upnp:rootdevice' % emu.udn}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            scpd_cache = cache.DescriptionCache(directory)
+
+            def create():
+                dev = device.StreamMagicDevice(
+                    emu.host, emu.port, emu.server, emu.location,
+                    scpd_cache=scpd_cache, ssdp_headers=headers)
+                dev.get_services(init=True)
+                dev.close()
+                return dev
+
+            first = create()   # fill the description cache
+            actions = sum(len(table) for table in first.actions.values())
+            arguments = sum(len(action) for table in first.actions.values()
+                            for action in table.values())
+            per_device = measure(create, args.devices)
+            per_table = measure(
+                lambda: scpd_cache.get(first._scpd_key)[1], args.devices)
+            per_registry = measure(
+                lambda: registry.ActionRegistry(
+                    scpd_cache.get(first._scpd_key)[1]), args.devices)
+    finally:
+        emu.stop()
+
+    print('%d devices, %d services, %d actions, %d arguments' % (
+        args.devices, len(first.services), actions, arguments))
+    print('%-32s %10.0f bytes' % ('device object', per_device))
+    print('%-32s %10.0f bytes' % ('actions as nested dicts',
+                                  per_table))
+    print('%-32s %10.0f bytes' % ('actions in ActionRegistry',
+                                  per_registry))
+    print('shared service tables: %d' % registry.shared_tables())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+""" Micro-benchmark: per-call CPU time and allocations for parsing a
+    GetPositionInfo response with minidom (one DOM per looked up value, as
+    done before stream_magic.parser existed) and with stream_magic.parser.
+
+    Usage: python benchmarks/bench_parser.py [iterations]
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+from xml.dom import minidom
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from stream_magic import parser  # noqa: E402
+
+DIDL = (
+    '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">'
+    '<item id="1" parentID="0" restricted="1">'
+    '<dc:title>Splitter</dc:title><upnp:artist>Calexico</upnp:artist>'
+    '<upnp:album>Algiers</upnp:album><upnp:genre>Rock</upnp:genre>'
+    '<upnp:originalTrackNumber>2</upnp:originalTrackNumber>'
+    '<upnp:albumArtURI>http://192.168.1.10/art/algiers.jpg</upnp:albumArtURI>'
+    '<res duration="0:03:30.000" protocolInfo="http-get:*:audio/flac:*">'
+    'http://192.168.1.10/media/2.flac</res></item></DIDL-Lite>')
+
+RESPONSE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+    '<u:GetPositionInfoResponse '
+    'xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">'
+    '<Track>2</Track><TrackDuration>0:03:30</TrackDuration>'
+    '<TrackMetaData>%s</TrackMetaData><TrackURI></TrackURI>'
+    '<RelTime>0:00:47</RelTime><AbsTime>0:00:47</AbsTime>'
+    '</u:GetPositionInfoResponse></s:Body></s:Envelope>'
+    % escape(DIDL)).encode('utf-8')
+
+TAGS = ('upnp:artist', 'dc:title', 'upnp:albumArtURI', 'upnp:genre',
+        'upnp:originalTrackNumber', 'upnp:album')
+
+
+def minidom_track_info(response):
+    """ The track info parsing as implemented with minidom. """
+    def value(data, tag):
+        values = minidom.parseString(data).getElementsByTagName(tag)
+        return values[0].firstChild.nodeValue if values else 'n/a'
+
+    track_data = value(response, 'TrackMetaData')
+    data = {tag: value(track_data, tag) for tag in TAGS}
+    data['currentPos'] = value(response, 'AbsTime')
+    data['trackLength'] = minidom.parseString(track_data)\
+        .getElementsByTagName('res')[0].attributes['duration']\
+        .firstChild.data[:-4]
+    return data
+
+
+def parser_track_info(response):
+    """ The track info parsing as implemented with stream_magic.parser. """
+    values = parser.get_values(response, ('TrackMetaData', 'AbsTime'))
+    meta, attrs = parser.extract(values['TrackMetaData'], TAGS, ('res',))
+    data = {tag: meta.get(tag, 'n/a') for tag in TAGS}
+    data['currentPos'] = values['AbsTime']
+    data['trackLength'] = attrs['res']['duration'].split('.')[0]
+    return data
+
+
+def measure(func, iterations):
+    """ Return (microseconds per call, peak traced memory per call). """
+    seconds = min(timeit.repeat(lambda: func(RESPONSE), number=iterations,
+                                repeat=3))
+    tracemalloc.start()
+    func(RESPONSE)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds / iterations * 1e6, peak
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    assert minidom_track_info(RESPONSE) == parser_track_info(RESPONSE)
+    print('%-10s %12s %12s' % ('parser', 'us/call', 'peak bytes'))
+    for name, func in (('minidom', minidom_track_info),
+                       ('expat', parser_track_info)):
+        usec, peak = measure(func, iterations)
+        print('%-10s %12.1f %12d' % (name, usec, peak))
+
+
+if __name__ == '__main__':
+    main()
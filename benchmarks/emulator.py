@@ -0,0 +1,614 @@
+""" Local StreamMagic device emulator used by the benchmarks.
+
+    Serves a root description, the service SCPD documents and SOAP
+    responses for the actions used by stream_magic.device, handles GENA
+    subscriptions and answers SSDP M-SEARCH requests, so the package can
+    be exercised without an actual player.
+"""
+import http.client
+import random
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse
+from xml.dom import minidom
+from xml.sax.saxutils import escape
+
+SOAP_ENVELOPE = "http://schemas.xmlsoap.org/soap/envelope/"
+SOAP_ENCODING = "http://schemas.xmlsoap.org/soap/encoding/"
+
+# service type -> (short name, {action: ([in args], [out args])})
+SERVICES = {
+    'urn:schemas-upnp-org:service:AVTransport:1': ('AVTransport', {
+        'GetTransportInfo': (['InstanceID'],
+                             ['CurrentTransportState',
+                              'CurrentTransportStatus',
+                              'CurrentSpeed']),
+        'GetPositionInfo': (['InstanceID'],
+                            ['Track', 'TrackDuration', 'TrackMetaData',
+                             'TrackURI', 'RelTime', 'AbsTime']),
+        'Play': (['InstanceID', 'Speed'], []),
+        'Pause': (['InstanceID'], []),
+        'Stop': (['InstanceID'], []),
+        'Seek': (['InstanceID', 'Unit', 'Target'], []),
+        'SetAVTransportURI': (['InstanceID', 'CurrentURI',
+                               'CurrentURIMetaData'], []),
+    }),
+    'urn:schemas-upnp-org:service:RenderingControl:1': ('RenderingControl', {
+        'GetMute': (['InstanceID', 'Channel'], ['CurrentMute']),
+        'SetMute': (['InstanceID', 'Channel', 'DesiredMute'], []),
+        'GetVolume': (['InstanceID', 'Channel'], ['CurrentVolume']),
+        'SetVolume': (['InstanceID', 'Channel', 'DesiredVolume'], []),
+        'GetVolumeMax': (['InstanceID'], ['CurrentVolumeMax']),
+    }),
+    'urn:schemas-upnp-org:service:ConnectionManager:1': ('ConnectionManager', {
+        'GetProtocolInfo': ([], ['Source', 'Sink']),
+    }),
+    'urn:UuVol-com:service:UuVolControl:5': ('UuVolControl', {
+        'GetAudioSource': ([], ['RetAudioSourceValue']),
+        'GetPowerState': ([], ['RetPowerStateValue']),
+        'SetPowerState': (['NewPowerStateValue'], []),
+        'GetVolumeControl': ([], ['Enabled']),
+        'RegisterNavigator': ([], ['RetNavigatorId']),
+        'ReleaseNavigator': (['NavigatorId'], []),
+        'IsRegisteredNavigatorId': (['NavigatorId'], ['IsRegistered']),
+        'GetPlaybackDetails': (['NavigatorId'], ['RetPlaybackXML']),
+        'GetNumberOfPresets': ([], ['RetNumberOfPresetsValue']),
+        'GetPresetList': (['Start', 'End'], ['RetPresetListXML']),
+        'PlayPreset': (['NewPresetNumberValue'], []),
+    }),
+    'urn:UuVol-com:service:UuVolSimpleRemote:1': ('UuVolSimpleRemote', {
+        'KeyPressed': (['Key', 'Duration'], []),
+    }),
+    'urn:UuVol-com:service:PlaylistExtension:1': ('PlaylistExtension', {
+        'Shuffle': ([], ['aShuffle']),
+        'SetShuffle': (['aShuffle'], []),
+        'Repeat': ([], ['aRepeat']),
+        'SetRepeat': (['aRepeat'], []),
+    }),
+}
+
+TRACK_META = (
+    '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">'
+    '<item id="1" parentID="0" restricted="1">'
+    '<dc:title>Splitter</dc:title>'
+    '<upnp:artist>Calexico</upnp:artist>'
+    '<upnp:album>Algiers</upnp:album>'
+    '<upnp:genre>Rock</upnp:genre>'
+    '<upnp:originalTrackNumber>2</upnp:originalTrackNumber>'
+    '<upnp:albumArtURI>http://{host}:{port}/art/algiers.jpg'
+    '</upnp:albumArtURI>'
+    '<res duration="0:03:30.000" protocolInfo="http-get:*:audio/flac:*">'
+    'http://{host}:{port}/media/2.flac</res>'
+    '</item></DIDL-Lite>')
+
+PLAYBACK_XML = (
+    '<reply type="ok"><playback-details>'
+    '<stream id="1"><title>Psychomed: Rock &amp; Blues</title></stream>'
+    '<state>Playing</state>'
+    '<format codec="MP3" sample-rate="44100" vbr="0" bit-rate="320000" '
+    'bit-depth="16"/>'
+    '<artist>Derek And The Dominos - Layla</artist>'
+    '</playback-details></reply>')
+
+# served as /art/algiers.jpg: a JPEG header followed by padding
+ALBUM_ART = b'\xff\xd8\xff\xe0' + bytes(60 * 1024 - 6) + b'\xff\xd9'
+ALBUM_ART_ETAG = '"algiers-1"'
+
+PROTOCOL_SINK = ','.join('http-get:*:%s:*' % mime for mime in (
+    'audio/flac', 'audio/x-flac', 'audio/mpeg', 'audio/mp4', 'audio/x-wav',
+    'audio/wav', 'audio/L16', 'audio/x-ms-wma', 'audio/ogg', 'audio/aac'))
+
+
+def _scpd(actions):
+    """ Return an SCPD document for the given actions table. """
+    parts = ['<?xml version="1.0"?>'
+             '<scpd xmlns="urn:schemas-upnp-org:service-1-0">'
+             '<specVersion><major>1</major><minor>0</minor></specVersion>'
+             '<actionList>']
+    for action, (args_in, args_out) in actions.items():
+        parts.append('<action><name>%s</name><argumentList>' % action)
+        for direction, args in (('in', args_in), ('out', args_out)):
+            for arg in args:
+                parts.append('<argument><name>%s</name>'
+                             '<direction>%s</direction>'
+                             '<relatedStateVariable>A_ARG_TYPE_%s'
+                             '</relatedStateVariable></argument>'
+                             % (arg, direction, arg))
+        parts.append('</argumentList></action>')
+    parts.append('</actionList><serviceStateTable/></scpd>')
+    return ''.join(parts).encode('utf-8')
+
+
+class DeviceState:
+    """ Mutable state of an emulated player. """
+
+    def __init__(self, presets=3):
+        self.power = 'ON'
+        self.transport = 'PLAYING'
+        self.source = 'MEDIA PLAYER'
+        self.volume = 12
+        self.mute = 0
+        self.shuffle = 0
+        self.repeat = 0
+        self.position = 47
+        self.preset = 1
+        self.presets = ['Preset %d' % (i + 1) for i in range(presets)]
+        self.navigators = set()
+        self._next_navigator = 1
+        self.lock = threading.Lock()
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+    def server_bind(self):
+        """ Bind without HTTPServer's reverse lookup of the host name,
+            which takes long for loopback aliases.
+        """
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address[:2]
+
+    def handle_error(self, request, client_address):
+        """ Ignore clients that went away, e.g. after a timeout. """
+
+
+class Emulator:
+    """ A single emulated StreamMagic player.
+
+        host/port: address the HTTP server binds to (port 0 = any)
+        latency: base delay in seconds added to every HTTP response
+        jitter: maximum random delay added on top of latency
+        loss: probability (0..1) of silently dropping a request
+        slowness: factor applied to latency for SCPD documents
+        standby: 'network' (answer with IDLE) or 'eco' (drop everything)
+                 when the emulated player is switched off
+        seed: seed for the random generator driving jitter and loss
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, name='Emulated 851N',
+                 udn=None, latency=0.0, jitter=0.0, loss=0.0, slowness=1.0,
+                 standby='network', presets=3, seed=None):
+        self.name = name
+        self.udn = udn or 'uuid:00000000-0000-0000-0000-%012x' % \
+            random.getrandbits(48)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.slowness = slowness
+        self.standby = standby
+        self.state = DeviceState(presets)
+        self.requests = 0
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._rlock = threading.Lock()
+        self._httpd = _Server((host, port), self._handler())
+        self.host, self.port = self._httpd.server_address[:2]
+        self._documents = self._build_documents()
+        self._threads = []
+        self._ssdp_sock = None
+        self.subscriptions = {}  # {sid: [short service name, callback, seq]}
+
+    @property
+    def location(self):
+        """ Return the URL of the root description. """
+        return 'http://%s:%d/description.xml' % (self.host, self.port)
+
+    @property
+    def server(self):
+        """ Return the value of the SERVER header. """
+        return 'StreamMagic/1.0 UPnP/1.0 %s' % self.name.replace(' ', '_')
+
+    def _build_documents(self):
+        """ Pre-render the root description and SCPD documents. """
+        docs = {}
+        services = []
+        for service_type, (short, actions) in SERVICES.items():
+            docs['/%s/scpd.xml' % short] = _scpd(actions)
+            services.append(
+                '<service><serviceType>%s</serviceType>'
+                '<serviceId>urn:upnp-org:serviceId:%s</serviceId>'
+                '<SCPDURL>/%s/scpd.xml</SCPDURL>'
+                '<controlURL>/%s/control</controlURL>'
+                '<eventSubURL>/%s/event</eventSubURL></service>'
+                % (service_type, short, short, short, short))
+        docs['/description.xml'] = (
+            '<?xml version="1.0"?>'
+            '<root xmlns="urn:schemas-upnp-org:device-1-0">'
+            '<specVersion><major>1</major><minor>0</minor></specVersion>'
+            '<device><deviceType>urn:schemas-upnp-org:device:MediaRenderer:1'
+            '</deviceType><friendlyName>%s</friendlyName>'
+            '<manufacturer>Cambridge Audio</manufacturer><UDN>%s</UDN>'
+            '<serviceList>%s</serviceList></device></root>'
+            % (escape(self.name), self.udn, ''.join(services))
+        ).encode('utf-8')
+        return docs
+
+    # ------ request handling ------
+
+    def _delay(self, factor=1.0):
+        """ Sleep for the configured latency plus jitter. """
+        with self._rlock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        delay *= factor
+        if delay > 0:
+            time.sleep(delay)
+
+    def _drop(self):
+        """ Return True if the current request should be dropped. """
+        if self.standby == 'eco' and self.state.power == 'OFF':
+            return True
+        if not self.loss:
+            return False
+        with self._rlock:
+            return self._random.random() < self.loss
+
+    def _value(self, action, args):
+        """ Execute a SOAP action and return a dict of output values. """
+        st = self.state
+        host, port = self.host, self.port
+        with st.lock:
+            if action == 'GetTransportInfo':
+                return {'CurrentTransportState': st.transport,
+                        'CurrentTransportStatus': 'OK',
+                        'CurrentSpeed': '1'}
+            if action == 'GetPositionInfo':
+                pos = '0:%02d:%02d' % divmod(st.position, 60)
+                return {'Track': '2', 'TrackDuration': '0:03:30',
+                        'TrackMetaData': TRACK_META.format(host=host,
+                                                           port=port),
+                        'TrackURI': '', 'RelTime': pos, 'AbsTime': pos}
+            if action in ('Play', 'KeyPressed') and \
+                    args.get('Key', 'PLAY_PAUSE') == 'PLAY_PAUSE':
+                st.transport = 'PAUSED_PLAYBACK' \
+                    if st.transport == 'PLAYING' else 'PLAYING'
+                return {}
+            if action == 'Pause':
+                st.transport = 'PAUSED_PLAYBACK'
+                return {}
+            if action == 'Stop':
+                st.transport = 'STOPPED'
+                return {}
+            if action == 'Seek':
+                h, m, s = (args.get('Target', '0:00:00').split('.')[0]
+                           .split(':'))
+                st.position = int(h) * 3600 + int(m) * 60 + int(s)
+                return {}
+            if action == 'GetMute':
+                return {'CurrentMute': st.mute}
+            if action == 'SetMute':
+                st.mute = int(args.get('DesiredMute', 0))
+                return {}
+            if action == 'GetVolume':
+                return {'CurrentVolume': st.volume}
+            if action == 'SetVolume':
+                st.volume = int(args.get('DesiredVolume', 0))
+                return {}
+            if action == 'GetVolumeMax':
+                return {'CurrentVolumeMax': 30}
+            if action == 'GetProtocolInfo':
+                return {'Source': '', 'Sink': PROTOCOL_SINK}
+            if action == 'GetAudioSource':
+                return {'RetAudioSourceValue': st.source}
+            if action == 'GetPowerState':
+                return {'RetPowerStateValue':
+                        'IDLE' if st.power == 'OFF' else st.power}
+            if action == 'SetPowerState':
+                st.power = args.get('NewPowerStateValue', 'ON')
+                return {}
+            if action == 'GetVolumeControl':
+                return {'Enabled': 1}
+            if action == 'RegisterNavigator':
+                nid = 'nav%d' % st._next_navigator
+                st._next_navigator += 1
+                st.navigators.add(nid)
+                return {'RetNavigatorId': nid}
+            if action == 'ReleaseNavigator':
+                st.navigators.discard(args.get('NavigatorId'))
+                return {}
+            if action == 'IsRegisteredNavigatorId':
+                return {'IsRegistered':
+                        int(args.get('NavigatorId') in st.navigators)}
+            if action == 'GetPlaybackDetails':
+                if args.get('NavigatorId') not in st.navigators:
+                    raise KeyError(action)
+                return {'RetPlaybackXML': PLAYBACK_XML}
+            if action == 'GetNumberOfPresets':
+                return {'RetNumberOfPresetsValue': len(st.presets)}
+            if action == 'GetPresetList':
+                start = int(args.get('Start', 1))
+                end = min(int(args.get('End', len(st.presets))),
+                          len(st.presets))
+                items = []
+                for num in range(start, end + 1):
+                    playing = ' isPlaying="true"' \
+                        if num == st.preset else ''
+                    items.append('<preset id="%d"%s><title>%s</title>'
+                                 '</preset>'
+                                 % (num, playing,
+                                    escape(st.presets[num - 1])))
+                return {'RetPresetListXML':
+                        '<presets>%s</presets>' % ''.join(items)}
+            if action == 'PlayPreset':
+                st.preset = int(args.get('NewPresetNumberValue', 1))
+                st.source = 'INTERNET RADIO'
+                return {}
+            if action == 'Shuffle':
+                return {'aShuffle': st.shuffle}
+            if action == 'SetShuffle':
+                st.shuffle = int(args.get('aShuffle', 0))
+                return {}
+            if action == 'Repeat':
+                return {'aRepeat': st.repeat}
+            if action == 'SetRepeat':
+                st.repeat = int(args.get('aRepeat', 0))
+                return {}
+        raise KeyError(action)
+
+    # ------ eventing ------
+
+    def _last_change(self, short):
+        """ Render the LastChange propertyset for a service. """
+        st = self.state
+        if short == 'AVTransport':
+            variables = '<TransportState val="%s"/>' % st.transport
+            ns = 'urn:schemas-upnp-org:metadata-1-0/AVT/'
+        elif short == 'RenderingControl':
+            variables = ('<Volume channel="Master" val="%d"/>'
+                         '<Mute channel="Master" val="%d"/>'
+                         % (st.volume, st.mute))
+            ns = 'urn:schemas-upnp-org:metadata-1-0/RCS/'
+        else:
+            return None
+        event = ('<Event xmlns="%s"><InstanceID val="0">%s</InstanceID>'
+                 '</Event>' % (ns, variables))
+        return ('<?xml version="1.0"?>'
+                '<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+                '<e:property><LastChange>%s</LastChange></e:property>'
+                '</e:propertyset>' % escape(event)).encode('utf-8')
+
+    def notify(self, short=None):
+        """ Send NOTIFY requests to the subscribers of a service
+            (or of all services).
+        """
+        for sid, sub in list(self.subscriptions.items()):
+            if short is not None and sub[0] != short:
+                continue
+            body = self._last_change(sub[0])
+            if body is None:
+                continue
+            url = urlparse(sub[1])
+            try:
+                conn = http.client.HTTPConnection(url.hostname, url.port,
+                                                  timeout=2)
+                conn.request('NOTIFY', url.path, body, {
+                    'Content-Type': 'text/xml; charset="utf-8"',
+                    'NT': 'upnp:event', 'NTS': 'upnp:propchange',
+                    'SID': sid, 'SEQ': str(sub[2])})
+                conn.getresponse().read()
+                conn.close()
+            except OSError:
+                pass
+            sub[2] += 1
+
+    def _handler(self):
+        """ Return a request handler class bound to this emulator. """
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                with emulator._rlock:
+                    emulator.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def _reply(self, status, body, ctype='text/xml; charset="utf-8"'):
+                self.send_response(status)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _reply_art(self):
+                if self.headers.get('If-None-Match') == ALBUM_ART_ETAG:
+                    self.send_response(304)
+                    body = b''
+                else:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/jpeg')
+                    body = ALBUM_ART
+                self.send_header('ETag', ALBUM_ART_ETAG)
+                self.send_header('Cache-Control', 'max-age=3600')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                emulator.requests += 1
+                if emulator._drop():
+                    self.close_connection = True
+                    return
+                emulator._delay(emulator.slowness)
+                if self.path == '/art/algiers.jpg':
+                    self._reply_art()
+                    return
+                doc = emulator._documents.get(self.path)
+                if doc is None:
+                    self._reply(404, b'')
+                else:
+                    self._reply(200, doc)
+
+            def do_SUBSCRIBE(self):
+                short = self.path.split('/')[1]
+                sid = self.headers.get('SID')
+                if sid:
+                    ok = sid in emulator.subscriptions
+                else:
+                    callback = self.headers.get('CALLBACK', '').strip('<>')
+                    sid = 'uuid:%032x' % random.getrandbits(128)
+                    emulator.subscriptions[sid] = [short, callback, 0]
+                    ok = True
+                self.send_response(200 if ok else 412)
+                self.send_header('SID', sid)
+                self.send_header('TIMEOUT', self.headers.get('TIMEOUT',
+                                                             'Second-1800'))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                if ok and not self.headers.get('SID'):
+                    threading.Thread(target=emulator.notify,
+                                     args=(short,), daemon=True).start()
+
+            def do_UNSUBSCRIBE(self):
+                ok = emulator.subscriptions.pop(self.headers.get('SID'),
+                                                None) is not None
+                self.send_response(200 if ok else 412)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):
+                emulator.requests += 1
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                if emulator._drop():
+                    self.close_connection = True
+                    return
+                emulator._delay()
+                soapaction = self.headers.get('SOAPACTION', '').strip('"')
+                service_type, _, action = soapaction.partition('#')
+                args = emulator._parse_args(body)
+                try:
+                    values = emulator._value(action, args)
+                except (KeyError, ValueError):
+                    self._reply(500, emulator._fault())
+                    return
+                self._reply(200, emulator._envelope(service_type, action,
+                                                    values))
+                if not action.startswith('Get') and emulator.subscriptions:
+                    emulator.notify()
+
+        return Handler
+
+    @staticmethod
+    def _parse_args(body):
+        """ Extract the argument values from a SOAP request body. """
+        args = {}
+        try:
+            doc = minidom.parseString(body)
+        except Exception:  # pylint: disable=broad-except
+            return args
+        for body_node in doc.getElementsByTagName('s:Body'):
+            for action in body_node.childNodes:
+                if action.nodeType != action.ELEMENT_NODE:
+                    continue
+                for arg in action.childNodes:
+                    if arg.nodeType == arg.ELEMENT_NODE:
+                        args[arg.tagName] = ''.join(
+                            n.data for n in arg.childNodes
+                            if n.nodeType == n.TEXT_NODE)
+        return args
+
+    @staticmethod
+    def _envelope(service_type, action, values):
+        """ Render a SOAP response envelope. """
+        args = ''.join('<%s>%s</%s>' % (k, escape(str(v)), k)
+                       for k, v in values.items())
+        return ('<?xml version="1.0" encoding="utf-8"?>'
+                '<s:Envelope xmlns:s="%s" s:encodingStyle="%s"><s:Body>'
+                '<u:%sResponse xmlns:u="%s">%s</u:%sResponse>'
+                '</s:Body></s:Envelope>'
+                % (SOAP_ENVELOPE, SOAP_ENCODING, action, service_type, args,
+                   action)).encode('utf-8')
+
+    @staticmethod
+    def _fault():
+        """ Render a SOAP fault envelope. """
+        return ('<?xml version="1.0" encoding="utf-8"?>'
+                '<s:Envelope xmlns:s="%s" s:encodingStyle="%s"><s:Body>'
+                '<s:Fault><faultcode>s:Client</faultcode>'
+                '<faultstring>UPnPError</faultstring><detail>'
+                '<UPnPError xmlns="urn:schemas-upnp-org:control-1-0">'
+                '<errorCode>401</errorCode>'
+                '<errorDescription>Invalid Action</errorDescription>'
+                '</UPnPError></detail></s:Fault></s:Body></s:Envelope>'
+                % (SOAP_ENVELOPE, SOAP_ENCODING)).encode('utf-8')
+
+    # ------ SSDP ------
+
+    def ssdp_reply(self, st='upnp:rootdevice'):
+        """ Return the datagram sent in response to an M-SEARCH. """
+        return ('HTTP/1.1 200 OK\r\n'
+                'CACHE-CONTROL: max-age=1800\r\n'
+                'EXT: \r\n'
+                'LOCATION: %s\r\n'
+                'SERVER: %s\r\n'
+                'ST: %s\r\n'
+                'USN: %s::%s\r\n'
+                '\r\n' % (self.location, self.server, st, self.udn, st)
+                ).encode('utf-8')
+
+    @property
+    def ssdp_address(self):
+        """ Return the (host, port) M-SEARCH requests are answered on, or
+            None if SSDP isn't served.
+        """
+        if self._ssdp_sock is None:
+            return None
+        return self._ssdp_sock.getsockname()[:2]
+
+    def _serve_ssdp(self):
+        """ Answer M-SEARCH requests arriving on the SSDP socket. """
+        sock = self._ssdp_sock
+        while True:
+            try:
+                data, addr = sock.recvfrom(65507)
+            except OSError:
+                return
+            if not data.startswith(b'M-SEARCH') or self._drop():
+                continue
+            self._delay()
+            try:
+                sock.sendto(self.ssdp_reply(), addr)
+            except OSError:
+                return
+
+    # ------ life cycle ------
+
+    def start(self, ssdp_port=None):
+        """ Start serving HTTP and, if ssdp_port is given, answer
+            unicast M-SEARCH requests sent to (self.host, ssdp_port).
+        """
+        thread = threading.Thread(target=self._httpd.serve_forever,
+                                  daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        if ssdp_port is not None:
+            self._ssdp_sock = socket.socket(socket.AF_INET,
+                                            socket.SOCK_DGRAM)
+            self._ssdp_sock.bind((self.host, ssdp_port))
+            thread = threading.Thread(target=self._serve_ssdp, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """ Shut down all servers. """
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._ssdp_sock is not None:
+            self._ssdp_sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
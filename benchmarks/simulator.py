@@ -0,0 +1,292 @@
+""" Load test: many emulated StreamMagic players on loopback.
+
+    Starts a number of emulated players (see emulator.py), spread over
+    loopback addresses 127.1.x.y (Linux routes all of 127.0.0.0/8 to the
+    loopback interface, no aliases need to be configured) and one SSDP
+    responder that answers an M-SEARCH on behalf of all of them: each
+    player replies from its own address after a random delay within the
+    MX window of the request, like real devices do. Replies, jitter and
+    packet loss are driven by seeded random generators, so runs are
+    repeatable.
+
+    Then measures how long discover() takes to find the players and how
+    long a fleet.Fleet needs to sweep them.
+
+    Usage: python benchmarks/simulator.py [options]
+
+    --devices N        number of players (default: 500)
+    --hosts N          number of loopback addresses used (default: 50)
+    --latency SECONDS  response latency of the players (default: 0.005)
+    --jitter SECONDS   maximum random delay added (default: 0.005)
+    --loss FRAC        probability of a request being dropped (default: 0)
+    --slow FRAC        fraction of players with slow firmware (default: 0)
+    --slowness FACTOR  latency factor of slow players (default: 20)
+    --off FRAC         fraction of players in standby (default: 0)
+    --standby MODE     'network' or 'eco' standby of players that are
+                       switched off (default: network)
+    --timeout SECONDS  discovery and sweep timeout (default: 5)
+    --sweeps N         number of fleet sweeps (default: 3)
+    --seed N           random seed (default: 1)
+"""
+import argparse
+import heapq
+import os
+import random
+import re
+import resource
+import socket
+import struct
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+from emulator import Emulator  # noqa: E402
+from stream_magic import discovery, fleet  # noqa: E402
+
+# First loopback address players are bound to
+BASE_ADDRESS = '127.1.0.1'
+
+
+def loopback_address(index):
+    """ Return the index'th loopback address after BASE_ADDRESS. """
+    base = struct.unpack('!I', socket.inet_aton(BASE_ADDRESS))[0]
+    return socket.inet_ntoa(struct.pack('!I', base + index))
+
+
+def _value(setting, index):
+    """ Return a setting for a player: settings are either a value used
+        for all players or a callable returning the value for an index.
+    """
+    return setting(index) if callable(setting) else setting
+
+
+class Simulator:
+    """ A group of emulated players sharing one SSDP responder.
+
+        count: number of players
+        hosts: number of loopback addresses the players are spread over
+               (several players on one address use different ports)
+        ssdp_host/ssdp_port: address of the SSDP responder (port 0 = any)
+        seed: seed of the random generators
+
+        latency, jitter, loss, slowness, standby: see Emulator; either a
+        value used for all players, or a callable returning the value for
+        the index of a player.
+        power: 'ON' or 'OFF', value or callable as above
+
+        Use ssdp_address as ssdp_group of a discovery.StreamMagic object
+        to search for the players.
+    """
+
+    def __init__(self, count, hosts=1, ssdp_host='127.0.0.1', ssdp_port=0,
+                 latency=0.0, jitter=0.0, loss=0.0, slowness=1.0,
+                 standby='network', power='ON', seed=None):
+        self.players = []
+        for index in range(count):
+            emu = Emulator(host=loopback_address(index % hosts),
+                           name='Simulated 851N %d' % index,
+                           udn='uuid:00000000-0000-0000-0000-%012x' % index,
+                           latency=_value(latency, index),
+                           jitter=_value(jitter, index),
+                           loss=_value(loss, index),
+                           slowness=_value(slowness, index),
+                           standby=_value(standby, index),
+                           seed=None if seed is None else seed + index)
+            emu.state.power = _value(power, index)
+            self.players.append(emu)
+        self.searches = 0
+        self.replies = 0
+        self._random = random.Random(seed)
+        self._ssdp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._ssdp_sock.bind((ssdp_host, ssdp_port))
+        self._reply_socks = dict()  # {host: socket replies are sent from}
+        self._queue = []            # heap of (due, seq, player, addr, st)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads = []
+
+    @property
+    def ssdp_address(self):
+        """ Return the (host, port) of the SSDP responder. """
+        return self._ssdp_sock.getsockname()[:2]
+
+    def __len__(self):
+        return len(self.players)
+
+    def _serve_ssdp(self):
+        """ Schedule the replies of all players to each M-SEARCH. """
+        while True:
+            try:
+                data, addr = self._ssdp_sock.recvfrom(65507)
+            except OSError:
+                return
+            if not data.startswith(b'M-SEARCH'):
+                continue
+            match = re.search(rb'\r\nMX: *(\d+)', data, re.IGNORECASE)
+            window = int(match.group(1)) if match else 1
+            match = re.search(rb'\r\nST: *(\S+)', data, re.IGNORECASE)
+            st = match.group(1).decode('ascii') if match \
+                else 'upnp:rootdevice'
+            if st == 'ssdp:all':
+                st = 'upnp:rootdevice'
+            now = time.monotonic()
+            with self._cond:
+                self.searches += 1
+                for emu in self.players:
+                    if emu._drop():  # pylint: disable=protected-access
+                        continue
+                    due = now + emu.latency + \
+                        self._random.uniform(0, window * 0.5)
+                    self._seq += 1
+                    heapq.heappush(self._queue,
+                                   (due, self._seq, emu, addr, st))
+                self._cond.notify()
+
+    def _send_replies(self):
+        """ Send the scheduled replies when they are due. """
+        while True:
+            with self._cond:
+                while self._running and (
+                        not self._queue or
+                        self._queue[0][0] > time.monotonic()):
+                    self._cond.wait(self._queue[0][0] - time.monotonic()
+                                    if self._queue else None)
+                if not self._running:
+                    return
+                _, _, emu, addr, st = heapq.heappop(self._queue)
+                self.replies += 1
+            try:
+                self._reply_socks[emu.host].sendto(emu.ssdp_reply(st), addr)
+            except OSError:
+                pass
+
+    def start(self):
+        """ Start the players and the SSDP responder. """
+        self._running = True
+        for emu in self.players:
+            emu.start()
+            if emu.host not in self._reply_socks:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind((emu.host, 0))
+                self._reply_socks[emu.host] = sock
+        for target in (self._serve_ssdp, self._send_replies):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """ Shut down all players and the SSDP responder. """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._ssdp_sock.close()
+        for sock in self._reply_socks.values():
+            sock.close()
+        for emu in self.players:
+            emu.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def raise_fd_limit():
+    """ Raise the open files limit to the hard limit: every player needs
+        a listening socket plus one per connection.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description='Load test stream_magic with many emulated players.')
+    args.add_argument('--devices', type=int, default=500)
+    args.add_argument('--hosts', type=int, default=50)
+    args.add_argument('--latency', type=float, default=0.005)
+    args.add_argument('--jitter', type=float, default=0.005)
+    args.add_argument('--loss', type=float, default=0.0)
+    args.add_argument('--slow', type=float, default=0.0)
+    args.add_argument('--slowness', type=float, default=20)
+    args.add_argument('--off', type=float, default=0.0)
+    args.add_argument('--standby', default='network',
+                      choices=('network', 'eco'))
+    args.add_argument('--timeout', type=float, default=5)
+    args.add_argument('--sweeps', type=int, default=3)
+    args.add_argument('--seed', type=int, default=1)
+    args = args.parse_args()
+    raise_fd_limit()
+
+    # pick the slow and switched off players up front, so the same
+    # players are affected in every run
+    picker = random.Random(args.seed)
+    slow = set(picker.sample(range(args.devices),
+                             int(args.devices * args.slow)))
+    off = set(picker.sample(range(args.devices),
+                            int(args.devices * args.off)))
+
+    # slow firmware is emulated by slowing down every response
+    def latency(index):
+        return args.latency * (args.slowness if index in slow else 1)
+
+    start = time.perf_counter()
+    sim = Simulator(args.devices, hosts=args.hosts, latency=latency,
+                    jitter=args.jitter, loss=args.loss,
+                    standby=args.standby,
+                    power=lambda index: 'OFF' if index in off else 'ON',
+                    seed=args.seed).start()
+    print('%d players on %d addresses started in %.2f s' % (
+        len(sim), min(args.hosts, args.devices),
+        time.perf_counter() - start))
+
+    try:
+        search = discovery.StreamMagic(ssdp_group=sim.ssdp_address)
+        start = time.perf_counter()
+        first = last = None
+        found = []
+        for item in search.iter_discover(count=len(sim),
+                                         timeout=args.timeout):
+            last = time.perf_counter() - start
+            if first is None:
+                first = last
+            found.append(item)
+        print('%-24s %6d of %d players (%d replies sent), first after '
+              '%.3f s, last after %.3f s' % (
+                  'discover', len(found), len(sim), sim.replies,
+                  first or 0, last or 0))
+
+        players = fleet.Fleet(max_workers=64)
+        for addr, data in found:
+            players.add_discovered(addr, data, timeout=args.timeout)
+        try:
+            print('%-24s %9s %9s %9s' % ('sweep', 'seconds', 'complete',
+                                         'failed'))
+            for number in range(args.sweeps):
+                start = time.perf_counter()
+                complete = failed = 0
+                for update in players.sweep(args.timeout):
+                    if not update.errors:
+                        complete += 1
+                    elif len(update.errors) == len(players.fields):
+                        failed += 1
+                print('%-24s %9.3f %9d %9d' % (
+                    '#%d' % (number + 1), time.perf_counter() - start,
+                    complete, failed))
+            stats = players.stats()
+            print('unhealthy: %d, busy: %d' % (stats.unhealthy, stats.busy))
+        finally:
+            players.close()
+    finally:
+        sim.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,20 @@
+from . import metrics
 from . import discovery
+from . import connection
+from . import cache
+from . import artwork
+from . import parser
+from . import registry
+from . import soap
+from . import commands
+from . import health
 from . import device
-__all__ = ['discovery', 'device']
+from . import asyncdevice
+from . import events
+from . import fleet
+from . import scheduler
+from . import position
+__all__ = ['metrics', 'discovery', 'connection', 'cache', 'artwork',
+           'parser', 'registry', 'soap', 'commands', 'health', 'device',
+           'asyncdevice', 'events', 'fleet', 'scheduler', 'position']
 __version__='0.16'
@@ -0,0 +1,304 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains a cache for the album art images referenced by the
+albumArtURI of the current track: images are kept in a size-bounded
+in-memory LRU cache (and optionally on disk), revalidated with
+conditional requests, and fetched only once when several callers ask for
+the same image at the same time.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from http.client import HTTPException
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from . import cache
+from . import connection
+
+# An album art image: the uri it was fetched from, the image bytes, its
+# mime type and the validators used for conditional requests
+Artwork = namedtuple('Artwork', ['uri', 'data', 'content_type', 'etag',
+                                 'last_modified'])
+
+
+def _write_bytes(path, data):
+    """ Atomically replace the file at path with data. """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class AlbumArtCache:
+    """ Fetch album art images and cache them by uri.
+
+        Images are fresh for the max-age of their Cache-Control header (or
+        max_age seconds). Stale images are revalidated with If-None-Match /
+        If-Modified-Since requests, and returned unchanged if that fails.
+
+        max_bytes: size limit of the in-memory cache; least recently used
+                   images are evicted first
+        directory: directory for a second, persistent cache tier (None: no
+                   disk tier)
+        disk_max_bytes: size limit of the disk tier
+        max_age: number of seconds images without Cache-Control max-age
+                 are fresh
+        timeout: network timeout in seconds
+    """
+
+    def __init__(self, max_bytes=16 << 20, directory=None,
+                 disk_max_bytes=256 << 20, max_age=3600, timeout=5):
+        """ Initialize instance. """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.max_age = max_age
+        self.timeout = timeout
+        self.hits = 0          # served from memory
+        self.disk_hits = 0     # served from the disk tier
+        self.misses = 0        # requests sent (including revalidations)
+        self.revalidated = 0   # requests answered with 304 Not Modified
+        self.coalesced = 0     # callers that waited for another's request
+        self.errors = 0        # failed requests
+        self.evictions = 0     # images evicted from memory
+        self.size = 0          # bytes in memory
+        self._entries = OrderedDict()  # {uri: (Artwork, expires)}
+        self._inflight = dict()        # {uri: Future}
+        self._lock = threading.Lock()
+        self._pool = connection.ConnectionPool(maxsize=2, timeout=timeout)
+
+    def get(self, uri, now=None):
+        """ Return the Artwork for a uri, or None if it couldn't be fetched
+            and isn't cached.
+        """
+        if not uri:
+            return None
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(uri)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(uri)
+                self.hits += 1
+                return entry[0]
+            future = self._inflight.get(uri)
+            waiting = future is not None
+            if waiting:
+                self.coalesced += 1
+            else:
+                future = self._inflight[uri] = Future()
+        if waiting:
+            return future.result()
+
+        try:
+            artwork = self._load(uri, entry, now)
+        except BaseException as err:
+            with self._lock:
+                del self._inflight[uri]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            del self._inflight[uri]
+        future.set_result(artwork)
+        return artwork
+
+    def _load(self, uri, entry, now):
+        """ Return the Artwork for a uri from the disk tier or the network,
+            given the (stale) memory entry, if any.
+        """
+        if entry is None:
+            entry = self._disk_get(uri)
+            if entry is not None and entry[1] > now:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(uri, entry)
+                return entry[0]
+        stale = entry and entry[0]
+        artwork, expires = self._fetch(uri, stale, now)
+        if artwork is None:
+            # serve the stale image rather than none
+            return stale
+        self._remember(uri, (artwork, expires))
+        if self.directory is not None:
+            self._disk_put(artwork, expires, artwork is not stale)
+        return artwork
+
+    def _fetch(self, uri, stale, now):
+        """ Request an image, conditionally if a stale Artwork is given.
+            Return (Artwork, expires), or (None, None) if the request
+            failed.
+        """
+        headers = dict()
+        if stale is not None:
+            if stale.etag:
+                headers['If-None-Match'] = stale.etag
+            if stale.last_modified:
+                headers['If-Modified-Since'] = stale.last_modified
+        with self._lock:
+            self.misses += 1
+        try:
+            if urlparse(uri).scheme == 'http':
+                status, resp_headers, data = self._pool.request(
+                    'GET', uri, headers=headers)
+            else:
+                status, resp_headers, data = self._urlopen(uri, headers)
+        except (OSError, HTTPException, ValueError):
+            status = None
+        if status == 304 and stale is not None:
+            with self._lock:
+                self.revalidated += 1
+            return stale, now + self._max_age(resp_headers)
+        if status != 200:
+            with self._lock:
+                self.errors += 1
+            return None, None
+        artwork = Artwork(uri, data, resp_headers.get('Content-Type'),
+                          resp_headers.get('ETag'),
+                          resp_headers.get('Last-Modified'))
+        return artwork, now + self._max_age(resp_headers)
+
+    def _urlopen(self, uri, headers):
+        """ Request an image with urllib (e.g. over https) and return
+            (status, headers, data).
+        """
+        request = urllib.request.Request(uri, headers=headers)
+        try:
+            with urllib.request.urlopen(request,
+                                        timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except HTTPError as err:
+            return err.code, err.headers, b''
+
+    def _max_age(self, headers):
+        """ Return the number of seconds a response is fresh. """
+        match = re.search(r'max-age\s*=\s*(\d+)',
+                          headers.get('Cache-Control') or '')
+        return int(match.group(1)) if match else self.max_age
+
+    def _remember(self, uri, entry):
+        """ Put an (Artwork, expires) entry into the memory cache and evict
+            the least recently used images beyond max_bytes.
+        """
+        size = len(entry[0].data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(uri, None)
+            if old is not None:
+                self.size -= len(old[0].data)
+            self._entries[uri] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (artwork, _) = self._entries.popitem(last=False)
+                self.size -= len(artwork.data)
+                self.evictions += 1
+
+    def _disk_path(self, uri):
+        """ Return the file name (without extension) for a uri. """
+        return os.path.join(self.directory,
+                            hashlib.sha1(uri.encode('utf-8')).hexdigest())
+
+    def _disk_get(self, uri):
+        """ Return the (Artwork, expires) entry for a uri from the disk
+            tier, or None.
+        """
+        if self.directory is None:
+            return None
+        path = self._disk_path(uri)
+        meta = cache._read_json(path + '.json')
+        if not isinstance(meta, dict) or meta.get('uri') != uri:
+            return None
+        try:
+            with open(path + '.img', 'rb') as image_file:
+                data = image_file.read()
+            os.utime(path + '.img')  # mark as recently used
+        except OSError:
+            return None
+        return (Artwork(uri, data, meta.get('content_type'),
+                        meta.get('etag'), meta.get('last_modified')),
+                meta.get('expires', 0))
+
+    def _disk_put(self, artwork, expires, changed=True):
+        """ Store an image in the disk tier and remove the least recently
+            used images beyond disk_max_bytes. Only the expiry time is
+            updated unless the image changed.
+        """
+        path = self._disk_path(artwork.uri)
+        try:
+            if changed:
+                _write_bytes(path + '.img', artwork.data)
+            cache._write_json(path + '.json', {
+                'uri': artwork.uri, 'content_type': artwork.content_type,
+                'etag': artwork.etag, 'last_modified': artwork.last_modified,
+                'expires': expires})
+            if changed:
+                self._prune_disk()
+        except OSError:
+            pass
+
+    def _prune_disk(self):
+        """ Remove the least recently used images from the disk tier until
+            it fits into disk_max_bytes.
+        """
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.img'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            for name in (path, path[:-4] + '.json'):
+                try:
+                    os.unlink(name)
+                except OSError:
+                    pass
+            total -= size
+
+    def invalidate(self, uri=None):
+        """ Remove an image, or all images, from the memory cache. """
+        with self._lock:
+            if uri is None:
+                self._entries.clear()
+                self.size = 0
+            else:
+                entry = self._entries.pop(uri, None)
+                if entry is not None:
+                    self.size -= len(entry[0].data)
+
+    def stats(self):
+        """ Return a dict with the cache's counters. """
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses, 'revalidated': self.revalidated,
+                    'coalesced': self.coalesced, 'errors': self.errors,
+                    'evictions': self.evictions, 'entries':
+                    len(self._entries), 'bytes': self.size}
+
+    def close(self):
+        """ Close the keep-alive connections. """
+        self._pool.close()
+
+
+# AlbumArtCache shared by all devices by default
+CACHE = AlbumArtCache()
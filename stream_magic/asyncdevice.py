@@ -0,0 +1,731 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains the asyncio counterpart of the device representation.
+All methods that communicate with the device are coroutines and use a
+non-blocking HTTP transport, so many devices can be controlled
+concurrently from a single event loop.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import asyncio
+import threading
+import time
+from http.client import HTTPException
+from urllib.error import HTTPError
+from . import cache
+from . import connection
+from . import device
+from . import health
+from . import registry
+
+StreamMagic = device.StreamMagic
+
+
+class AsyncStreamMagicDevice(device.StreamMagicDevice):
+    """ Representation of a DLNA Media Player (UPnP-AV renderer) device
+        for use with asyncio.
+
+        The constructor does not communicate with the device. Use the
+        create() coroutine (or "async with") to get an initialized object:
+
+            dev = await AsyncStreamMagicDevice.create(host, port,
+                                                      description, location)
+
+        Otherwise the device is set up when it is used for the first time,
+        like a lazily created StreamMagicDevice.
+    """
+
+    # the command channel sends from a thread, which doesn't work with
+    # coroutines
+    commands = None
+
+    # the circuit breaker probes the device from a thread as well; a trial
+    # request is allowed instead
+    _probe = None
+
+    def __init__(self, host, port, description, location, name='Unknown',
+                 pool_size=device.STATE_REQUESTS, timeout=2,
+                 scpd_cache=None, ssdp_headers=None,
+                 connect_timeout=None, deadline=None, retry=None,
+                 circuit_breaker=True, read_ttls=None):
+        """ Initialize instance without contacting the device. The device
+            is set up by setup(), or on first use like a lazily created
+            StreamMagicDevice.
+
+            See StreamMagicDevice for the meaning of the parameters. The
+            circuit breaker doesn't probe the device in the background;
+            a trial request is allowed when its reset timeout expired.
+        """
+        # pylint: disable=super-init-not-called
+        self.host = host
+        self.port = port
+        self.description = description
+        self.location = location
+        self._name = name
+        self._pool = connection.AsyncConnectionPool(
+            maxsize=pool_size, timeout=timeout,
+            connect_timeout=connect_timeout)
+        self.deadline = timeout if deadline is None else deadline
+        self.retry = health.RetryPolicy() if retry is None else retry
+        if circuit_breaker is True:
+            circuit_breaker = health.CircuitBreaker()
+        self.circuit_breaker = circuit_breaker or None
+        self.services = dict()
+        self.actions = registry.ActionRegistry()
+        self._scpd_cache = scpd_cache
+        self._scpd_key = self._description_key(ssdp_headers)
+        self._soap_requests = dict()
+        self.read_cache = cache.ReadCache(read_ttls)
+        self._protocol_info = None
+        self._presets = None
+        self._navigator_id = None
+        self._navigator_lock = None
+        self._materialize_lock = None
+        self._materialized = False
+        self._commands = None
+        self._commands_lock = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """ Return a new instance that has been set up already. """
+        dev = cls(*args, **kwargs)
+        await dev.setup()
+        return dev
+
+    async def setup(self):
+        """ Fetch the root service control point description XML document,
+            populate the objects data structures and query the power state.
+            Return False if the device couldn't be reached; the next call
+            will try again.
+        """
+        return await self._materialize()
+
+    async def warm_up(self):
+        """ Retrieve the data of a device that hasn't been set up yet
+            (see setup()). Return True if the device could be reached.
+            Use asyncio.ensure_future() to do this in the background.
+        """
+        return await self._materialize()
+
+    async def _materialize(self):
+        """ Retrieve the root description and the power state, unless that
+            has been done already. Return False if the device couldn't be
+            reached.
+        """
+        if self._materialized:
+            return True
+        if self._materialize_lock is None:
+            self._materialize_lock = asyncio.Lock()
+        async with self._materialize_lock:
+            if not self._materialized:
+                self._materialized = await self._load_description()
+                if self._materialized:
+                    self._pwrstate = await self.get_power_state()
+        return self._materialized
+
+    async def _load_description(self):
+        """ Populate self.services from the cached or downloaded root
+            description. Return False if it couldn't be retrieved.
+        """
+        if self._load_cached_description():
+            return True
+        response = await self._fetch_scpd(self.location)
+        if self._scpd_cache is not None and self._scpd_key is None \
+                and response is not None:
+            self._scpd_key = self._description_key(response=response)
+            if self._load_cached_description():
+                return True
+        if response is None:
+            return False
+        self._parse_root_description(self._parse_scpd(response))
+        self._store_description()
+        return True
+
+    async def __aenter__(self):
+        await self.setup()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def close(self):
+        """ Close the keep-alive connections to the device. Use aclose()
+            to release the navigator id as well.
+        """
+        self._navigator_id = None
+        super().close()
+
+    async def aclose(self):
+        """ Release the navigator id (see get_playback_details()) and close
+            the keep-alive connections to the device.
+        """
+        navigator_id, self._navigator_id = self._navigator_id, None
+        if navigator_id is not None:
+            await self._navigator_release(navigator_id)
+        self.close()
+
+    async def _get_scpd(self, scpdurl=None):
+        """ Download the SCPD XML file from the device and
+            return it as a minidom object.
+        """
+        response = await self._fetch_scpd(scpdurl)
+        start = time.perf_counter()
+        xml = self._parse_scpd(response)
+        self._record_parse('description', 'GET', start)
+        return xml
+
+    async def _fetch_scpd(self, scpdurl=None):
+        """ Download the SCPD XML file from the device and return the
+            connection.Response or None if that failed.
+        """
+        timings = dict()
+        start = time.perf_counter()
+        try:
+            scpdurl = scpdurl or self.location
+            response = await self._pool.request('GET', scpdurl,
+                                                timings=timings)
+            self._record_health(True)
+            self._record_request('description', 'GET', start, timings, None,
+                                 response)
+            if response.status != 200:
+                raise HTTPError(scpdurl, response.status, 'HTTP Error',
+                                response.headers, None)
+            return response
+        except (OSError, HTTPException, asyncio.TimeoutError) as ex:
+            if not isinstance(ex, HTTPError):
+                self._record_health(False)
+                self._record_request('description', 'GET', start, timings,
+                                     None, error=ex)
+            print("Something went wrong fetching the SCPD XML file from %s"
+                  % self.host, ex)
+        return None
+
+    async def _send_cmd(self, action, instanceId=0,
+                        service_type=StreamMagic.URN_AVTransport,
+                        omitInstanceId=False, **kwargs):
+        """ Execute an action (as specified in the SCPD XML) on the device.
+            See StreamMagicDevice._send_cmd() for the parameters.
+        """
+        cache_key = self._read_cache_key(action, instanceId, service_type,
+                                         omitInstanceId, kwargs)
+        if cache_key is not None:
+            data = self.read_cache.get(action, cache_key)
+            if data is not None:
+                return data
+        if self.circuit_breaker is not None and \
+                not self.circuit_breaker.allow():
+            return None
+        if not await self._materialize() or \
+                service_type not in self.services:
+            return None
+        ctrlUrl, soapBody, headers = self._build_request(
+            action, instanceId, service_type, omitInstanceId, kwargs)
+
+        deadline = time.monotonic() + self.deadline if self.deadline \
+            else None
+        attempts = self._attempts(action)
+        for attempt in range(attempts):
+            remaining = None if deadline is None \
+                else max(deadline - time.monotonic(), 0.001)
+            timings = dict()
+            start = time.perf_counter()
+            try:
+                response = await self._pool.request(
+                    'POST', ctrlUrl, soapBody, headers, timings, remaining)
+            except (OSError, HTTPException, asyncio.TimeoutError) as ex:
+                self._record_health(False)
+                self._record_request(service_type, action, start, timings,
+                                     soapBody, error=ex)
+                delay = self._retry_delay(attempt, attempts, deadline)
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+                continue
+            self._record_health(True)
+            self._record_request(service_type, action, start, timings,
+                                 soapBody, response)
+            if response.status != 200:
+                return None
+            if cache_key is not None:
+                self.read_cache.put(action, cache_key, response.data)
+            return response.data
+        return None
+
+    async def _update_actions(self):
+        """ Fill self.actions with the services and associated actions
+            retrieved from the SCPD XML documents.
+            Up to device.SCPD_WORKERS documents are downloaded concurrently.
+        """
+        await self._materialize()
+        if self._load_cached_description(actions_only=True):
+            return
+        semaphore = asyncio.Semaphore(device.SCPD_WORKERS)
+
+        async def fetch(service):
+            async with semaphore:
+                xml = await self._get_scpd(self.services[service]['scpdUrl'])
+            return service, self._parse_actions(service, xml)
+
+        self._merge_actions(await asyncio.gather(
+            *[fetch(service) for service in list(self.services)]))
+        self._store_description(with_actions=True)
+
+    async def _get_protocol_info(self):
+        """ Return a list of audio formats the device supports. """
+        svc_type = 'urn:schemas-upnp-org:service:ConnectionManager:1'
+        response = await self._send_cmd('GetProtocolInfo',
+                                        omitInstanceId=True,
+                                        service_type=svc_type)
+        return self._parse_protocol_info(response)
+
+    async def get_protocol_info(self):
+        """ Return a ProtocolInfo with the audio formats the device
+            supports (see StreamMagicDevice.get_protocol_info()).
+        """
+        svc_type = 'urn:schemas-upnp-org:service:ConnectionManager:1'
+        response = await self._send_cmd('GetProtocolInfo',
+                                        omitInstanceId=True,
+                                        service_type=svc_type)
+        return self._make_protocol_info(response)
+
+# Service Control Point Definition related methods
+
+    async def get_services(self, init=False):
+        """ Return the list of service types the device supports from
+            the self.actions attribute, initializing it if necessary.
+        """
+        if init or not self.actions.keys():
+            await self._update_actions()
+        return self.actions.keys()
+
+# Transport Controls related methods
+
+    async def get_mute_state(self):
+        """ Return the boolean state of the muting function of the device. """
+        svc_type = 'urn:schemas-upnp-org:service:RenderingControl:1'
+        response = await self._send_cmd('GetMute', service_type=svc_type,
+                                        Channel='Master')
+        return self._get_response_flag(response, 'CurrentMute')
+
+    async def volume_mute(self, state=True):
+        """ Mute (default) or unmute the device. """
+        svc_type = 'urn:schemas-upnp-org:service:RenderingControl:1'
+        # param order is important: Channel= before DesiredMute=
+        return await self._send_cmd('SetMute', service_type=svc_type,
+                                    Channel='Master', DesiredMute=int(state))
+
+    async def get_volume_control(self):
+        """ Return True if the device supports volume control (pre-amp mode),
+            and False otherwise.
+        """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd('GetVolumeControl',
+                                        service_type=svc_type,
+                                        omitInstanceId=True)
+        return self._get_response_flag(response, 'Enabled')
+
+    async def get_volume(self):
+        """ Return the current volume setting. """
+        svc_type = 'urn:schemas-upnp-org:service:RenderingControl:1'
+        response = await self._send_cmd('GetVolume', service_type=svc_type,
+                                        Channel='Master')
+        return self._get_response_tag_value(response, 'CurrentVolume')
+
+    async def get_volume_max(self):
+        """ Return the maximum volume setting. """
+        svc_type = 'urn:schemas-upnp-org:service:RenderingControl:1'
+        response = await self._send_cmd('GetVolumeMax', service_type=svc_type)
+        return self._get_response_tag_value(response, 'CurrentVolumeMax')
+
+    async def set_volume(self, volume):
+        """ Set the volume to the specified value. """
+        svc_type = 'urn:schemas-upnp-org:service:RenderingControl:1'
+        await self._send_cmd('SetVolume', service_type=svc_type,
+                             Channel='Master', DesiredVolume=volume)
+        return None
+
+    async def get_transport_state(self):
+        """ Return the transport state: PLAYING, STOPPED or PAUSED_PLAYBACK """
+        response = await self._send_cmd('GetTransportInfo')
+        return self._get_response_tag_value(response, 'CurrentTransportState')
+
+    async def trnsprt_pause(self):
+        """ Pause playback. """
+        return await self._send_cmd('Pause')
+
+    async def trnsprt_play(self):
+        """ Start playback (see StreamMagicDevice.trnsprt_play()). """
+        if await self.get_transport_state() != 'PLAYING':
+            return await self.trnsprt_play_pause()
+        return None
+
+    async def trnsprt_play_pause(self):
+        """ Toggle play/pause by simulating a key press. """
+        svc_type = 'urn:UuVol-com:service:UuVolSimpleRemote:1'
+        return await self._send_cmd('KeyPressed', Key='PLAY_PAUSE',
+                                    Duration='SHORT', service_type=svc_type,
+                                    omitInstanceId=True)
+
+    async def trnsprt_next(self):
+        """ Skip to next track. """
+        svc_type = 'urn:UuVol-com:service:UuVolSimpleRemote:1'
+        return await self._send_cmd('KeyPressed', Key='SKIP_NEXT',
+                                    Duration='SHORT', service_type=svc_type,
+                                    omitInstanceId=True)
+
+    async def trnsprt_prev(self, press_twice=False):
+        """ Jump to the beginning of the current track.
+            Supply press_twice=True argument to actually jump to
+            the previous track.
+        """
+        svc_type = 'urn:UuVol-com:service:UuVolSimpleRemote:1'
+        response = await self._send_cmd('KeyPressed', Key='SKIP_PREVIOUS',
+                                        Duration='SHORT',
+                                        service_type=svc_type,
+                                        omitInstanceId=True)
+        if press_twice:
+            await self.trnsprt_prev()
+        return response
+
+    async def trnsprt_stop(self):
+        """ Stop playback """
+        return await self._send_cmd('Stop')
+
+    async def trnsprt_seek(self, seek_target):
+        """ Seek to the absolute position within the track specified by
+            seek_target, e.g. seek('0:01:15').
+        """
+        await self._send_cmd('Seek', Unit='ABS_TIME', Target=seek_target)
+        return None
+
+    async def get_shuffle(self):
+        """ Return the state of the shuffle function as a boolean. """
+        svc_type = 'urn:UuVol-com:service:PlaylistExtension:1'
+        response = await self._send_cmd('Shuffle', omitInstanceId=True,
+                                        service_type=svc_type)
+        return self._get_response_flag(response, 'aShuffle')
+
+    async def set_shuffle(self, state):
+        """ Randomize playlist order.
+            Activate with state=True, deactivate with state=False.
+        """
+        svc_type = 'urn:UuVol-com:service:PlaylistExtension:1'
+        await self._send_cmd('SetShuffle', aShuffle=int(state),
+                             omitInstanceId=True, service_type=svc_type)
+        return None
+
+    async def get_repeat(self):
+        """ Return the state of the repeat function as a boolean. """
+        svc_type = 'urn:UuVol-com:service:PlaylistExtension:1'
+        response = await self._send_cmd('Repeat', omitInstanceId=True,
+                                        service_type=svc_type)
+        return self._get_response_flag(response, 'aRepeat')
+
+    async def set_repeat(self, state):
+        """ Repeat playlist after reaching the end.
+            Activate with state=True, deactivate with state=False.
+        """
+        svc_type = 'urn:UuVol-com:service:PlaylistExtension:1'
+        await self._send_cmd('SetRepeat', aRepeat=int(state),
+                             omitInstanceId=True, service_type=svc_type)
+        return None
+
+# Methods to retrieve various information from the device.
+
+    async def get_audio_source(self):
+        """ Return the currently selected audio source in lowercase
+            (i.e. "internet radio", "media player" or "other")
+        """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd('GetAudioSource',
+                                        service_type=svc_type)
+        src = self._get_response_tag_value(response, 'RetAudioSourceValue')
+        return None if src is None else src.lower()
+
+    async def get_power_state(self):
+        """ Returns the power state of the device ('on', 'off' or 'idle'). """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd('GetPowerState',
+                                        service_type=svc_type)
+        if response:
+            pwstate = self._get_response_tag_value(response,
+                                                   'RetPowerStateValue')
+            return str(pwstate).lower()
+        return None
+
+    async def get_current_track_info(self):
+        """ Return a dict with meta data for the currently playing track
+            (see StreamMagicDevice.get_current_track_info()).
+        """
+        if await self.get_audio_source() == "media player":
+            return self._parse_track_info(
+                await self._send_cmd('GetPositionInfo'))
+        return self._parse_track_info(None)
+
+    async def get_position_info(self):
+        """ Return a dict with the position info of the current track
+            (see StreamMagicDevice.get_position_info()).
+        """
+        return self._parse_position_info(
+            await self._send_cmd('GetPositionInfo'))
+
+    async def get_album_art(self, uri=None):
+        """ Return an artwork.Artwork with the album art of the current
+            track (see StreamMagicDevice.get_album_art()). The image is
+            fetched in the event loop's default executor.
+        """
+        if uri is None:
+            uri = (await self.get_current_track_info())['albumArtURI']
+        url = self._album_art_url(uri)
+        if url is None:
+            return None
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.album_art_cache.get, url)
+
+    @staticmethod
+    async def _timed_call(func, *args):
+        """ Return (result, time received) for a call, with result being
+            None if the response couldn't be parsed.
+        """
+        try:
+            value = await func(*args)
+        except device.PARSE_ERRORS:
+            value = None
+        return value, time.time()
+
+    async def get_state(self):
+        """ Return a DeviceState snapshot of the device
+            (see StreamMagicDevice.get_state()).
+        """
+        semaphore = asyncio.Semaphore(max(1, self._pool.maxsize))
+
+        async def call(func, *args):
+            async with semaphore:
+                return await self._timed_call(func, *args)
+
+        getters = self._state_getters()
+        results = await asyncio.gather(
+            *[call(getter) for _, getter in getters],
+            call(self._send_cmd, 'GetPositionInfo'))
+        return self._make_state(
+            {field: result for (field, _), result in zip(getters, results)},
+            results[-1])
+
+# Functions related to using a Navigator ID
+
+    async def _navigator_register(self):
+        """ Register a navigator_id at the device and return the value,
+            or None if that failed.
+        """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd('RegisterNavigator',
+                                        service_type=svc_type)
+        if response is None:
+            return None
+        return self._get_response_tag_value(response, 'RetNavigatorId')
+
+    async def _lease_navigator(self, expired=None):
+        """ Return the navigator id leased by this object, registering one
+            if there is none yet or the current one is the expired id.
+        """
+        if self._navigator_lock is None:
+            self._navigator_lock = asyncio.Lock()
+        async with self._navigator_lock:
+            if self._navigator_id is None or self._navigator_id == expired:
+                self._navigator_id = await self._navigator_register()
+            return self._navigator_id
+
+    async def _navigator_release(self, navigator_id):
+        """ Release (=invalidate) the specified navigator_id. """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        await self._send_cmd('ReleaseNavigator',
+                             NavigatorId=navigator_id,
+                             omitInstanceId=True,
+                             service_type=svc_type)
+
+    async def _navigator_is_registered(self, navigator_id):
+        """ Check if the specified navigator_id is registered at the device.
+            Return None if the device didn't answer.
+        """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd('IsRegisteredNavigatorId',
+                                        NavigatorId=navigator_id,
+                                        omitInstanceId=True,
+                                        service_type=svc_type)
+        if response is None:
+            return None
+        return self._get_response_tag_value(
+            response, 'IsRegistered').lower() in ('1', 'true')
+
+    async def _set_av_transport_uri(self, uri):
+        """ Set current playback URI (media file, playlist, etc) """
+        response = await self._send_cmd('SetAVTransportURI',
+                                        CurrentURI=uri, CurrentURIMetaData='')
+        return self._get_response_tag_value(response, 'IsRegistered')
+
+    async def _get_number_of_presets(self):
+        """ query the number of supported presets from the device """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd('GetNumberOfPresets',
+                                        service_type=svc_type)
+        return self._get_response_tag_value(response,
+                                            'RetNumberOfPresetsValue')
+
+    async def _get_presets(self, start, end):
+        """ Return the presets start to end in the format of
+            get_preset_list(), or None if the device didn't respond.
+        """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd(
+            'GetPresetList', Start=str(start), End=str(end),
+            omitInstanceId=True, service_type=svc_type)
+        return self._parse_preset_list(response)
+
+    async def _load_presets(self, count):
+        """ Retrieve the count presets in pages of device.PRESET_PAGE_SIZE,
+            all pages concurrently, and store them in the preset cache.
+            Return the PresetTable, or None if the device didn't respond.
+        """
+        pages = await asyncio.gather(*[
+            self._get_presets(start,
+                              min(start + device.PRESET_PAGE_SIZE - 1, count))
+            for start in range(1, count + 1, device.PRESET_PAGE_SIZE)])
+        if None in pages:
+            return None
+        self._presets = device.PresetTable(
+            count, [preset for page in pages for preset in page])
+        return self._presets
+
+    async def get_preset_list(self, refresh=False):
+        """ Get the list of internet radio station presets
+            (see StreamMagicDevice.get_preset_list()).
+        """
+        table = await self._preset_table(refresh)
+        return None if table is None else table.as_list()
+
+    async def _preset_table(self, refresh=False):
+        """ Return the cached PresetTable, retrieving the presets first if
+            refresh is True, none are cached or their number changed.
+        """
+        if refresh:
+            self.read_cache.invalidate('GetNumberOfPresets')
+        count = await self._get_number_of_presets()
+        if count is None:
+            return None
+        count = int(count)
+        table = self._presets
+        if refresh or table is None or table.count != count:
+            table = await self._load_presets(count)
+        return table
+
+    async def get_current_preset(self):
+        """ Return the id and name for the current preset - or None if n/a.
+            (see StreamMagicDevice.get_current_preset()).
+        """
+        table = await self._preset_table()
+        if table is None or table.playing is None:
+            return None
+        page = await self._get_presets(table.playing, table.playing)
+        if not page:
+            return None
+        if page[0][0] == table.playing and page[0][2]:
+            return table.find(table.playing)
+        table.playing = None
+        return None
+
+    async def find_preset(self, preset):
+        """ Return the number and name of a preset specified by number or
+            name - or None if n/a (see StreamMagicDevice.find_preset()).
+        """
+        table = await self._preset_table()
+        return None if table is None else table.find(preset)
+
+    async def play_preset(self, num):
+        """ Start playing the preset with the specified id """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        await self._send_cmd('PlayPreset', NewPresetNumberValue=num,
+                             omitInstanceId=True, service_type=svc_type)
+        if self._presets is not None:
+            self._presets.playing = str(num)
+        return None
+
+    async def get_playback_details(self):
+        """ Return a dict with details for the currently playing Stream
+            (see StreamMagicDevice.get_playback_details()).
+        """
+        # if the device is not 'on', don't try to retrieve any data
+        if not await self._materialize() or self._pwrstate != 'on':
+            return None
+
+        nid = await self._lease_navigator()
+        response = await self._get_playback_details(nid)
+        if response is None and nid is not None \
+                and await self._navigator_is_registered(nid) is False:
+            nid = await self._lease_navigator(expired=nid)
+            response = await self._get_playback_details(nid)
+
+        try:
+            details = self._parse_playback_details(response)
+        except device.PARSE_ERRORS:
+            details = None
+        if details is None or not details['state']:
+            if await self.get_transport_state() == 'TRANSITIONING':
+                return {'state': '', 'format': '', 'artist': '', 'stream': ''}
+        return details
+
+    async def _get_playback_details(self, navigator_id):
+        """ Return the GetPlaybackDetails response or None. """
+        if navigator_id is None:
+            return None
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        return await self._send_cmd('GetPlaybackDetails',
+                                    NavigatorId=navigator_id,
+                                    omitInstanceId=True,
+                                    service_type=svc_type)
+
+# Misc methods
+
+    async def power_on(self):
+        """ Power on the device.
+            Only works if device is set to Network standby mode (not ECO).
+        """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd('SetPowerState',
+                                        NewPowerStateValue='ON',
+                                        service_type=svc_type,
+                                        omitInstanceId=True)
+        self._pwrstate = 'on'
+        return response
+
+    async def power_off(self, power_state='OFF'):
+        """ Power off the device. """
+        if power_state not in ['OFF', 'IDLE']:
+            return None
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = await self._send_cmd('SetPowerState',
+                                        NewPowerStateValue=power_state,
+                                        service_type=svc_type,
+                                        omitInstanceId=True)
+        self._pwrstate = power_state.lower()
+        return response
+
+    async def send_event_request(self, method, service_type, headers):
+        """ Send a GENA request to the event url of a service
+            (see StreamMagicDevice.send_event_request()).
+        """
+        if not await self._materialize():
+            return None
+        url = self.services.get(service_type, {}).get('eventUrl')
+        if url is None:
+            return None
+        try:
+            response = await self._pool.request(method, url, None, headers)
+        except (OSError, HTTPException, asyncio.TimeoutError):
+            return None
+        return response if response.status == 200 else None
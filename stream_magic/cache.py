@@ -0,0 +1,289 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains persistent on-disk caches that allow skipping
+network round trips when a program starts up, and an in-memory cache of
+responses to actions whose results rarely change.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+
+
+# Number of seconds the responses to these actions are cached by
+# StreamMagicDevice (see ReadCache)
+READ_TTLS = {'GetVolumeMax': 3600,
+             'GetProtocolInfo': 3600,
+             'GetVolumeControl': 60,
+             'GetNumberOfPresets': 30}
+
+
+def default_cache_dir():
+    """ Return the directory used for cache files by default. """
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'stream_magic')
+
+
+def _read_json(path):
+    """ Return the decoded contents of a JSON file or None if it can't
+        be read.
+    """
+    try:
+        with open(path, encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    """ Atomically replace the file at path with the JSON encoded data. """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            json.dump(data, tmp_file, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class DiscoveryCache:
+    """ Persistent cache of SSDP discovery results.
+
+        Entries are stored with an expiry time derived from the
+        max-age of the device's CACHE-CONTROL header and are validated
+        with a cheap unicast request for the cached location before they
+        are used.
+
+        path: cache file, defaults to discovery.json in default_cache_dir()
+        probe_timeout: timeout in seconds for validating an entry
+    """
+
+    DEFAULT_MAX_AGE = 1800
+
+    def __init__(self, path=None, probe_timeout=0.5):
+        """ Initialize instance. """
+        self.path = path or os.path.join(default_cache_dir(),
+                                         'discovery.json')
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(addr, data):
+        """ Return the cache key for a device: its USN or address. """
+        return data.get('usn') or '%s:%d' % tuple(addr[0:2])
+
+    def _load(self):
+        """ Return the cache file's entries. """
+        entries = _read_json(self.path)
+        return entries if isinstance(entries, dict) else dict()
+
+    def store(self, devices, now=None):
+        """ Add the (addr, data) tuples returned by discovery to the
+            cache.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entries = self._load()
+            for addr, data in devices:
+                match = re.search(r'max-age\s*=\s*(\d+)',
+                                  data.get('cache-control', ''))
+                max_age = int(match.group(1)) if match \
+                    else self.DEFAULT_MAX_AGE
+                entries[self._key(addr, data)] = {
+                    'addr': list(addr[0:2]),
+                    'data': data,
+                    'expires': now + max_age}
+            _write_json(self.path, entries)
+
+    def invalidate(self, addr=None, data=None):
+        """ Remove a device from the cache, or all devices if no device
+            is specified.
+        """
+        with self._lock:
+            entries = self._load()
+            if addr is None:
+                entries.clear()
+            else:
+                entries.pop(self._key(addr, data or dict()), None)
+            _write_json(self.path, entries)
+
+    def get(self, host=None, now=None):
+        """ Return a list of the unexpired (addr, data) tuples in the cache,
+            optionally limited to the specified host.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entries = self._load()
+        return [(tuple(entry['addr']), entry['data'])
+                for entry in entries.values()
+                if entry['expires'] > now
+                and (host is None or entry['addr'][0] == host)]
+
+    def probe(self, data):
+        """ Return True if the device's root description can be fetched
+            from the cached location.
+        """
+        try:
+            with urllib.request.urlopen(data['location'],
+                                        timeout=self.probe_timeout) as resp:
+                return resp.status == 200
+        except (OSError, KeyError, ValueError):
+            return False
+
+    def lookup(self, host=None, count=None):
+        """ Return the cached devices if they can be used instead of a
+            network discovery, and None otherwise.
+
+            Cached devices are only used if there are any (or the requested
+            host is among them, or at least count devices are cached) and
+            all of them answer a probe. Entries failing the probe are
+            removed from the cache.
+        """
+        devices = self.get(host)
+        if not devices or (count and len(devices) < count):
+            return None
+        if count:
+            devices = devices[:count]
+        for addr, data in devices:
+            if not self.probe(data):
+                self.invalidate(addr, data)
+                return None
+        return devices
+
+
+class DescriptionCache:
+    """ Persistent, content-addressed cache of the parsed service
+        descriptions (root description and service SCPD documents) of
+        devices.
+
+        Entries are keyed by the location url plus either the device's
+        UDN, BOOTID.UPNP.ORG and CONFIGID.UPNP.ORG values from the SSDP
+        headers (for devices that send them) or the ETag / content of the
+        root description, so a firmware update results in a new entry. They are stored as
+        compact JSON documents, one file per entry.
+
+        directory: cache directory, defaults to scpd/ in default_cache_dir()
+    """
+
+    def __init__(self, directory=None):
+        """ Initialize instance. """
+        self.directory = directory or os.path.join(default_cache_dir(),
+                                                   'scpd')
+
+    @staticmethod
+    def key(location, udn=None, bootid=None, configid=None, etag=None,
+            content=None):
+        """ Return the cache key for a device description. """
+        digest = hashlib.sha1(location.encode('utf-8'))
+        for part in (udn, bootid, configid, etag):
+            digest.update(b'\0' + str(part or '').encode('utf-8'))
+        if content is not None:
+            digest.update(b'\0' + content)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        """ Return the file name for a cache key. """
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """ Return the cached (services, actions) tuple for the key, with
+            actions being None if no actions were stored, or None if the
+            key is not cached. Both are in the format used by
+            StreamMagicDevice.services and StreamMagicDevice.actions.
+        """
+        entry = _read_json(self._path(key))
+        if not isinstance(entry, dict) or 'services' not in entry:
+            return None
+        actions = entry.get('actions')
+        if actions is not None:
+            actions = {
+                service: {
+                    action: {argument: {'direction': direction,
+                                        'relatedStateVariable': rsv,
+                                        'dataType': None}
+                             for argument, direction, rsv in arguments}
+                    for action, arguments in service_actions.items()}
+                for service, service_actions in actions.items()}
+        return entry['services'], actions
+
+    def put(self, key, services, actions=None):
+        """ Store the services map and (optionally) the actions table for
+            the key. Arguments are stored as [name, direction,
+            relatedStateVariable] lists.
+        """
+        entry = {'services': services}
+        if actions is not None:
+            entry['actions'] = {
+                service: {
+                    action: [[argument, info['direction'],
+                              info['relatedStateVariable']]
+                             for argument, info in arguments.items()]
+                    for action, arguments in service_actions.items()}
+                for service, service_actions in actions.items()}
+        _write_json(self._path(key), entry)
+
+
+class ReadCache:
+    """ In-memory cache of responses to actions that only read values
+        which rarely change, each with its own time to live.
+
+        ttls: {action: seconds} dict; responses to other actions are not
+              cached
+    """
+
+    def __init__(self, ttls=None):
+        """ Initialize instance. """
+        self.ttls = dict(READ_TTLS if ttls is None else ttls)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = dict()  # {action: {key: (expiry, value)}}
+
+    def get(self, action, key, now=None):
+        """ Return the cached value for an action call (identified by key,
+            e.g. its arguments), or None if it isn't cached or expired.
+        """
+        if action not in self.ttls:
+            return None
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(action, {}).get(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, action, key, value, now=None):
+        """ Cache the value for an action call, if the action has a TTL.
+            None values are not cached.
+        """
+        ttl = self.ttls.get(action)
+        if not ttl or value is None:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._entries.setdefault(action, dict())[key] = (now + ttl,
+                                                             value)
+
+    def invalidate(self, action=None):
+        """ Remove the cached values of an action, or all of them. """
+        with self._lock:
+            if action is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(action, None)
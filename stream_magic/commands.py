@@ -0,0 +1,156 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains a command channel for setters that are called in
+quick succession, e.g. from a volume slider: a command that hasn't been
+sent yet is replaced by a newer one of the same kind, so the device only
+receives the latest value instead of a growing backlog.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class CommandChannel:
+    """ Send commands to a StreamMagicDevice from a background thread, one
+        at a time. Commands with the same key supersede each other: while a
+        command is in flight, only the latest of the commands queued after
+        it is sent.
+
+        min_interval: minimum number of seconds between two commands with
+                      the same key
+    """
+
+    def __init__(self, device, min_interval=0.1):
+        """ Initialize instance. """
+        self.device = device
+        self.min_interval = min_interval
+        self.sent = 0           # number of commands sent
+        self.coalesced = 0      # number of commands replaced by newer ones
+        self._pending = OrderedDict()  # {key: (method, args, [futures])}
+        self._last_sent = dict()       # {key: time.monotonic()}
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, key, method, *args):
+        """ Queue a call of the device method with the given name, replacing
+            a queued command with the same key. Return a Future for the
+            result of the call that was sent eventually.
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("CommandChannel is closed")
+            futures = [future]
+            if key in self._pending:
+                futures = self._pending.pop(key)[2] + futures
+                self.coalesced += 1
+            self._pending[key] = (method, args, futures)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name='CommandChannel')
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def set_volume(self, volume):
+        """ Queue device.set_volume(). """
+        return self.submit('volume', 'set_volume', volume)
+
+    def volume_mute(self, state=True):
+        """ Queue device.volume_mute(). """
+        return self.submit('mute', 'volume_mute', state)
+
+    def trnsprt_seek(self, seek_target):
+        """ Queue device.trnsprt_seek(). """
+        return self.submit('seek', 'trnsprt_seek', seek_target)
+
+    def pending(self):
+        """ Return the keys of the commands waiting to be sent. """
+        with self._cond:
+            return list(self._pending)
+
+    def flush(self, timeout=None):
+        """ Wait until all queued commands were sent. Return False if the
+            timeout (in seconds) expired before.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                wait = None if deadline is None \
+                    else deadline - time.monotonic()
+                if wait is not None and wait <= 0:
+                    return False
+                self._cond.wait(wait)
+        return True
+
+    def close(self, flush=True):
+        """ Stop the channel, after sending the queued commands unless flush
+            is False (their futures are cancelled then).
+        """
+        if flush:
+            self.flush()
+        with self._cond:
+            self._closed = True
+            for _, _, futures in self._pending.values():
+                for future in futures:
+                    future.cancel()
+            self._pending.clear()
+            self._cond.notify_all()
+        if self._thread is not None and \
+                self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+
+    def _next(self):
+        """ Wait for a command that may be sent and return (key, method,
+            args, futures), or None when the channel was closed.
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                now = time.monotonic()
+                wait = None
+                for key in self._pending:
+                    due = self._last_sent.get(key, now - self.min_interval) \
+                        + self.min_interval
+                    if due <= now:
+                        method, args, futures = self._pending.pop(key)
+                        self._busy = True
+                        return key, method, args, futures
+                    wait = due - now if wait is None else min(wait, due - now)
+                self._cond.wait(wait)
+
+    def _run(self):
+        """ Send the queued commands until the channel is closed. """
+        while True:
+            command = self._next()
+            if command is None:
+                return
+            key, method, args, futures = command
+            try:
+                result = getattr(self.device, method)(*args)
+                error = None
+            except Exception as err:  # pylint: disable=broad-except
+                error = err
+            with self._cond:
+                self._last_sent[key] = time.monotonic()
+                self._busy = False
+                self.sent += 1
+                self._cond.notify_all()
+            for future in futures:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
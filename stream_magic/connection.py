@@ -0,0 +1,463 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains small pools of persistent (keep-alive) HTTP/1.1
+connections that are used to send requests to a device, for blocking
+(ConnectionPool) as well as for asyncio based code (AsyncConnectionPool).
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import asyncio
+import http.client
+import io
+import socket
+import ssl
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+# Result of a request: HTTP status code, response headers and body bytes
+Response = namedtuple('Response', ['status', 'headers', 'data'])
+
+# Exceptions indicating that the device closed an idle keep-alive
+# connection. Requests failing with one of those on a reused connection
+# are repeated once on a fresh connection.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+                           http.client.BadStatusLine,
+                           ConnectionResetError,
+                           ConnectionAbortedError,
+                           BrokenPipeError)
+
+# Exceptions indicating that a request timed out
+TIMEOUT_ERRORS = (socket.timeout, asyncio.TimeoutError)
+
+# Default ports of the supported URL schemes
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _split_url(url):
+    """ Return (scheme, host, port, path) of a URL.
+        Raises ValueError if the scheme isn't http or https.
+    """
+    url = urlparse(url)
+    if url.scheme not in DEFAULT_PORTS:
+        raise ValueError("Unsupported URL scheme: %r" % url.scheme)
+    path = url.path or '/'
+    if url.query:
+        path += '?' + url.query
+    return url.scheme, url.hostname, url.port or DEFAULT_PORTS[url.scheme], \
+        path
+
+
+class _Connection(http.client.HTTPConnection):
+    """ HTTP(S) connection that uses the pool's address cache to connect. """
+
+    def __init__(self, pool, scheme, host, port, timeout):
+        super().__init__(host, port, timeout=timeout)
+        self._pool = pool
+        self.scheme = scheme
+        self.reused = False
+
+    def connect(self):
+        """ Connect to the (cached) address of the host. """
+        self.sock = self._pool._create_socket(self.host, self.port,
+                                              self.timeout)
+        if self.scheme == 'https':
+            self.sock = self._pool.ssl_context.wrap_socket(
+                self.sock, server_hostname=self.host)
+
+
+class ConnectionPool:
+    """ A pool of persistent HTTP and HTTPS connections per host and port.
+
+        maxsize: number of idle connections kept open per host and port
+        timeout: socket timeout in seconds for reading (and connecting,
+                 unless connect_timeout is specified)
+        dns_ttl: number of seconds a resolved address is cached
+        connect_timeout: timeout in seconds for connecting
+        ssl_context: ssl.SSLContext for https URLs; defaults to
+                     ssl.create_default_context()
+    """
+
+    def __init__(self, maxsize=1, timeout=2, dns_ttl=300,
+                 connect_timeout=None, ssl_context=None):
+        """ Initialize instance. """
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = timeout if connect_timeout is None \
+            else connect_timeout
+        self._ssl_context = ssl_context
+        self._lock = threading.Lock()
+        self._idle = dict()       # {(scheme, host, port): [connection, ...]}
+        self._addresses = dict()  # {(host, port): (expiry, [sockaddr, ...])}
+
+    def _resolve(self, host, port):
+        """ Return the list of socket addresses for host and port,
+            served from the address cache if possible.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._addresses.get((host, port))
+        if cached and cached[0] > now:
+            return cached[1]
+
+        addresses = [(family, sockaddr) for family, _, _, _, sockaddr
+                     in socket.getaddrinfo(host, port, 0,
+                                           socket.SOCK_STREAM)]
+        with self._lock:
+            self._addresses[(host, port)] = (now + self.dns_ttl, addresses)
+        return addresses
+
+    def _create_socket(self, host, port, timeout):
+        """ Open a TCP connection to host and port. If connecting to the
+            cached addresses fails, resolve the host name again once.
+        """
+        for attempt in range(2):
+            error = None
+            for family, sockaddr in self._resolve(host, port):
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.settimeout(timeout)
+                try:
+                    sock.connect(sockaddr)
+                except OSError as ex:
+                    sock.close()
+                    error = ex
+                    continue
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return sock
+            with self._lock:
+                self._addresses.pop((host, port), None)
+            if attempt or error is None:
+                break
+        raise error or OSError("No address found for %s" % host)
+
+    @property
+    def ssl_context(self):
+        """ Return the ssl.SSLContext used for https URLs. """
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    def _get_connection(self, scheme, host, port):
+        """ Return an idle connection to host and port or a new one. """
+        with self._lock:
+            idle = self._idle.get((scheme, host, port))
+            if idle:
+                conn = idle.pop()
+                conn.reused = True
+                return conn
+        return _Connection(self, scheme, host, port, self.timeout)
+
+    def _release_connection(self, conn):
+        """ Put a connection back into the pool or close it if the
+            pool for its host and port is full.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(
+                (conn.scheme, conn.host, conn.port), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, timings=None,
+                timeout=None):
+        """ Send a request to the specified URL and return a Response.
+
+            Raises OSError (including socket.timeout) or
+            http.client.HTTPException if the request could not be completed,
+            or ValueError if the scheme of the URL isn't http or https.
+
+            timings: optional dict that is filled with the seconds spent
+                     connecting ('connect'), sending the request ('request')
+                     and waiting for and reading the response ('response')
+            timeout: optional limit in seconds for the connect and read
+                     timeouts, e.g. the time left until a deadline
+        """
+        scheme, host, port, path = _split_url(url)
+        connect_timeout = self.connect_timeout
+        read_timeout = self.timeout
+        if timeout is not None:
+            connect_timeout = min(connect_timeout, timeout)
+            read_timeout = min(read_timeout, timeout)
+
+        while True:
+            conn = self._get_connection(scheme, host, port)
+            try:
+                start = time.perf_counter()
+                if conn.sock is None:
+                    conn.timeout = connect_timeout
+                    conn.connect()
+                conn.sock.settimeout(read_timeout)
+                connected = time.perf_counter()
+                conn.request(method, path, body, headers or {})
+                sent = time.perf_counter()
+                response = conn.getresponse()
+                data = response.read()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if conn.reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+
+            if timings is not None:
+                timings['connect'] = connected - start
+                timings['request'] = sent - connected
+                timings['response'] = time.perf_counter() - sent
+            if response.will_close:
+                conn.close()
+            else:
+                self._release_connection(conn)
+            return Response(response.status, response.headers, data)
+
+    def close(self):
+        """ Close all idle connections. """
+        with self._lock:
+            idle, self._idle = self._idle, dict()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class _AsyncConnection:
+    """ A keep-alive HTTP/1.1 connection based on asyncio streams. """
+
+    def __init__(self, scheme, host, port, reader, writer):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+
+    async def request(self, method, path, body, headers, timings=None):
+        """ Send a request and return (status, headers, data, will_close).
+            The seconds spent sending it are stored in timings['request'].
+        """
+        start = time.perf_counter()
+        lines = ['%s %s HTTP/1.1' % (method, path)]
+        names = {name.lower() for name in headers}
+        if 'host' not in names:
+            lines.append('Host: %s:%d' % (self.host, self.port))
+        if body is not None and 'content-length' not in names:
+            lines.append('Content-Length: %d' % len(body))
+        lines.extend('%s: %s' % item for item in headers.items())
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+                          + (body or b''))
+        await self.writer.drain()
+        if timings is not None:
+            timings['request'] = time.perf_counter() - start
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected(
+                "Remote end closed connection without response")
+        try:
+            version, status = status_line.decode('latin-1').split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise http.client.BadStatusLine(status_line)
+
+        raw_headers = []
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            raw_headers.append(line)
+        msg = http.client.parse_headers(
+            io.BytesIO(b''.join(raw_headers) + b'\r\n'))
+
+        will_close = version == 'HTTP/1.0' or \
+            msg.get('connection', '').lower() == 'close'
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            data = b''
+        elif msg.get('transfer-encoding', '').lower() == 'chunked':
+            data = await self._read_chunked()
+        elif msg.get('content-length') is not None:
+            data = await self.reader.readexactly(int(msg['content-length']))
+        else:
+            data = await self.reader.read()
+            will_close = True
+        return status, msg, data, will_close
+
+    async def _read_chunked(self):
+        """ Read a body sent with chunked transfer encoding. """
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                break
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+        # skip trailers
+        while (await self.reader.readline()) not in (b'\r\n', b''):
+            pass
+        return b''.join(chunks)
+
+    def close(self):
+        """ Close the connection. """
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+    """ A pool of persistent HTTP and HTTPS connections per host and port
+        for use with asyncio. Mirrors ConnectionPool, but request() is a
+        coroutine.
+
+        maxsize: number of idle connections kept open per host and port
+        timeout: timeout in seconds for a complete request
+        dns_ttl: number of seconds a resolved address is cached
+        connect_timeout: timeout in seconds for connecting
+        ssl_context: ssl.SSLContext for https URLs; defaults to
+                     ssl.create_default_context()
+    """
+
+    def __init__(self, maxsize=1, timeout=2, dns_ttl=300,
+                 connect_timeout=None, ssl_context=None):
+        """ Initialize instance. """
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = timeout if connect_timeout is None \
+            else connect_timeout
+        self._ssl_context = ssl_context
+        self._idle = dict()       # {(scheme, host, port): [connection, ...]}
+        self._addresses = dict()  # {(host, port): (expiry, [address, ...])}
+
+    async def _resolve(self, host, port):
+        """ Return the list of ip addresses for host and port,
+            served from the address cache if possible.
+        """
+        now = time.monotonic()
+        cached = self._addresses.get((host, port))
+        if cached and cached[0] > now:
+            return cached[1]
+
+        loop = asyncio.get_event_loop()
+        addresses = [sockaddr[0] for _, _, _, _, sockaddr
+                     in await loop.getaddrinfo(host, port,
+                                               type=socket.SOCK_STREAM)]
+        self._addresses[(host, port)] = (now + self.dns_ttl, addresses)
+        return addresses
+
+    @property
+    def ssl_context(self):
+        """ Return the ssl.SSLContext used for https URLs. """
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    async def _connect(self, scheme, host, port):
+        """ Open a new connection to host and port. If connecting to the
+            cached addresses fails, resolve the host name again once.
+        """
+        tls = dict()
+        if scheme == 'https':
+            tls = dict(ssl=self.ssl_context, server_hostname=host)
+        for attempt in range(2):
+            error = None
+            for address in await self._resolve(host, port):
+                try:
+                    reader, writer = await asyncio.open_connection(
+                        address, port, **tls)
+                except ssl.SSLError:
+                    # another address won't have another certificate
+                    raise
+                except OSError as ex:
+                    error = ex
+                    continue
+                return _AsyncConnection(scheme, host, port, reader, writer)
+            self._addresses.pop((host, port), None)
+            if attempt or error is None:
+                break
+        raise error or OSError("No address found for %s" % host)
+
+    async def _get_connection(self, scheme, host, port):
+        """ Return an idle connection to host and port or a new one. """
+        idle = self._idle.get((scheme, host, port))
+        while idle:
+            conn = idle.pop()
+            if conn.reader.at_eof():
+                conn.close()
+                continue
+            conn.reused = True
+            return conn
+        return await self._connect(scheme, host, port)
+
+    def _release_connection(self, conn):
+        """ Put a connection back into the pool or close it if the
+            pool for its host and port is full.
+        """
+        idle = self._idle.setdefault((conn.scheme, conn.host, conn.port),
+                                     [])
+        if len(idle) < self.maxsize:
+            idle.append(conn)
+        else:
+            conn.close()
+
+    async def request(self, method, url, body=None, headers=None,
+                      timings=None, timeout=None):
+        """ Send a request to the specified URL and return a Response.
+
+            Raises OSError, asyncio.TimeoutError or
+            http.client.HTTPException if the request could not be completed,
+            or ValueError if the scheme of the URL isn't http or https.
+
+            timings: see ConnectionPool.request()
+            timeout: optional limit in seconds for the complete request,
+                     e.g. the time left until a deadline
+        """
+        if timeout is not None:
+            timeout = min(timeout, self.timeout)
+        return await asyncio.wait_for(
+            self._request(method, url, body, headers, timings),
+            self.timeout if timeout is None else timeout)
+
+    async def _request(self, method, url, body, headers, timings):
+        """ Send a request, see request(). """
+        scheme, host, port, path = _split_url(url)
+
+        while True:
+            start = time.perf_counter()
+            conn = await asyncio.wait_for(
+                self._get_connection(scheme, host, port),
+                self.connect_timeout)
+            connected = time.perf_counter()
+            parts = dict()
+            try:
+                status, msg, data, will_close = await conn.request(
+                    method, path, body, headers or {}, parts)
+            except STALE_CONNECTION_ERRORS + (asyncio.IncompleteReadError,):
+                conn.close()
+                if conn.reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+
+            if timings is not None:
+                timings['connect'] = connected - start
+                timings['request'] = parts['request']
+                timings['response'] = time.perf_counter() - connected - \
+                    parts['request']
+            if will_close:
+                conn.close()
+            else:
+                self._release_connection(conn)
+            return Response(status, msg, data)
+
+    def close(self):
+        """ Close all idle connections. """
+        idle, self._idle = self._idle, dict()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
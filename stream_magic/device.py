@@ -14,14 +14,137 @@ information from the device as well as control the device.
 __version__ = '0.16'
 __author__ = 'Sebastian Kaps (sebk-666)'
 
-import urllib.request
-from urllib.parse import urlparse
-from urllib.error import HTTPError, URLError
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from types import MappingProxyType
+from urllib.parse import urljoin, urlparse
+from urllib.error import HTTPError
 from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+from . import artwork
+from . import cache
+from . import commands
+from . import connection
 from . import discovery
+from . import health
+from . import metrics
+from . import parser
+from . import registry
+from . import soap
 
 StreamMagic = discovery.StreamMagic()
 
+# Errors raised when parsing a missing or malformed response
+PARSE_ERRORS = (TypeError, ValueError, AttributeError, IndexError, KeyError,
+                ExpatError)
+
+# Snapshot of a device's state as returned by get_state(). track_info and
+# timestamps (the time.time() each field's value was received) are
+# read-only mappings. Fields that couldn't be retrieved are None.
+DeviceState = namedtuple('DeviceState', [
+    'power_state', 'transport_state', 'volume', 'mute', 'audio_source',
+    'shuffle', 'repeat', 'track_info', 'timestamps'])
+
+# Maximum number of SCPD documents downloaded concurrently
+SCPD_WORKERS = 4
+
+# Number of presets retrieved with one GetPresetList request
+PRESET_PAGE_SIZE = 20
+
+# Number of requests sent by get_state()
+STATE_REQUESTS = 8
+
+# Codec names of mime types found in protocol info entries; other mime
+# types are named after their subtype, without an 'x-' prefix
+CODECS = {'audio/mpeg': 'mp3', 'audio/mp3': 'mp3', 'audio/mp4': 'aac',
+          'audio/x-m4a': 'aac', 'audio/l16': 'pcm', 'audio/wave': 'wav',
+          'audio/x-ms-wma': 'wma', 'audio/ogg': 'vorbis',
+          'application/ogg': 'vorbis'}
+
+
+def codec_name(mime_type):
+    """ Return the codec name for a (lowercase) mime type. """
+    codec = CODECS.get(mime_type)
+    if codec is None:
+        codec = mime_type.partition('/')[2]
+        if codec.startswith('x-'):
+            codec = codec[2:]
+    return codec
+
+
+class PresetTable:
+    """ The preset names of a device, indexed by number and by name.
+
+        count: number of presets reported by the device
+        presets: [number, name, playing] lists as returned by
+                 StreamMagicDevice.get_preset_list()
+    """
+
+    __slots__ = ('count', 'names', 'numbers', 'playing')
+
+    def __init__(self, count, presets):
+        """ Initialize instance. """
+        self.count = count
+        self.names = dict()    # {number: name}
+        self.numbers = dict()  # {name: number}
+        self.playing = None    # number of the playing preset
+        for num, name, playing in presets:
+            self.names[num] = name
+            self.numbers.setdefault(name, num)
+            if playing:
+                self.playing = num
+
+    def as_list(self):
+        """ Return the presets in the format of get_preset_list(). """
+        return [[num, name, num == self.playing]
+                for num, name in self.names.items()]
+
+    def find(self, preset):
+        """ Return a {'num': ..., 'name': ...} dict for a preset number or
+            name, or None if there's no such preset.
+        """
+        num = str(preset)
+        if num not in self.names:
+            num = self.numbers.get(preset)
+            if num is None:
+                return None
+        return {'num': num, 'name': self.names[num]}
+
+
+class ProtocolInfo:
+    """ The audio formats a device can play, indexed by mime type and by
+        codec name, so checks like 'audio/flac' in info or 'flac' in info
+        don't need to scan the list.
+
+        protocols: protocol info entries as returned by the device, e.g.
+                   'http-get:*:audio/flac:*'
+    """
+
+    __slots__ = ('protocols', 'mime_types', 'codecs')
+
+    def __init__(self, protocols):
+        """ Initialize instance. """
+        self.protocols = tuple(protocols)
+        mime_types = set()
+        for entry in self.protocols:
+            fields = entry.strip().split(':')
+            if len(fields) > 2:
+                mime_types.add(fields[2].partition(';')[0].strip().lower())
+        mime_types.discard('')
+        self.mime_types = frozenset(mime_types)
+        self.codecs = frozenset(codec_name(mime) for mime in mime_types)
+
+    def __contains__(self, audio_format):
+        audio_format = audio_format.lower()
+        return audio_format in self.mime_types or audio_format in self.codecs
+
+    def __len__(self):
+        return len(self.protocols)
+
 
 class StreamMagicDevice:
     """ Representation of a DLNA Media Player (UPnP-AV renderer) device.
@@ -35,52 +158,199 @@ class StreamMagicDevice:
     _name = None  # friendly name of the device
     _pwrstate = None
 
-    # dictionary containing mapping of service type to scpdUrl and ctrlUrl:
-    # {'Service Type': {'scpdUrl': 'SCPD XML URL', 'ctrlUrl': 'Control URL'}}
-    services = dict()
+    # dictionary containing mapping of service type to scpdUrl, ctrlUrl and
+    # (if the service supports eventing) eventUrl:
+    # {'Service Type': {'scpdUrl': 'SCPD XML URL', 'ctrlUrl': 'Control URL',
+    #                   'eventUrl': 'Event Subscription URL'}}
+    # (set per instance)
+    services = None
+
+    # supported actions of a service: registry.ActionRegistry
+    # (set per instance; identical tables are shared between devices)
+    actions = None
+
+    # metrics.Metrics object requests are recorded in (None: not recorded)
+    metrics_registry = metrics.REGISTRY
 
-    # supported actions of a service
-    actions = dict()
+    # artwork.AlbumArtCache used by get_album_art()
+    album_art_cache = artwork.CACHE
 
-    def __init__(self, host, port, description, location, name='Unknown'):
+    def __init__(self, host, port, description, location, name='Unknown',
+                 pool_size=STATE_REQUESTS, timeout=2, scpd_cache=None,
+                 ssdp_headers=None, lazy=False, connect_timeout=None,
+                 deadline=None, retry=None, circuit_breaker=True,
+                 read_ttls=None, command_interval=0.1):
         """ Initialize instance, fetch the root service control point
             description XML document and populate the objects data structures.
 
             host: host name or ip address and port of the device
             description: device description, e.g. SERVER header value
             location: root service control point definition url (LOCATION:)
+            pool_size: number of keep-alive connections kept open per host;
+                       connections are only opened for concurrent requests,
+                       e.g. those of get_state()
+            timeout: network timeout in seconds for requests to the device
+            scpd_cache: cache.DescriptionCache object to load the service
+                        descriptions from (and store them in)
+            ssdp_headers: the headers dict returned by discovery; used to
+                        identify the device firmware in the scpd_cache
+            lazy: don't contact the device until it is used for the first
+                  time (or warm_up() is called)
+            connect_timeout: timeout in seconds for connecting to the
+                        device; defaults to timeout
+            deadline: number of seconds a call may take in total, including
+                      retries; defaults to timeout
+            retry: health.RetryPolicy for actions that only read the state
+                   of the device; defaults to RetryPolicy()
+            circuit_breaker: health.CircuitBreaker that rejects requests
+                        while the device doesn't respond, True for a default
+                        one or False to always send requests
+            read_ttls: {action: seconds} dict of the actions whose
+                       responses are cached; defaults to cache.READ_TTLS
+            command_interval: minimum number of seconds between two
+                       commands of the same kind sent by the command channel
+                       (see commands)
         """
         self.host = host
         self.port = port
         self.description = description
         self.location = location
         self._name = name
+        self._pool = connection.ConnectionPool(maxsize=pool_size,
+                                               timeout=timeout,
+                                               connect_timeout=connect_timeout)
+        self.deadline = timeout if deadline is None else deadline
+        self.retry = health.RetryPolicy() if retry is None else retry
+        if circuit_breaker is True:
+            circuit_breaker = health.CircuitBreaker()
+        self.circuit_breaker = circuit_breaker or None
+        if self.circuit_breaker is not None and \
+                self.circuit_breaker.probe is None:
+            self.circuit_breaker.probe = self._probe
+        self.services = dict()
+        self.actions = registry.ActionRegistry()
+        self._scpd_cache = scpd_cache
+        self._scpd_key = self._description_key(ssdp_headers)
+        # precompiled requests: {(service, action, arguments): SoapRequest}
+        self._soap_requests = dict()
+        self.read_cache = cache.ReadCache(read_ttls)
+        self._protocol_info = None  # (response, ProtocolInfo)
+        self._presets = None  # PresetTable
+        self._navigator_id = None  # leased by get_playback_details()
+        self._navigator_lock = threading.Lock()
+        self._materialize_lock = threading.RLock()
+        self._materialized = False
+        self.command_interval = command_interval
+        self._commands = None  # CommandChannel, created on first use
+        self._commands_lock = threading.Lock()
+        self._executor = None  # ThreadPoolExecutor of get_state()
+        self._executor_lock = threading.Lock()
+
+        if not lazy:
+            self._materialize()
+
+    def _load_description(self):
+        """ Populate self.services from the cached or downloaded root
+            description. Return False if it couldn't be retrieved.
+        """
+        if self._load_cached_description():
+            return True
+        response = self._fetch_scpd(self.location)
+        if self._scpd_cache is not None and self._scpd_key is None \
+                and response is not None:
+            self._scpd_key = self._description_key(response=response)
+            if self._load_cached_description():
+                return True
+        if response is None:
+            return False
+        self._parse_root_description(self._parse_scpd(response))
+        self._store_description()
+        return True
+
+    def _materialize(self):
+        """ Retrieve the root description and the power state of a lazily
+            created device, unless that has been done already.
+            Return False if the device couldn't be reached; the next call
+            will try again.
+        """
+        if self._materialized:
+            return True
+        with self._materialize_lock:
+            if not self._materialized:
+                self._materialized = self._load_description()
+                if self._materialized:
+                    self._pwrstate = self.get_power_state()
+        return self._materialized
+
+    def warm_up(self, background=True):
+        """ Retrieve the data of a lazily created device before it is used.
+            With background=True, this is done in a daemon thread, which is
+            returned. Otherwise return True if the device could be reached.
+        """
+        if not background:
+            return self._materialize()
+        thread = threading.Thread(target=self._materialize, daemon=True,
+                                  name='StreamMagicWarmUp')
+        thread.start()
+        return thread
 
-        # fetch the root scpd xml document
-        root_xml = self._get_scpd(location)
-
-        # set self.urlBase from urlBase tag or,
-        # if this is not specified, from the location parameter
-        urlbase = root_xml.getElementsByTagName('urlBase')
-        if urlbase:
-            urlbase = self._xml_get_node_text(urlbase[0].rstrip('/'))
-        else:
-            urlbase = urlparse(location)
-            urlbase = '%s://%s' % (urlbase.scheme, urlbase.netloc)
-
-        for node in root_xml.getElementsByTagName('service'):
-            service_type = self._xml_get_node_text(
-                node.getElementsByTagName('serviceType')[0])
-
-            control_url = '%s%s' % (urlbase, self._xml_get_node_text(
-                node.getElementsByTagName('controlURL')[0]))
-
-            scpd_url = '%s%s' % (urlbase, self._xml_get_node_text(
-                node.getElementsByTagName('SCPDURL')[0]))
-
-            self.services.update({service_type: {'scpdUrl': scpd_url,
-                                                 'ctrlUrl': control_url}})
-        self._pwrstate = self.get_power_state()
+    @property
+    def commands(self):
+        """ Return the CommandChannel of the device, for setters that are
+            called in quick succession (e.g. from a volume slider):
+            dev.commands.set_volume(volume) returns right away, and only
+            the latest volume is sent if the device is still busy.
+        """
+        if self._commands is None:
+            with self._commands_lock:
+                if self._commands is None:
+                    self._commands = commands.CommandChannel(
+                        self, min_interval=self.command_interval)
+        return self._commands
+
+    def close(self):
+        """ Send the commands queued in the command channel, release the
+            navigator id (see get_playback_details()) and close the
+            keep-alive connections to the device.
+        """
+        if self._commands is not None:
+            self._commands.close()
+            self._commands = None
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.close()
+        navigator_id, self._navigator_id = self._navigator_id, None
+        if navigator_id is not None:
+            self._navigator_release(navigator_id)
+        self._pool.close()
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def rebind(self, location):
+        """ Point the device object to a new root SCPD url, e.g. after the
+            device got a new ip address, without fetching the service
+            descriptions again.
+        """
+        old = urlparse(self.location)
+        old = '%s://%s' % (old.scheme, old.netloc)
+        new = urlparse(location)
+        self.host = new.hostname
+        self.port = new.port or (443 if new.scheme == 'https' else 80)
+        self.location = location
+        new = '%s://%s' % (new.scheme, new.netloc)
+
+        services = dict()
+        for service_type, urls in self.services.items():
+            services[service_type] = {
+                key: new + url[len(old):] if url.startswith(old) else url
+                for key, url in urls.items()}
+        self.services = services
+        # cached descriptions are keyed by location
+        self._scpd_key = None
+        self._soap_requests = dict()
+        self.read_cache.invalidate()
+        self._pool.close()
 
     @property
     def name(self):
@@ -96,16 +366,226 @@ class StreamMagicDevice:
         """ Download the SCPD XML file from the device and
             return it as a minidom object.
         """
+        response = self._fetch_scpd(scpdurl)
+        start = time.perf_counter()
+        xml = self._parse_scpd(response)
+        self._record_parse('description', 'GET', start)
+        return xml
+
+    def _fetch_scpd(self, scpdurl=None):
+        """ Download the SCPD XML file from the device and return the
+            connection.Response or None if that failed.
+        """
+        timings = dict()
+        start = time.perf_counter()
         try:
             scpdurl = scpdurl or self.location
-            with urllib.request.urlopen(scpdurl) as response:
-                return minidom.parseString(response.read())
-        except (HTTPError, URLError) as ex:
+            response = self._pool.request('GET', scpdurl, timings=timings)
+            self._record_health(True)
+            self._record_request('description', 'GET', start, timings, None,
+                                 response)
+            if response.status != 200:
+                raise HTTPError(scpdurl, response.status, 'HTTP Error',
+                                response.headers, None)
+            return response
+        except (OSError, HTTPException) as ex:
+            if not isinstance(ex, HTTPError):
+                self._record_health(False)
+                self._record_request('description', 'GET', start, timings,
+                                     None, error=ex)
             print("Something went wrong fetching the SCPD XML file from %s"
                   % self.host, ex)
         return None
+
+    def _record_health(self, responded):
+        """ Tell the circuit breaker whether the device responded. """
+        if self.circuit_breaker is not None:
+            if responded:
+                self.circuit_breaker.record_success()
+            else:
+                self.circuit_breaker.record_failure()
+
+    def _probe(self):
+        """ Return True if the device responds to a request for its root
+            description; used by the circuit breaker.
+        """
+        try:
+            self._pool.request('GET', self.location,
+                               timeout=self._pool.connect_timeout)
+        except (OSError, HTTPException):
+            return False
+        return True
+
+    def _read_cache_key(self, action, instanceId, service_type,
+                        omitInstanceId, kwargs):
+        """ Return the key of an action call in the read cache, or None if
+            the response to the action isn't cached.
+        """
+        if action not in self.read_cache.ttls:
+            return None
+        return (service_type, None if omitInstanceId else instanceId) + \
+            tuple(kwargs.items())
+
+    def _attempts(self, action):
+        """ Return the number of times a failed action call may be sent. """
+        if self.retry is None or not health.is_idempotent(action):
+            return 1
+        return self.retry.retries + 1
+
+    def _retry_delay(self, attempt, attempts, deadline):
+        """ Return the number of seconds to wait before sending a failed
+            request again, or None if it shouldn't be sent again.
+        """
+        if attempt + 1 >= attempts or (
+                self.circuit_breaker is not None and
+                self.circuit_breaker.is_open):
+            return None
+        delay = self.retry.delay(attempt)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _record_request(self, service_type, action, start, timings, body,
+                        response=None, error=None):
+        """ Record a request that was started at time.perf_counter() start
+            in self.metrics_registry, with either the connection.Response
+            or the exception raised.
+        """
+        registry = self.metrics_registry
+        if registry is None:
+            return
+        phases = dict(timings)
+        code = None
+        bytes_in = 0
+        if error is not None:
+            status = 'timeout' \
+                if isinstance(error, connection.TIMEOUT_ERRORS) else 'error'
+        elif response.status == 200:
+            status = 'ok'
+            bytes_in = len(response.data)
+        else:
+            status = 'http_error'
+            code = response.status
+            bytes_in = len(response.data)
+            if response.status == 500:
+                parse_start = time.perf_counter()
+                try:
+                    fault = parser.get_value(response.data, 'errorCode', None)
+                except ExpatError:
+                    fault = None
+                phases['parse'] = time.perf_counter() - parse_start
+                if fault is not None:
+                    status = 'fault'
+                    code = fault
+        phases['total'] = time.perf_counter() - start
+        registry.request(self.host, metrics.service_name(service_type),
+                         action, status, code, phases, len(body or b''),
+                         bytes_in)
+
+    def _record_parse(self, service_type, action, start):
+        """ Record the time spent parsing a response since
+            time.perf_counter() start.
+        """
+        if self.metrics_registry is not None:
+            self.metrics_registry.observe(
+                'stream_magic_request_seconds',
+                (('device', self.host),
+                 ('service', metrics.service_name(service_type)),
+                 ('action', action), ('phase', 'parse')),
+                time.perf_counter() - start)
+
+    @staticmethod
+    def _parse_scpd(response):
+        """ Return the body of a connection.Response as minidom object. """
+        if response is None:
+            return None
+        return minidom.parseString(response.data)
 # ------ Helper Functions ------
 
+    def _description_key(self, ssdp_headers=None, response=None):
+        """ Return the description cache key for the device, derived from
+            the SSDP headers (if they identify the device and its firmware)
+            or from the response for the root description. Return None if
+            there's no cache or the device can't be identified.
+        """
+        if self._scpd_cache is None:
+            return None
+        if response is not None:
+            etag = response.headers.get('ETag')
+            return self._scpd_cache.key(
+                self.location, etag=etag,
+                content=None if etag else response.data)
+        ssdp_headers = ssdp_headers or dict()
+        udn = ssdp_headers.get('usn', '').split('::')[0]
+        bootid = ssdp_headers.get('bootid.upnp.org')
+        configid = ssdp_headers.get('configid.upnp.org')
+        # UPnP 1.0 devices (like StreamMagic players) don't announce
+        # BOOTID/CONFIGID, so the UDN alone wouldn't change with the
+        # firmware; the root description identifies it instead
+        if not udn or not (bootid or configid):
+            return None
+        return self._scpd_cache.key(self.location, udn=udn, bootid=bootid,
+                                    configid=configid)
+
+    def _load_cached_description(self, actions_only=False):
+        """ Populate self.services and, if available, self.actions from
+            the description cache. Return True on success.
+            With actions_only=True, only succeed if the actions are cached.
+        """
+        if self._scpd_key is None:
+            return False
+        entry = self._scpd_cache.get(self._scpd_key)
+        if entry is None or (actions_only and entry[1] is None):
+            return False
+        self.services.update(entry[0])
+        if entry[1] is not None:
+            self.actions.update(entry[1])
+            self._soap_requests = dict()
+        return True
+
+    def _store_description(self, with_actions=False):
+        """ Store self.services (and the actions of those services) in
+            the description cache.
+        """
+        if self._scpd_key is None:
+            return
+        actions = None
+        if with_actions:
+            actions = {service: self.actions[service]
+                       for service in self.services
+                       if service in self.actions}
+        self._scpd_cache.put(self._scpd_key, self.services, actions)
+
+    def _parse_root_description(self, root_xml):
+        """ Populate self.services from the root SCPD XML document. """
+        # set self.urlBase from urlBase tag or,
+        # if this is not specified, from the location parameter
+        urlbase = root_xml.getElementsByTagName('urlBase')
+        if urlbase:
+            urlbase = self._xml_get_node_text(urlbase[0]).rstrip('/')
+        else:
+            urlbase = urlparse(self.location)
+            urlbase = '%s://%s' % (urlbase.scheme, urlbase.netloc)
+
+        for node in root_xml.getElementsByTagName('service'):
+            service_type = sys.intern(self._xml_get_node_text(
+                node.getElementsByTagName('serviceType')[0]))
+
+            control_url = '%s%s' % (urlbase, self._xml_get_node_text(
+                node.getElementsByTagName('controlURL')[0]))
+
+            scpd_url = '%s%s' % (urlbase, self._xml_get_node_text(
+                node.getElementsByTagName('SCPDURL')[0]))
+
+            urls = {'scpdUrl': scpd_url, 'ctrlUrl': control_url}
+
+            event_url = node.getElementsByTagName('eventSubURL')
+            if event_url and self._xml_get_node_text(event_url[0]):
+                urls['eventUrl'] = '%s%s' % (
+                    urlbase, self._xml_get_node_text(event_url[0]))
+
+            self.services.update({service_type: urls})
+
     # this was taken from
     # https://www.electricmonk.nl/log/2016/07/05/exploring-upnp-with-python/
     def _xml_get_node_text(self, node):
@@ -117,12 +597,19 @@ class StreamMagicDevice:
         return ''.join(text)
 
     def _get_response_tag_value(self, response, tag):
-        """ Return a tag's value extracted from an XML response by the device.
+        """ Return a tag's value extracted from an XML response by the device,
+            or None if there is no response (e.g. the device is offline).
         """
-        values = minidom.parseString(response).getElementsByTagName(tag)
-        if values:
-            return values[0].firstChild.nodeValue
-        return 'n/a'
+        if response is None:
+            return None
+        return parser.get_value(response, tag)
+
+    def _get_response_flag(self, response, tag):
+        """ Return the value (0 or 1) of a tag in an XML response as boolean,
+            or None if there is no response.
+        """
+        value = self._get_response_tag_value(response, tag)
+        return None if value is None else bool(int(value))
 
     def _print_services(self):
         """ Print the services that are registered for a device and the
@@ -133,6 +620,8 @@ class StreamMagicDevice:
             print("Service Type: ", service)
             print(" `-> Control Url:", self.services[service]['ctrlUrl'])
             print(" `-> SCPD Url:", self.services[service]['scpdUrl'])
+            if 'eventUrl' in self.services[service]:
+                print(" `-> Event Url:", self.services[service]['eventUrl'])
             print("." * 100)
 
     def _get_service_data(self, service_type):
@@ -161,82 +650,150 @@ class StreamMagicDevice:
             to the specified action and added to the SOAP request as XML
             tags accordingly.
         """
+        cache_key = self._read_cache_key(action, instanceId, service_type,
+                                         omitInstanceId, kwargs)
+        if cache_key is not None:
+            data = self.read_cache.get(action, cache_key)
+            if data is not None:
+                return data
+        if self.circuit_breaker is not None and \
+                not self.circuit_breaker.allow():
+            return None
+        if not self._materialize() or service_type not in self.services:
+            return None
+        ctrlUrl, soapBody, headers = self._build_request(
+            action, instanceId, service_type, omitInstanceId, kwargs)
+
+        deadline = time.monotonic() + self.deadline if self.deadline \
+            else None
+        attempts = self._attempts(action)
+        for attempt in range(attempts):
+            remaining = None if deadline is None \
+                else max(deadline - time.monotonic(), 0.001)
+            timings = dict()
+            start = time.perf_counter()
+            try:
+                response = self._pool.request('POST', ctrlUrl, soapBody,
+                                              headers, timings, remaining)
+            except (OSError, HTTPException) as ex:
+                self._record_health(False)
+                self._record_request(service_type, action, start, timings,
+                                     soapBody, error=ex)
+                delay = self._retry_delay(attempt, attempts, deadline)
+                if delay is None:
+                    return None
+                time.sleep(delay)
+                continue
+            self._record_health(True)
+            self._record_request(service_type, action, start, timings,
+                                 soapBody, response)
+            if response.status != 200:
+                return None
+            if cache_key is not None:
+                self.read_cache.put(action, cache_key, response.data)
+            return response.data
+        return None
 
+    def _build_request(self, action, instanceId, service_type,
+                       omitInstanceId, kwargs):
+        """ Return control url, SOAP request body and headers for an
+            action call (see _send_cmd() for the parameters).
+        """
         # <InstanceID> apparently needs to be the first parameter tag
         #  but it needs to be omitted completely for certain action calls
         if omitInstanceId is True:
-            params = ''
+            names = tuple(kwargs)
+            values = tuple(kwargs.values())
         else:
-            params = '<{0}>{1}</{0}>\n'.format('InstanceID', instanceId)
-
-        # build XML tags from the remaining kwargs
-        for key in kwargs:
-            params += '<{0}>{1}</{0}>\n'.format(key, kwargs[key])
-
-        # template for the SOAP request body
-        soapBody = '<?xml version="1.0" encoding="utf-8"?>\n' \
-                   '<s:Envelope xmlns:s="{3}" s:encodingStyle="{0}">\n' \
-                   '<s:Body>\n' \
-                   '<u:{2} xmlns:u="{1}">\n' \
-                   '{4}' \
-                   '</u:{2}>\n' \
-                   '</s:Body>\n' \
-                   '</s:Envelope>\n'.format(StreamMagic.SOAP_ENCODING,
-                                            service_type, action,
-                                            StreamMagic.SOAP_ENVELOPE,
-                                            params)
-
-        # template for the SOAP request headers
-        headers = {'SOAPACTION': u'"%s"' % (service_type + '#' + action),
-                   'Host': u'%s:%s' % (self.host, self.port),
-                   'Content-Type': 'text/xml; charset="utf-8"',
-                   'Accept': '*/*',
-                   'Content-Length': len(soapBody)}
-
-        ctrlUrl = self._get_service_data(service_type)['ctrlUrl']
-
-        request = urllib.request.Request(ctrlUrl, str.encode(soapBody),
-                                         headers)
-        try:
-            response = urllib.request.urlopen(request, timeout=2)
-            return response.read()
-        except URLError:
-            return None
+            names = ('InstanceID',) + tuple(kwargs)
+            values = (instanceId,) + tuple(kwargs.values())
+
+        request = self._soap_requests.get((service_type, action, names))
+        if request is None:
+            request = self._compile_request(service_type, action, names)
+        body, headers = request.build(values)
+        return request.ctrl_url, body, headers
+
+    def _compile_request(self, service_type, action, names):
+        """ Create and remember the soap.SoapRequest for calling an action
+            with the named arguments. Arguments are ordered as in the
+            service's SCPD if its actions are known.
+        """
+        arguments = self.actions.get(service_type, {}).get(action)
+        order = [] if arguments is None else list(arguments.in_arguments)
+        if 'InstanceID' in names and 'InstanceID' not in order:
+            order.insert(0, 'InstanceID')
+        request = soap.SoapRequest(
+            self.services[service_type]['ctrlUrl'],
+            '%s:%s' % (self.host, self.port), service_type, action, names,
+            order)
+        self._soap_requests[(service_type, action, names)] = request
+        return request
 
     def _update_actions(self):
-        """ Fill the self.actions class attribute with the services and
-            associated actions retrieved from the SCPD XML documents.
+        """ Fill self.actions with the services and associated actions
+            retrieved from the SCPD XML documents or the description cache.
+            The documents are downloaded and parsed concurrently by up to
+            SCPD_WORKERS threads.
         """
-        for service in self.services:
-            scpd_url = self.services[service]['scpdUrl']
-            xml = self._get_scpd(scpd_url)
-
-            for node in xml.getElementsByTagName('action'):
-                action = self._xml_get_node_text(
-                    node.getElementsByTagName('name')[0])
+        self._materialize()
+        if self._load_cached_description(actions_only=True):
+            return
 
-                for arg in node.getElementsByTagName('argument'):
-                    argument = self._xml_get_node_text(
-                        arg.getElementsByTagName('name')[0])
-
-                    direction = self._xml_get_node_text(
-                        arg.getElementsByTagName('direction')[0])
-
-                    rsv = self._xml_get_node_text(
-                        arg.getElementsByTagName('relatedStateVariable')[0])
-
-                    if service not in self.actions.keys():
-                        self.actions[service] = dict()
-
-                    if action not in self.actions[service].keys():
-                        self.actions[service][action] = dict()
-
-                    self.actions[service][action][argument] = \
-                        {
-                            'direction': direction,
-                            'relatedStateVariable': rsv,
-                            'dataType': None
-                        }
+        def fetch(service):
+            scpd_url = self.services[service]['scpdUrl']
+            return service, self._parse_actions(service,
+                                                self._get_scpd(scpd_url))
+
+        services = list(self.services)
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(len(services), SCPD_WORKERS)),
+                thread_name_prefix='StreamMagicSCPD') as executor:
+            results = list(executor.map(fetch, services))
+        self._merge_actions(results)
+        self._store_description(with_actions=True)
+
+    def _merge_actions(self, results):
+        """ Add the (service, actions) tuples returned by _parse_actions()
+            to self.actions in one step. Devices with the same firmware
+            share the resulting tables.
+        """
+        self.actions.update({service: actions for service, actions in results
+                             if actions})
+        # the argument order of compiled requests may change
+        self._soap_requests = dict()
+
+    def _parse_actions(self, service, xml):
+        """ Return the actions and arguments defined in a service's
+            SCPD XML document as {action: {argument: {...}}} dict.
+        """
+        actions = dict()
+        if xml is None:
+            return actions
+        for node in xml.getElementsByTagName('action'):
+            action = self._xml_get_node_text(
+                node.getElementsByTagName('name')[0])
+
+            for arg in node.getElementsByTagName('argument'):
+                argument = self._xml_get_node_text(
+                    arg.getElementsByTagName('name')[0])
+
+                direction = self._xml_get_node_text(
+                    arg.getElementsByTagName('direction')[0])
+
+                rsv = self._xml_get_node_text(
+                    arg.getElementsByTagName('relatedStateVariable')[0])
+
+                if action not in actions:
+                    actions[action] = dict()
+
+                actions[action][argument] = \
+                    {
+                        'direction': direction,
+                        'relatedStateVariable': rsv,
+                        'dataType': None
+                    }
+        return actions
 
     def _get_protocol_info(self):
         """ Return a list of audio formats the device supports.
@@ -248,8 +805,39 @@ class StreamMagicDevice:
                                   omitInstanceId=True,
                                   service_type=svc_type)
 
+        return self._parse_protocol_info(response)
+
+    def _parse_protocol_info(self, response):
+        """ Return the list of audio formats from a GetProtocolInfo
+            response.
+        """
         response = self._get_response_tag_value(response, 'Sink')
-        return response.split(',')
+        return None if response is None else response.split(',')
+
+    def get_protocol_info(self):
+        """ Return a ProtocolInfo with the audio formats the device
+            supports, or None if the device didn't respond. The response is
+            cached (see read_cache), and so is the ProtocolInfo built from
+            it.
+        """
+        svc_type = 'urn:schemas-upnp-org:service:ConnectionManager:1'
+        response = self._send_cmd('GetProtocolInfo',
+                                  omitInstanceId=True,
+                                  service_type=svc_type)
+        return self._make_protocol_info(response)
+
+    def _make_protocol_info(self, response):
+        """ Return the ProtocolInfo for a GetProtocolInfo response, reusing
+            the previous one if the response is the same.
+        """
+        if response is None:
+            return None
+        cached = self._protocol_info
+        if cached is not None and cached[0] is response:
+            return cached[1]
+        info = ProtocolInfo(self._parse_protocol_info(response))
+        self._protocol_info = (response, info)
+        return info
 # ------ End of Helper Functions ------
 
 # Service Control Point Definition related methods
@@ -284,9 +872,10 @@ class StreamMagicDevice:
 
     def get_parameter_info(self, service_type, action, parameter):
         """ Returns information about the specified parameter for
-            a service type's action.
+            a service type's action as {'direction', 'relatedStateVariable',
+            'dataType'} dict.
         """
-        return self.actions[service_type][action][parameter]
+        return self.actions[service_type][action][parameter].as_dict()
 
 # Transport Controls related methods
 
@@ -296,11 +885,9 @@ class StreamMagicDevice:
         svc_type = 'urn:schemas-upnp-org:service:RenderingControl:1'
         response = self._send_cmd('GetMute', service_type=svc_type,
                                   Channel='Master')
-        state = self._get_response_tag_value(response, 'CurrentMute')
         # The xml response contains either 0 (not muted) or 1 (muted).
         # Turn that into a boolean and return it.
-        state = bool(int(state))
-        return state
+        return self._get_response_flag(response, 'CurrentMute')
 
     def volume_mute(self, state=True):
         """ Mute (default) or unmute the device. """
@@ -317,7 +904,7 @@ class StreamMagicDevice:
         svc_type = 'urn:UuVol-com:service:UuVolControl:5'
         response = self._send_cmd('GetVolumeControl', service_type=svc_type,
                                   omitInstanceId=True)
-        return bool(int(self._get_response_tag_value(response, 'Enabled')))
+        return self._get_response_flag(response, 'Enabled')
 
     def get_volume(self):
         """ Return the current volume setting. """
@@ -420,7 +1007,7 @@ class StreamMagicDevice:
         svc_type = 'urn:UuVol-com:service:PlaylistExtension:1'
         response = self._send_cmd('Shuffle', omitInstanceId=True,
                                   service_type=svc_type)
-        return bool(int(self._get_response_tag_value(response, 'aShuffle')))
+        return self._get_response_flag(response, 'aShuffle')
 
     def set_shuffle(self, state):
         """ Randomize playlist order.
@@ -437,7 +1024,7 @@ class StreamMagicDevice:
         svc_type = 'urn:UuVol-com:service:PlaylistExtension:1'
         response = self._send_cmd('Repeat', omitInstanceId=True,
                                   service_type=svc_type)
-        return bool(int(self._get_response_tag_value(response, 'aRepeat')))
+        return self._get_response_flag(response, 'aRepeat')
 
     def set_repeat(self, state):
         """ Repeat playlist after reaching the end.
@@ -459,7 +1046,7 @@ class StreamMagicDevice:
         svc_type = 'urn:UuVol-com:service:UuVolControl:5'
         response = self._send_cmd('GetAudioSource', service_type=svc_type)
         src = self._get_response_tag_value(response, 'RetAudioSourceValue')
-        return src.lower()
+        return None if src is None else src.lower()
 
     def get_power_state(self):
         """ Returns the power state of the device ('on', 'off' or 'idle'). """
@@ -479,28 +1066,156 @@ class StreamMagicDevice:
             When the audio source is "Internet radio" use
             get_playback_details() instead to get this information.
         """
-        data = dict()
         if self.get_audio_source() == "media player":
-            # pylint: disable=C0103
-            f = self._get_response_tag_value    # just a function alias
-            response = self._send_cmd('GetPositionInfo')
-            track_data = f(response, 'TrackMetaData')
-            data['artist'] = f(track_data, 'upnp:artist')
-            data['trackTitle'] = f(track_data, 'dc:title')
-            data['albumArtURI'] = f(track_data, 'upnp:albumArtURI')
-            data['genre'] = f(track_data, 'upnp:genre')
-            data['origTrackNo'] = f(track_data, 'upnp:originalTrackNumber')
-            data['album'] = f(track_data, 'upnp:album')
-            data['currentPos'] = f(response, 'AbsTime')
+            return self._parse_track_info(self._send_cmd('GetPositionInfo'))
+        return self._parse_track_info(None)
+
+    def get_position_info(self):
+        """ Return a dict with the 'trackURI', 'absTime' (position) and
+            'trackDuration' values reported by the device for the current
+            track and its meta data as 'trackInfo' (in the format of
+            get_current_track_info(), or None if it couldn't be parsed).
+            Return None if the device didn't respond.
+
+            Unlike get_current_track_info(), the audio source isn't checked.
+        """
+        return self._parse_position_info(self._send_cmd('GetPositionInfo'))
+
+    def _parse_position_info(self, response):
+        """ Return the position info dict from a GetPositionInfo response,
+            or None if there is no response or it couldn't be parsed.
+        """
+        if response is None:
+            return None
+        try:
+            values = parser.get_values(response, ('TrackURI', 'AbsTime',
+                                                  'TrackDuration'))
+        except PARSE_ERRORS:
+            return None
+        try:
+            track_info = self._parse_track_info(response)
+        except PARSE_ERRORS:
+            track_info = None
+        return {'trackURI': values.get('TrackURI'),
+                'absTime': values.get('AbsTime'),
+                'trackDuration': values.get('TrackDuration'),
+                'trackInfo': track_info}
+
+    def get_album_art(self, uri=None):
+        """ Return an artwork.Artwork with the album art of the current
+            track (or of the specified albumArtURI), or None if there is
+            none. Images are served from self.album_art_cache, which is
+            shared by all devices, unless set per device.
+        """
+        if uri is None:
+            uri = self.get_current_track_info()['albumArtURI']
+        url = self._album_art_url(uri)
+        return None if url is None else self.album_art_cache.get(url)
+
+    def _album_art_url(self, uri):
+        """ Return the absolute url of an albumArtURI, or None if the
+            track has no album art.
+        """
+        if not uri or uri in ('n/a', 'NOT_IMPLEMENTED'):
+            return None
+        return urljoin(self.location, uri)
+
+    def _state_getters(self):
+        """ Return the (field, method) tuples used by get_state(). """
+        return (('power_state', self.get_power_state),
+                ('transport_state', self.get_transport_state),
+                ('volume', self.get_volume),
+                ('mute', self.get_mute_state),
+                ('audio_source', self.get_audio_source),
+                ('shuffle', self.get_shuffle),
+                ('repeat', self.get_repeat))
+
+    @staticmethod
+    def _timed_call(func, *args):
+        """ Return (result, time received) for a call, with result being
+            None if the response couldn't be parsed.
+        """
+        try:
+            value = func(*args)
+        except PARSE_ERRORS:
+            value = None
+        return value, time.time()
+
+    def _make_state(self, results, position):
+        """ Return a DeviceState from the {field: (value, time)} results
+            of the getters and the (response, time) of GetPositionInfo.
+        """
+        response, received = position
+        source = results['audio_source'][0]
+        track_info = None
+        if source is not None and \
+                (source != 'media player' or response is not None):
+            if source != 'media player':
+                response = None
+            try:
+                track_info = MappingProxyType(
+                    self._parse_track_info(response))
+            except PARSE_ERRORS:
+                pass
+        values = {field: value for field, (value, _) in results.items()}
+        timestamps = {field: ts if value is not None else None
+                      for field, (value, ts) in results.items()}
+        timestamps['track_info'] = received if track_info is not None \
+            else None
+        return DeviceState(track_info=track_info,
+                           timestamps=MappingProxyType(timestamps),
+                           **values)
+
+    def get_state(self):
+        """ Return a DeviceState snapshot with power state, transport
+            state, volume, mute state, audio source, shuffle and repeat
+            settings and the current track info.
+
+            The requests are sent concurrently, so with the default
+            pool_size this takes about as long as a single request. A
+            smaller pool_size limits the number of concurrent requests.
+            The track info is only parsed if the audio source is
+            "media player", without asking for the source again.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                # more workers than pooled connections would open
+                # connections that are closed again right away
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, min(STATE_REQUESTS,
+                                           self._pool.maxsize)),
+                    thread_name_prefix='StreamMagicDevice')
+            executor = self._executor
+        futures = {field: executor.submit(self._timed_call, getter)
+                   for field, getter in self._state_getters()}
+        position = executor.submit(self._timed_call, self._send_cmd,
+                                   'GetPositionInfo')
+        results = {field: future.result()
+                   for field, future in futures.items()}
+        return self._make_state(results, position.result())
+
+    def _parse_track_info(self, response):
+        """ Return the track info dict from a GetPositionInfo response or
+            a dict of NOT_IMPLEMENTED values if response is None.
+        """
+        data = dict()
+        if response is not None:
+            values = parser.get_values(response, ('TrackMetaData', 'AbsTime'))
             # track duration is expressed as an attribute of the res-tag
             # within the DIDL structure, e.g.:
             # <res duration="0:05:07.000"></res>
-            data['trackLength'] = minidom.parseString(track_data)\
-                                         .getElementsByTagName('res')[0]\
-                                         .attributes['duration']\
-                                         .firstChild.data
+            meta, attrs = parser.extract(values['TrackMetaData'], (
+                'upnp:artist', 'dc:title', 'upnp:albumArtURI', 'upnp:genre',
+                'upnp:originalTrackNumber', 'upnp:album'), ('res',))
+            data['artist'] = meta.get('upnp:artist', 'n/a')
+            data['trackTitle'] = meta.get('dc:title', 'n/a')
+            data['albumArtURI'] = meta.get('upnp:albumArtURI', 'n/a')
+            data['genre'] = meta.get('upnp:genre', 'n/a')
+            data['origTrackNo'] = meta.get('upnp:originalTrackNumber', 'n/a')
+            data['album'] = meta.get('upnp:album', 'n/a')
+            data['currentPos'] = values.get('AbsTime', 'n/a')
             # strip the sub-second specifier, so format becomes H:MM:SS
-            data['trackLength'] = data['trackLength'][:-4]
+            data['trackLength'] = attrs['res']['duration'].split('.')[0]
         else:
             # set all fields to NOT_IMPLEMENTED to at least return some
             # syntactically correct information
@@ -513,12 +1228,25 @@ class StreamMagicDevice:
 # note: all those return only SOAP errors it an InstanceID is specified
 
     def _navigator_register(self):
-        """ Register a navigator_id at the device and return the value. """
+        """ Register a navigator_id at the device and return the value,
+            or None if that failed.
+        """
         svc_type = 'urn:UuVol-com:service:UuVolControl:5'
         response = self._send_cmd('RegisterNavigator', service_type=svc_type)
+        if response is None:
+            return None
         navigator_id = self._get_response_tag_value(response, 'RetNavigatorId')
         return navigator_id
 
+    def _lease_navigator(self, expired=None):
+        """ Return the navigator id leased by this object, registering one
+            if there is none yet or the current one is the expired id.
+        """
+        with self._navigator_lock:
+            if self._navigator_id is None or self._navigator_id == expired:
+                self._navigator_id = self._navigator_register()
+            return self._navigator_id
+
     def _navigator_release(self, navigator_id):
         """ Release (=invalidate) the specified navigator_id. """
         svc_type = 'urn:UuVol-com:service:UuVolControl:5'
@@ -529,13 +1257,17 @@ class StreamMagicDevice:
 
     def _navigator_is_registered(self, navigator_id):
         """ Check if the specified navigator_id is registered at the device.
+            Return None if the device didn't answer.
         """
         svc_type = 'urn:UuVol-com:service:UuVolControl:5'
         response = self._send_cmd('IsRegisteredNavigatorId',
                                   NavigatorId=navigator_id,
                                   omitInstanceId=True,
                                   service_type=svc_type)
-        return bool(self._get_response_tag_value(response, 'IsRegistered'))
+        if response is None:
+            return None
+        return self._get_response_tag_value(
+            response, 'IsRegistered').lower() in ('1', 'true')
 
     def _set_av_transport_uri(self, uri):
         """ Set current playback URI (media file, playlist, etc) """
@@ -550,93 +1282,170 @@ class StreamMagicDevice:
         return self._get_response_tag_value(response,
                                             'RetNumberOfPresetsValue')
 
-    def get_preset_list(self):
+    def _get_presets(self, start, end):
+        """ Return the presets start to end in the format of
+            get_preset_list(), or None if the device didn't respond.
+        """
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        response = self._send_cmd('GetPresetList',
+                                  Start=str(start),
+                                  End=str(end),
+                                  omitInstanceId=True,
+                                  service_type=svc_type)
+        return self._parse_preset_list(response)
+
+    def _load_presets(self, count):
+        """ Retrieve the count presets in pages of PRESET_PAGE_SIZE and
+            store them in the preset cache. Return the PresetTable, or None
+            if the device didn't respond.
+        """
+        presets = []
+        for start in range(1, count + 1, PRESET_PAGE_SIZE):
+            page = self._get_presets(
+                start, min(start + PRESET_PAGE_SIZE - 1, count))
+            if page is None:
+                return None
+            presets.extend(page)
+        self._presets = PresetTable(count, presets)
+        return self._presets
+
+    def get_preset_list(self, refresh=False):
         """ Get the list of internet radio station presets
 
             Format is a list of lists, each containing tree elements:
             1. the preset number
             2. the station id
             3. True/False depending on if the station is currently playing
+
+            The presets are cached and only retrieved again if their number
+            changed or refresh is True. The number of presets is cached
+            as well (see read_cache), unless refresh is True.
+            Return None if the device didn't respond.
+        """
+        table = self._preset_table(refresh)
+        return None if table is None else table.as_list()
+
+    def _preset_table(self, refresh=False):
+        """ Return the cached PresetTable, retrieving the presets first if
+            refresh is True, none are cached or their number changed.
+            Return None if the device didn't respond.
+        """
+        if refresh:
+            self.read_cache.invalidate('GetNumberOfPresets')
+        count = self._get_number_of_presets()
+        if count is None:
+            return None
+        count = int(count)
+        table = self._presets
+        if refresh or table is None or table.count != count:
+            table = self._load_presets(count)
+        return table
+
+    def _parse_preset_list(self, response):
+        """ Return the preset list from a GetPresetList response, or None
+            if there is no response.
         """
-        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
-        response = self._send_cmd('GetPresetList',
-                                  Start='1',
-                                  End=self._get_number_of_presets(),
-                                  omitInstanceId=True,
-                                  service_type=svc_type)
         presetListXML = self._get_response_tag_value(response,
                                                      'RetPresetListXML')
-        presets = minidom.parseString(presetListXML)\
-                         .getElementsByTagName('preset')
+        if presetListXML is None:
+            return None
         presetList = []
 
-        for p in presets:
-            name = p.getElementsByTagName('title')[0].firstChild.nodeValue
-            attrs = dict(p.attributes.items())
+        for attrs, texts in parser.get_elements(presetListXML, 'preset',
+                                                ('title',)):
             presetNo = attrs['id']
-            isPlaying = ('isPlaying' in attrs.keys())
-            presetList.append([presetNo, name, isPlaying])
+            isPlaying = ('isPlaying' in attrs)
+            presetList.append([presetNo, texts['title'], isPlaying])
         return presetList
 
     def get_current_preset(self):
-        """ Return the id and name for the current preset - or None if n/a. """
-        for preset in self.get_preset_list():
-            if preset[2]:
-                num, name = preset[0:2]
-                return {'num': num, 'name': name}
+        """ Return the id and name for the current preset - or None if n/a.
+
+            The preset that was playing when the presets were retrieved (or
+            that was started with play_preset()) is checked with a single
+            request; if it isn't playing anymore, None is returned without
+            retrieving all presets again. Use get_preset_list(refresh=True)
+            to find a preset that was started by other means.
+        """
+        table = self._preset_table()
+        if table is None or table.playing is None:
+            return None
+        page = self._get_presets(table.playing, table.playing)
+        if not page:
+            return None
+        if page[0][0] == table.playing and page[0][2]:
+            return table.find(table.playing)
+        table.playing = None
         return None
 
+    def find_preset(self, preset):
+        """ Return the number and name ({'num': ..., 'name': ...}) of a
+            preset specified by number or name - or None if n/a.
+            Uses the cached preset list.
+        """
+        table = self._preset_table()
+        return None if table is None else table.find(preset)
+
     def play_preset(self, num):
         """ Start playing the preset with the specified id """
         svc_type = 'urn:UuVol-com:service:UuVolControl:5'
         self._send_cmd('PlayPreset', NewPresetNumberValue=num,
                        omitInstanceId=True, service_type=svc_type)
+        if self._presets is not None:
+            self._presets.playing = str(num)
         return None
 
     def get_playback_details(self):
-        """ Return a dict with details for the currently playing Stream"""
+        """ Return a dict with details for the currently playing Stream
+
+            A navigator id is registered once and reused for all calls, so
+            this usually takes a single request. If the request fails, the
+            navigator id is checked and registered again if necessary.
+        """
         # if the device is not 'on', don't try to retrieve any data
-        if self._pwrstate != 'on':
+        if not self._materialize() or self._pwrstate != 'on':
             return None
 
-        # return a dict with empty string values when device is
-        # still transitioning to the PLAYING state
-        if self.get_transport_state() == 'TRANSITIONING':
-            return {'state': '', 'format': '', 'artist': '', 'stream': ''}
-
-        # alternative: actively wait until the state changes.
-        # which can be about 5-6 seconds.
-        # while self.get_transport_state() == 'TRANSITIONING':
-        #     sleep(0.5)
-
-        # register navigator id, get the playback info...
-        nid = self._navigator_register()
-        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
-        response = self._send_cmd('GetPlaybackDetails', NavigatorId=nid,
-                                  omitInstanceId=True, service_type=svc_type)
-        pb_details = self._get_response_tag_value(response, 'RetPlaybackXML')
-        # ...and release the navigator again
-        if self._navigator_is_registered(nid):
-            self._navigator_release(nid)
+        nid = self._lease_navigator()
+        response = self._get_playback_details(nid)
+        if response is None and nid is not None \
+                and self._navigator_is_registered(nid) is False:
+            # the device forgot the navigator id, e.g. after a restart
+            nid = self._lease_navigator(expired=nid)
+            response = self._get_playback_details(nid)
 
         try:
-            pbd = minidom.parseString(pb_details)\
-                        .getElementsByTagName('playback-details')[0]
-
-            state = pbd.getElementsByTagName('state')[0]\
-                       .firstChild.nodeValue
-
-            fmt = dict(pbd.getElementsByTagName('format')[0]
-                       .attributes.items())
-
-            artist = pbd.getElementsByTagName('artist')[0]\
-                        .firstChild.nodeValue
+            details = self._parse_playback_details(response)
+        except PARSE_ERRORS:
+            details = None
+        if details is None or not details['state']:
+            # return a dict with empty string values when device is
+            # still transitioning to the PLAYING state
+            if self.get_transport_state() == 'TRANSITIONING':
+                return {'state': '', 'format': '', 'artist': '', 'stream': ''}
+        return details
+
+    def _get_playback_details(self, navigator_id):
+        """ Return the GetPlaybackDetails response or None. """
+        if navigator_id is None:
+            return None
+        svc_type = 'urn:UuVol-com:service:UuVolControl:5'
+        return self._send_cmd('GetPlaybackDetails', NavigatorId=navigator_id,
+                              omitInstanceId=True, service_type=svc_type)
 
-            stream = pbd.getElementsByTagName('stream')[0]\
-                        .getElementsByTagName('title')[0]\
-                        .firstChild.nodeValue
-        except IndexError:
-            pass
+    def _parse_playback_details(self, response):
+        """ Return the playback details dict from a GetPlaybackDetails
+            response.
+        """
+        pb_details = self._get_response_tag_value(response, 'RetPlaybackXML')
+        # values missing from the document are returned as empty strings
+        texts, attrs = parser.extract(pb_details,
+                                      ('state', 'artist', 'stream/title'),
+                                      ('format',))
+        state = texts.get('state', '')
+        fmt = dict(attrs.get('format', ''))
+        artist = texts.get('artist', '')
+        stream = texts.get('stream/title', '')
 
         # example response:
         # {'state': 'Playing',
@@ -673,3 +1482,20 @@ class StreamMagicDevice:
                                   service_type=svc_type, omitInstanceId=True)
         self._pwrstate = power_state.lower()
         return response
+
+    def send_event_request(self, method, service_type, headers):
+        """ Send a GENA request (SUBSCRIBE or UNSUBSCRIBE, see
+            events.EventSubscriber) to the event url of a service.
+            Return the connection.Response, or None if the service has no
+            event url or the request failed or wasn't accepted.
+        """
+        if not self._materialize():
+            return None
+        url = self.services.get(service_type, {}).get('eventUrl')
+        if url is None:
+            return None
+        try:
+            response = self._pool.request(method, url, None, headers)
+        except (OSError, HTTPException):
+            return None
+        return response if response.status == 200 else None
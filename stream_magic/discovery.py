@@ -3,7 +3,8 @@ DLNA Digital Media Controller implementation for Cambridge Audio
 network audio players that are based on their StreamMagic platform.
 
 This module contains the methods to discover a StreamMagic device
-on the local network using IP multicast.
+on the local network using IP multicast, either actively (M-SEARCH) or
+passively by listening for the devices' NOTIFY announcements.
 """
 
 # This is in parts based on Pavel Cherezov's dlnap.py
@@ -14,7 +15,16 @@ on the local network using IP multicast.
 __version__ = '0.16'
 __author__ = 'Sebastian Kaps (sebk-666)'
 
+import asyncio
+import logging
+import re
 import socket
+import struct
+import threading
+import time
+from . import metrics
+
+_LOGGER = logging.getLogger(__name__)
 
 
 class StreamMagic:
@@ -30,38 +40,227 @@ class StreamMagic:
     SSDP_ALL = "ssdp:all"
     SOAP_ENCODING = "http://schemas.xmlsoap.org/soap/encoding/"
     SOAP_ENVELOPE = "http://schemas.xmlsoap.org/soap/envelope/"
+    # Receive buffer size requested for the search socket, so replies
+    # arriving in a burst from many devices aren't dropped by the kernel
+    RECV_BUFFER = 1 << 20
 
     devices = None
 
-    def __init__(self):
-        """ Initialize instance. """
+    # metrics.Metrics object searches are recorded in (None: not recorded)
+    metrics_registry = metrics.REGISTRY
+
+    def __init__(self, ssdp_group=None):
+        """ Initialize instance.
+
+            ssdp_group: (address, port) tuple search messages are sent to
+                        instead of the SSDP multicast group, e.g. a
+                        simulator or a single device
+        """
         self.devices = []
+        self.ssdp_group = tuple(ssdp_group or self.SSDP_GROUP)
 
     def _send_udp(self, msg):
         """ Send the specified message to the SSDP multicast group. """
+        return list(self._iter_udp(msg, timeout=2))
+
+    def _iter_udp(self, msg, timeout=2, retries=0):
+        """ Send the specified message to the SSDP multicast group and
+            yield (addr, data) tuples for the replies as they arrive,
+            until the timeout (in seconds) expires.
+
+            retries: number of times the message is sent again, evenly
+                     spaced within the timeout
+        """
         sock = socket.socket(socket.AF_INET,
                              socket.SOCK_DGRAM,
                              socket.IPPROTO_UDP)
-        sock.settimeout(2)
-        sock.sendto(msg, StreamMagic.SSDP_GROUP)
-
-        replies = []
+        self._set_recv_buffer(sock)
+        start = time.monotonic()
+        deadline = start + timeout
+        interval = timeout / (retries + 1)
+        sent = 0
+        replies = 0
+        received = 0
 
         try:
             while True:
-                data, addr = sock.recvfrom(65507)
-                replies.append((addr, data))
-        except socket.timeout:
+                now = time.monotonic()
+                if sent <= retries and now >= start + sent * interval:
+                    sock.sendto(msg, self.ssdp_group)
+                    sent += 1
+                if now >= deadline:
+                    break
+                wakeup = deadline
+                if sent <= retries:
+                    wakeup = min(wakeup, start + sent * interval)
+                sock.settimeout(max(wakeup - now, 0.001))
+                try:
+                    data, addr = sock.recvfrom(65507)
+                except socket.timeout:
+                    continue
+                replies += 1
+                received += len(data)
+                yield (addr, data)
+        finally:
+            sock.close()
+            self._record_search(msg, start, sent, replies, received)
+
+    def _set_recv_buffer(self, sock):
+        """ Enlarge the receive buffer of a socket (the kernel may cap the
+            size, which is fine).
+        """
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            self.RECV_BUFFER)
+        except OSError:
             pass
-        return replies
 
-    def discover(self, host=None):
+    def _record_search(self, msg, start, sent, replies, received):
+        """ Record a search that was started at time.monotonic() start in
+            self.metrics_registry.
+        """
+        registry = self.metrics_registry
+        if registry is None:
+            return
+        group = '%s:%d' % self.ssdp_group
+        action = msg.split(b' ', 1)[0].decode('ascii', 'replace')
+        registry.request(group, 'SSDP', action, 'ok',
+                         phases={'total': time.monotonic() - start},
+                         bytes_out=len(msg) * sent, bytes_in=received)
+        registry.inc('stream_magic_ssdp_replies_total',
+                     (('device', group), ('action', action)), replies)
+
+    @staticmethod
+    def _parse_reply(data):
+        """ Turn an SSDP reply into a dict of lowercase header names
+            and their values.
+        """
+        headers = dict()
+        for line in data.decode("utf-8", "replace").splitlines()[1:]:
+            # If we find a header without an associated value,
+            # e.g. "EXT:", assign an empty string instead.
+            key, _, val = line.partition(":")
+            if key:
+                headers[key.strip().lower()] = val.strip()
+        return headers
+
+    @staticmethod
+    def _search_message(mx=2):
+        """ Return the M-SEARCH message for root devices. """
+        return \
+            b'M-SEARCH * HTTP/1.1\r\n' \
+            b'HOST:239.255.255.250:1900\r\n' \
+            b'ST:upnp:rootdevice\r\n' \
+            b'MX:%d\r\n' \
+            b'MAN:"ssdp:discover"\r\n' \
+            b'\r\n' % mx
+
+    def _filter_reply(self, addr, data, host, seen):
+        """ Return the parsed headers of a reply if it is from a (new)
+            StreamMagic device matching host, and None otherwise.
+            seen is the set of USNs/addresses of devices found so far.
+        """
+        if host and addr[0] != host:
+            return None
+        headers = self._parse_reply(data)
+        # If the device is not a StreamMagic device, discard it.
+        if not headers.get('server', '').startswith("StreamMagic"):
+            return None
+        key = headers.get('usn') or addr
+        if key in seen:
+            return None
+        seen.add(key)
+        return headers
+
+    def iter_discover(self, host=None, count=None, timeout=2, retries=0):
+        """ Send out UDP discover messages to the SSDP multicast group and
+            yield each StreamMagic device as soon as its reply arrives.
+
+            Optional parameters:
+            host='IP_addr': only yield the host with the specified ip address
+                            and stop as soon as it has been found
+            count: stop after this many devices have been found
+            timeout: overall time limit in seconds
+            retries: number of times the discover message is retransmitted
+                     within the timeout (in case a datagram got lost)
+
+            Yields (addr, data) tuples as returned by discover().
+            Devices are reported once, identified by their USN or address.
+        """
+        seen = set()
+        found = 0
+        msg = self._search_message(mx=max(1, int(timeout)))
+        for (addr, data) in self._iter_udp(msg, timeout, retries):
+            headers = self._filter_reply(addr, data, host, seen)
+            if headers is None:
+                continue
+            yield (addr, headers)
+            found += 1
+            if host or (count and found >= count):
+                return
+
+    async def aiter_discover(self, host=None, count=None, timeout=2,
+                             retries=0):
+        """ Asynchronous iterator version of iter_discover() for use with
+            "async for".
+        """
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue()
+
+        class Protocol(asyncio.DatagramProtocol):
+            """ Put received datagrams into the queue. """
+            def datagram_received(self, data, addr):
+                queue.put_nowait((addr, data))
+
+        transport, _ = await loop.create_datagram_endpoint(
+            Protocol, family=socket.AF_INET, proto=socket.IPPROTO_UDP)
+        self._set_recv_buffer(transport.get_extra_info('socket'))
+        seen = set()
+        found = 0
+        msg = self._search_message(mx=max(1, int(timeout)))
+        start = loop.time()
+        interval = timeout / (retries + 1)
+        sent = 0
+        try:
+            while True:
+                now = loop.time()
+                if sent <= retries and now >= start + sent * interval:
+                    transport.sendto(msg, self.ssdp_group)
+                    sent += 1
+                if now >= start + timeout:
+                    return
+                wakeup = start + timeout
+                if sent <= retries:
+                    wakeup = min(wakeup, start + sent * interval)
+                try:
+                    addr, data = await asyncio.wait_for(
+                        queue.get(), max(wakeup - now, 0.001))
+                except asyncio.TimeoutError:
+                    continue
+                headers = self._filter_reply(addr, data, host, seen)
+                if headers is None:
+                    continue
+                yield (addr, headers)
+                found += 1
+                if host or (count and found >= count):
+                    return
+        finally:
+            transport.close()
+
+    def discover(self, host=None, count=None, timeout=2, retries=0,
+                 cache=None):
         """ Send out an UDP discover message to the SSDP multicast group
             and return a list of StreamMagic devices that replied to it.
 
             Optional parameters:
             host='IP_addr': if specified, only include the host with the
                             specified ip address in the returned list.
+                            Returns as soon as that host has replied.
+            count, timeout, retries: see iter_discover()
+            cache: a cache.DiscoveryCache object. If it holds valid entries
+                   for the request, those are returned without sending a
+                   discover message. Otherwise the cache is updated with
+                   the discovered devices.
 
             Returns a list object: [ (addr, data ), ... ] with:
 
@@ -71,45 +270,178 @@ class StreamMagic:
             data: {'HEADER': 'value'} dict containing the headers
                     of the reply and their values
         """
+        if cache is not None:
+            cached = cache.lookup(host, count)
+            if cached:
+                self.devices.extend(cached)
+                return self.devices
 
-        # Message template
-        msg = \
-            b'M-SEARCH * HTTP/1.1\r\n' \
-            b'HOST:239.255.255.250:1900\r\n' \
-            b'ST:upnp:rootdevice\r\n' \
-            b'MX:2\r\n' \
-            b'MAN:"ssdp:discover"\r\n' \
-            b'\r\n'
-
-        discovered_devices = []
-
-        for (addr, data) in self._send_udp(msg):
-            # Turn the response into a dict of header names and their value.
-            headers = [elem.split(": ")
-                       for elem in data.decode("utf-8").splitlines()[1:]]
-
-            data = dict()
-
-            for header in headers:
-                # If we find a header without an assiciated value,
-                # e.g. "EXT: ", assign an empty string instead.
-                # Also: lowercase the header names
-                if len(header) > 1:
-                    (key, val) = str(header[0]).lower(), header[1]
-                else:
-                    (key, val) = (str(header[0]).lower(), '')
-                data.update({key: val})
-
-            # If the device is not a StreamMagic device, discard it.
-            # If a host parameter was specified, only add the matching host
-            if host:
-                if addr[0] == host:
-                    if (data['server'].startswith("StreamMagic")):
-                        self.devices.append((addr, data))
-            else:
-                if addr not in [dev[0] for dev in discovered_devices]:
-                    if (data['server'].startswith("StreamMagic")):
-                        self.devices.append((addr, data))
+        found = list(self.iter_discover(host, count, timeout, retries))
+        if cache is not None and found:
+            cache.store(found)
+        self.devices.extend(found)
         if self.devices:
             return self.devices
         return None
+
+
+class SSDPListener:
+    """ Listen for SSDP NOTIFY messages (ssdp:alive / ssdp:byebye) in a
+        background thread and maintain a registry of the StreamMagic
+        devices announcing themselves on the network.
+
+        The registry (self.devices) is a {udn: (addr, data)} dict with addr
+        and data as returned by StreamMagic.discover(). Entries expire
+        after the max-age announced in the CACHE-CONTROL header.
+
+        Optional callbacks, each called with (udn, addr, data):
+        on_added: a device appeared
+        on_removed: a device said goodbye or its announcement expired
+        on_address_changed: a known device announced a new location,
+                            e.g. after getting a new DHCP address
+
+        Exceptions raised by the callbacks (or by rebinding a watched
+        device) are logged and counted in self.errors; the listener keeps
+        running.
+    """
+
+    DEFAULT_MAX_AGE = 1800
+
+    def __init__(self, on_added=None, on_removed=None,
+                 on_address_changed=None, interface='0.0.0.0'):
+        """ Initialize instance. Call start() to start listening. """
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.on_address_changed = on_address_changed
+        self.interface = interface
+        self.devices = dict()
+        self.errors = 0         # messages whose handling raised
+        self._expiry = dict()   # {udn: monotonic expiry time}
+        self._watched = dict()  # {udn: StreamMagicDevice}
+        self._lock = threading.Lock()
+        self._sock = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """ Join the SSDP multicast group and start the listener thread. """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                             socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', StreamMagic.SSDP_GROUP[1]))
+        membership = struct.pack('4s4s',
+                                 socket.inet_aton(StreamMagic.SSDP_GROUP[0]),
+                                 socket.inet_aton(self.interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                        membership)
+        sock.settimeout(1)
+        self._sock = sock
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='SSDPListener')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop the listener thread and leave the multicast group. """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def watch(self, udn, device):
+        """ Rebind the StreamMagicDevice object to the new location
+            whenever the device with the specified udn changes its address.
+        """
+        with self._lock:
+            self._watched[udn] = device
+
+    def _run(self):
+        """ Receive and process NOTIFY messages until stopped. """
+        while self._running:
+            try:
+                data, addr = self._sock.recvfrom(65507)
+            except socket.timeout:
+                data, addr = None, None
+            except OSError:
+                break
+            try:
+                if data is not None:
+                    self.handle_message(addr, data)
+                self.expire()
+            except Exception:  # pylint: disable=broad-except
+                self.errors += 1
+                _LOGGER.exception("Error handling SSDP message from %s",
+                                  addr)
+
+    @staticmethod
+    def _max_age(data):
+        """ Return the max-age value of the CACHE-CONTROL header. """
+        match = re.search(r'max-age\s*=\s*(\d+)',
+                          data.get('cache-control', ''))
+        return int(match.group(1)) if match else SSDPListener.DEFAULT_MAX_AGE
+
+    def handle_message(self, addr, data, now=None):
+        """ Process a received SSDP datagram. """
+        if not data.startswith(b'NOTIFY'):
+            return
+        headers = StreamMagic._parse_reply(data)
+        udn = headers.get('usn', '').split('::')[0]
+        if not udn:
+            return
+        if headers.get('nts') == 'ssdp:byebye':
+            self.remove(udn)
+        elif headers.get('nts') == 'ssdp:alive':
+            if headers.get('server', '').startswith('StreamMagic'):
+                self.add(addr, headers, now)
+
+    def add(self, addr, data, now=None):
+        """ Add or refresh a device in the registry. This can also be used
+            to seed the registry with the results of StreamMagic.discover().
+        """
+        now = time.monotonic() if now is None else now
+        udn = data.get('usn', '').split('::')[0]
+        with self._lock:
+            previous = self.devices.get(udn)
+            self.devices[udn] = (addr, data)
+            self._expiry[udn] = now + self._max_age(data)
+            watched = self._watched.get(udn)
+
+        if previous is None:
+            callback = self.on_added
+        elif previous[1].get('location') != data.get('location'):
+            if watched is not None:
+                watched.rebind(data['location'])
+            callback = self.on_address_changed
+        else:
+            return
+        if callback:
+            callback(udn, addr, data)
+
+    def remove(self, udn):
+        """ Remove a device from the registry. """
+        with self._lock:
+            previous = self.devices.pop(udn, None)
+            self._expiry.pop(udn, None)
+        if previous is not None and self.on_removed:
+            self.on_removed(udn, *previous)
+
+    def expire(self, now=None):
+        """ Remove all devices whose announcement has expired. """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [udn for udn, expiry in self._expiry.items()
+                       if expiry <= now]
+        for udn in expired:
+            self.remove(udn)
@@ -0,0 +1,359 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains the means to subscribe to UPnP (GENA) events of a
+device, so state changes are pushed by the device instead of being
+polled for.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import inspect
+import queue
+import re
+import socket
+import socketserver
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from xml.parsers import expat
+from . import discovery
+from . import health
+
+StreamMagic = discovery.StreamMagic
+
+
+class _CallbackServer(socketserver.ThreadingMixIn, HTTPServer):
+    """ HTTP server that handles each NOTIFY request in a daemon thread
+        (http.server.ThreadingHTTPServer requires Python 3.7).
+    """
+    daemon_threads = True
+
+
+class LastChangeParser:
+    """ Incremental parser for the property sets sent with NOTIFY requests.
+
+        The state variables of each service are remembered, so parse()
+        only returns the variables whose value actually changed.
+        Variables reported inside a LastChange document
+        (<Event><InstanceID val="0"><Volume channel="Master" val="10"/>...)
+        are returned by name, with ":<channel>" appended for channels
+        other than Master. Other properties are returned by tag name.
+    """
+
+    def __init__(self):
+        """ Initialize instance. """
+        self.state = dict()  # {service type: {variable: value}}
+
+    @staticmethod
+    def _properties(body):
+        """ Return a list of (name, text) tuples for the properties of
+            a propertyset document.
+        """
+        properties = []
+        depth = [0]
+        current = []
+
+        def start(name, attrs):
+            depth[0] += 1
+            # propertyset > property > variable
+            if depth[0] == 3:
+                current[:] = [name.split(':')[-1], []]
+
+        def end(name):
+            if depth[0] == 3 and current:
+                properties.append((current[0], ''.join(current[1])))
+                current[:] = []
+            depth[0] -= 1
+
+        def text(data):
+            if current:
+                current[1].append(data)
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text
+        parser.Parse(body, True)
+        return properties
+
+    @staticmethod
+    def _last_change(document):
+        """ Return a list of (name, value) tuples for the variables in a
+            LastChange document.
+        """
+        variables = []
+
+        def start(name, attrs):
+            if name in ('Event', 'InstanceID') or 'val' not in attrs:
+                return
+            channel = attrs.get('channel')
+            if channel and channel != 'Master':
+                name = '%s:%s' % (name, channel)
+            variables.append((name, attrs['val']))
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start
+        parser.Parse(document, True)
+        return variables
+
+    def parse(self, service_type, body):
+        """ Return a {variable: value} dict of the variables of the
+            service that changed according to the NOTIFY body.
+        """
+        variables = []
+        for name, text in self._properties(body):
+            if name == 'LastChange':
+                if text.strip():
+                    variables.extend(self._last_change(text))
+            else:
+                variables.append((name, text))
+
+        state = self.state.setdefault(service_type, dict())
+        changes = dict()
+        for name, value in variables:
+            if state.get(name) != value:
+                state[name] = value
+                changes[name] = value
+        return changes
+
+
+class EventSubscriber:
+    """ Subscribe to the events of a StreamMagicDevice's services.
+
+        A small HTTP server is started to receive the NOTIFY requests sent
+        by the device. Each change is put into self.queue as a
+        (service type, {variable: value}) tuple and passed to the
+        optional callback(service_type, changes). Subscriptions are
+        renewed automatically before they time out.
+
+        If a subscription can neither be renewed nor made again, its loss
+        is reported as (service type, None) and subscribing is retried
+        with the delays of retry until it succeeds or stop() is called.
+        The variables reported after that are all current values of the
+        service, not only the changed ones.
+
+        device: StreamMagicDevice object (an AsyncStreamMagicDevice is
+                rejected with TypeError; its requests are coroutines)
+        services: service types to subscribe to
+        callback: function called with (service_type, changes)
+        timeout: requested subscription duration in seconds
+        address: (ip, port) for the callback server; by default the
+                 address of the interface used to reach the device
+        retry: health.RetryPolicy for subscribing again after a lost
+               subscription; its number of retries is ignored
+    """
+
+    DEFAULT_SERVICES = (StreamMagic.URN_AVTransport,
+                        StreamMagic.URN_RenderingControl)
+
+    def __init__(self, device, services=DEFAULT_SERVICES, callback=None,
+                 timeout=1800, address=None, retry=None):
+        """ Initialize instance. Call start() to subscribe. """
+        if inspect.iscoroutinefunction(device.send_event_request):
+            raise TypeError('EventSubscriber requires a StreamMagicDevice, '
+                            'not %s' % type(device).__name__)
+        self.device = device
+        self.services = services
+        self.callback = callback
+        self.timeout = timeout
+        self.address = address
+        self.retry = health.RetryPolicy(backoff=5, max_backoff=300) \
+            if retry is None else retry
+        self.queue = queue.Queue()
+        self.parser = LastChangeParser()
+        self.subscriptions = dict()  # {sid: service type}
+        self._timers = dict()        # {sid: threading.Timer}
+        self._retries = dict()       # {service type: threading.Timer}
+        self._running = False
+        self._lock = threading.Lock()
+        # held while subscribing, so the initial event sent by the device
+        # is only processed once the subscription id is known
+        self._subscribe_lock = threading.Lock()
+        self._path = '/%s' % uuid.uuid4().hex
+        self._httpd = None
+
+    def _local_address(self):
+        """ Return the local ip address used to reach the device. """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.connect((self.device.host, 1900))
+            return sock.getsockname()[0]
+        finally:
+            sock.close()
+
+    def _handler(self):
+        """ Return a request handler class for NOTIFY requests. """
+        subscriber = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Handle NOTIFY requests sent by the device. """
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_NOTIFY(self):
+                """ Process an event message. """
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                accepted = self.path == subscriber._path and \
+                    subscriber.handle_notify(self.headers.get('SID'), body)
+                self.send_response(200 if accepted else 412)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        return Handler
+
+    def start(self):
+        """ Start the callback server and subscribe to the services. """
+        address = self.address or (self._local_address(), 0)
+        self._httpd = _CallbackServer(address, self._handler())
+        self._running = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True,
+                         name='EventSubscriber').start()
+        for service_type in self.services:
+            self.subscribe(service_type)
+        return self
+
+    def stop(self):
+        """ Cancel all subscriptions and stop the callback server. """
+        with self._lock:
+            self._running = False
+            retries, self._retries = self._retries, dict()
+        for timer in retries.values():
+            timer.cancel()
+        for sid in list(self.subscriptions):
+            self.unsubscribe(sid)
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def callback_url(self):
+        """ Return the url NOTIFY requests are sent to. """
+        host, port = self._httpd.server_address[0:2]
+        return 'http://%s:%d%s' % (host, port, self._path)
+
+    def _request(self, method, service_type, headers):
+        """ Send a GENA request for the service and return the response,
+            or None if the request failed.
+        """
+        return self.device.send_event_request(method, service_type, headers)
+
+    def _timeout(self, response):
+        """ Return the subscription duration granted by the device. """
+        match = re.search(r'Second-(\d+)', response.headers.get('TIMEOUT', ''))
+        return int(match.group(1)) if match else self.timeout
+
+    def _schedule_renewal(self, sid, duration):
+        """ Renew the subscription shortly before it times out. """
+        timer = threading.Timer(max(duration * 0.8, 1), self.renew, (sid,))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.pop(sid, None)
+            self._timers[sid] = timer
+        if previous is not None:
+            previous.cancel()
+        timer.start()
+
+    def subscribe(self, service_type):
+        """ Subscribe to the events of a service and return the
+            subscription id, or None if subscribing failed.
+        """
+        with self._subscribe_lock:
+            response = self._request('SUBSCRIBE', service_type, {
+                'CALLBACK': '<%s>' % self.callback_url,
+                'NT': 'upnp:event',
+                'TIMEOUT': 'Second-%d' % self.timeout})
+            if response is None or not response.headers.get('SID'):
+                return None
+            sid = response.headers['SID']
+            with self._lock:
+                self.subscriptions[sid] = service_type
+        self._schedule_renewal(sid, self._timeout(response))
+        return sid
+
+    def renew(self, sid):
+        """ Renew a subscription. If the device doesn't know the
+            subscription anymore, subscribe again (see _resubscribe()).
+        """
+        service_type = self.subscriptions.get(sid)
+        if service_type is None:
+            return
+        response = self._request('SUBSCRIBE', service_type, {
+            'SID': sid, 'TIMEOUT': 'Second-%d' % self.timeout})
+        if response is None:
+            with self._lock:
+                self.subscriptions.pop(sid, None)
+                self._timers.pop(sid, None)
+            self._resubscribe(service_type)
+            return
+        self._schedule_renewal(sid, self._timeout(response))
+
+    def _resubscribe(self, service_type, attempt=0):
+        """ Subscribe to a service whose subscription was lost. If that
+            fails, report the loss (on the first attempt) and try again
+            after the delay for the attempt.
+        """
+        with self._lock:
+            self._retries.pop(service_type, None)
+            if not self._running:
+                return
+        if self.subscribe(service_type) is not None:
+            return
+        if attempt == 0:
+            with self._lock:
+                # report all values once subscribed again
+                self.parser.state.pop(service_type, None)
+            self._report(service_type, None)
+        timer = threading.Timer(self.retry.delay(attempt), self._resubscribe,
+                                (service_type, attempt + 1))
+        timer.daemon = True
+        with self._lock:
+            if not self._running:
+                return
+            self._retries[service_type] = timer
+        timer.start()
+
+    def unsubscribe(self, sid):
+        """ Cancel a subscription. """
+        with self._lock:
+            service_type = self.subscriptions.pop(sid, None)
+            timer = self._timers.pop(sid, None)
+        if timer is not None:
+            timer.cancel()
+        if service_type is not None:
+            self._request('UNSUBSCRIBE', service_type, {'SID': sid})
+
+    def handle_notify(self, sid, body):
+        """ Process the body of a NOTIFY request for the subscription.
+            Return False if the subscription is unknown.
+        """
+        with self._subscribe_lock:
+            service_type = self.subscriptions.get(sid)
+        if service_type is None:
+            return False
+        try:
+            with self._lock:
+                changes = self.parser.parse(service_type, body)
+        except expat.ExpatError:
+            return True
+        if changes:
+            self._report(service_type, changes)
+        return True
+
+    def _report(self, service_type, changes):
+        """ Put changes into the queue and pass them to the callback. """
+        self.queue.put((service_type, changes))
+        if self.callback:
+            self.callback(service_type, changes)
@@ -0,0 +1,275 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains a poller for large numbers of devices. Requests are
+sent concurrently with bounded global and per-device concurrency, and
+devices that don't respond are limited to a few worker threads, so they
+don't delay the devices that do.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from . import device
+
+# The state fields that can be polled and the device methods returning them
+FIELDS = {'power_state': 'get_power_state',
+          'transport_state': 'get_transport_state',
+          'volume': 'get_volume',
+          'mute': 'get_mute_state',
+          'audio_source': 'get_audio_source',
+          'shuffle': 'get_shuffle',
+          'repeat': 'get_repeat',
+          'track_info': 'get_current_track_info',
+          'current_preset': 'get_current_preset',
+          'playback_details': 'get_playback_details'}
+
+# Result of polling one device: the key it was added with, the
+# {field: value} and {field: time received} dicts (value and time are None
+# for fields that couldn't be retrieved), the fields that failed or timed
+# out, and the number of seconds polling the device took.
+FleetUpdate = namedtuple('FleetUpdate', [
+    'key', 'values', 'timestamps', 'errors', 'duration'])
+
+# Statistics returned by Fleet.stats(). staleness is a {key: seconds} dict
+# of the time since the last successful update of each device (None if
+# there never was one).
+FleetStats = namedtuple('FleetStats', [
+    'sweeps', 'last_sweep_duration', 'max_sweep_duration', 'devices',
+    'unhealthy', 'busy', 'staleness'])
+
+
+def _poll(method):
+    """ Return (result, time received) for a device method, with result
+        being None if the method failed.
+    """
+    try:
+        value = method()
+    except Exception:  # pylint: disable=broad-except
+        value = None
+    return value, time.time()
+
+
+class Fleet:
+    """ Poll the state of many StreamMagicDevice objects.
+
+        fields: names of the fields to poll (see FIELDS)
+        max_workers: number of requests sent concurrently in total
+        per_device: number of requests sent concurrently to one device
+        max_unhealthy: number of requests sent concurrently to devices
+                       whose last poll failed; defaults to a quarter of
+                       max_workers
+    """
+
+    DEFAULT_FIELDS = ('power_state', 'transport_state', 'volume', 'mute',
+                      'audio_source')
+
+    def __init__(self, fields=DEFAULT_FIELDS, max_workers=32, per_device=1,
+                 max_unhealthy=None):
+        """ Initialize instance. """
+        for field in fields:
+            if field not in FIELDS:
+                raise ValueError("Unknown field: %s" % field)
+        self.fields = tuple(fields)
+        self.max_workers = max_workers
+        self.per_device = per_device
+        self.max_unhealthy = max_unhealthy or max(1, max_workers // 4)
+        self.devices = dict()       # {key: StreamMagicDevice}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._unhealthy = set()     # keys of devices whose last poll failed
+        self._busy = dict()         # {key: requests left over from a sweep}
+        self._last_success = dict()  # {key: time.monotonic()}
+        self._sweeps = 0
+        self._last_duration = None
+        self._max_duration = None
+
+    def add(self, key, dev):
+        """ Add a device to the fleet. """
+        with self._lock:
+            self.devices[key] = dev
+
+    def add_discovered(self, addr, data, **kwargs):
+        """ Add a device from an (addr, data) tuple returned by discovery,
+            keyed by its USN (or address). The device is created lazily,
+            additional keyword arguments are passed to StreamMagicDevice.
+            Return the key.
+        """
+        key = data.get('usn') or '%s:%d' % tuple(addr[0:2])
+        kwargs.setdefault('lazy', True)
+        self.add(key, device.StreamMagicDevice(
+            addr[0], addr[1], data.get('server'), data.get('location'),
+            ssdp_headers=data, **kwargs))
+        return key
+
+    def remove(self, key):
+        """ Remove a device from the fleet and return it. """
+        with self._lock:
+            dev = self.devices.pop(key, None)
+            self._unhealthy.discard(key)
+            self._last_success.pop(key, None)
+        return dev
+
+    def __len__(self):
+        return len(self.devices)
+
+    def close(self):
+        """ Stop the worker threads and close all devices. """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        for dev in list(self.devices.values()):
+            dev.close()
+
+    def _release(self, key):
+        """ Note that a request left over from a timed out sweep is done. """
+        with self._lock:
+            self._busy[key] -= 1
+            if not self._busy[key]:
+                del self._busy[key]
+
+    def sweep(self, timeout=None):
+        """ Poll all devices once and yield a FleetUpdate for each device
+            as soon as all of its fields have been retrieved.
+
+            Devices that responded to the previous poll are polled first.
+            When the timeout (in seconds) expires, an update with the
+            missing fields in its errors is yielded for every device that
+            isn't done yet; devices with requests still running then are
+            skipped by the following sweeps until those have finished.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix='Fleet')
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._lock:
+            devices = [(key, dev) for key, dev in self.devices.items()
+                       if key not in self._busy]
+            unhealthy = set(self._unhealthy)
+        devices.sort(key=lambda item: item[0] in unhealthy)
+
+        ready = deque(devices)   # devices that can send another request
+        remaining = {key: list(self.fields) for key, _ in devices}
+        results = {key: dict() for key, _ in devices}
+        running = {key: 0 for key, _ in devices}
+        futures = dict()         # {future: (key, device, field)}
+        sick = 0                 # requests running for unhealthy devices
+
+        while ready or futures:
+            deferred = []
+            while ready and len(futures) < self.max_workers:
+                key, dev = ready.popleft()
+                if key in unhealthy and sick >= self.max_unhealthy:
+                    deferred.append((key, dev))
+                    continue
+                while remaining[key] and running[key] < self.per_device \
+                        and len(futures) < self.max_workers:
+                    field = remaining[key].pop(0)
+                    future = self._executor.submit(
+                        _poll, getattr(dev, FIELDS[field]))
+                    futures[future] = (key, dev, field)
+                    running[key] += 1
+                    if key in unhealthy:
+                        sick += 1
+                        if sick >= self.max_unhealthy:
+                            break
+                if remaining[key] and running[key] < self.per_device:
+                    ready.appendleft((key, dev))
+                    if len(futures) >= self.max_workers:
+                        break
+            ready.extend(deferred)
+            if not futures:
+                break
+
+            wait_time = None if deadline is None \
+                else max(0, deadline - time.monotonic())
+            done = wait(futures, wait_time, FIRST_COMPLETED)[0]
+            if not done:
+                for update in self._abort(futures, results, start):
+                    yield update
+                break
+
+            for future in done:
+                key, dev, field = futures.pop(future)
+                running[key] -= 1
+                if key in unhealthy:
+                    sick -= 1
+                results[key][field] = future.result()
+                if remaining[key] and running[key] == self.per_device - 1:
+                    ready.append((key, dev))
+                elif not remaining[key] and not running[key]:
+                    yield self._update(key, results.pop(key), start)
+
+        duration = time.monotonic() - start
+        with self._lock:
+            self._sweeps += 1
+            self._last_duration = duration
+            self._max_duration = max(self._max_duration or 0, duration)
+
+    def _abort(self, futures, results, start):
+        """ Give up on the running requests of a timed out sweep and
+            return updates for the devices that aren't done.
+        """
+        for future, (key, _, _) in futures.items():
+            if future.cancel():
+                continue
+            with self._lock:
+                self._busy[key] = self._busy.get(key, 0) + 1
+            future.add_done_callback(
+                lambda future, key=key: self._release(key))
+        return [self._update(key, values, start)
+                for key, values in results.items()]
+
+    def _update(self, key, results, start):
+        """ Return the FleetUpdate for the {field: (value, time)} results
+            of a device and record whether the device responded.
+        """
+        values = dict()
+        timestamps = dict()
+        errors = []
+        for field in self.fields:
+            value, received = results.get(field, (None, None))
+            values[field] = value
+            timestamps[field] = received if value is not None else None
+            if value is None:
+                errors.append(field)
+        with self._lock:
+            if len(errors) < len(self.fields):
+                self._unhealthy.discard(key)
+                self._last_success[key] = time.monotonic()
+            elif key in self.devices:
+                self._unhealthy.add(key)
+        return FleetUpdate(key, values, timestamps, tuple(errors),
+                           time.monotonic() - start)
+
+    def stream(self, interval=10, timeout=None):
+        """ Poll the devices every interval seconds (or continuously if a
+            sweep takes longer) and yield a FleetUpdate per device and
+            sweep. The timeout of a sweep defaults to the interval.
+        """
+        while True:
+            start = time.monotonic()
+            for update in self.sweep(timeout or interval):
+                yield update
+            time.sleep(max(0, start + interval - time.monotonic()))
+
+    def stats(self):
+        """ Return a FleetStats tuple. """
+        now = time.monotonic()
+        with self._lock:
+            return FleetStats(
+                sweeps=self._sweeps,
+                last_sweep_duration=self._last_duration,
+                max_sweep_duration=self._max_duration,
+                devices=len(self.devices),
+                unhealthy=len(self._unhealthy),
+                busy=len(self._busy),
+                staleness={key: now - self._last_success[key]
+                           if key in self._last_success else None
+                           for key in self.devices})
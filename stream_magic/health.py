@@ -0,0 +1,177 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains the health tracking of devices: a retry policy for
+requests that can safely be repeated, and a circuit breaker that makes
+requests to a device fail right away while it is known to be offline
+(e.g. in ECO standby, which drops all packets), and probes it in the
+background until it answers again.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import random
+import threading
+import time
+
+# Actions besides Get* that only read the state of the device
+READ_ACTIONS = frozenset(('Shuffle', 'Repeat', 'IsRegisteredNavigatorId'))
+
+# States of a CircuitBreaker
+CLOSED = 'closed'        # requests are sent
+OPEN = 'open'            # requests fail right away
+HALF_OPEN = 'half_open'  # a single trial request is sent
+
+
+def is_idempotent(action):
+    """ Return True if an action only reads the state of the device, so
+        it can be repeated after a failure.
+    """
+    return action.startswith('Get') or action in READ_ACTIONS
+
+
+class RetryPolicy:
+    """ Exponential backoff with jitter for repeating failed requests.
+
+        retries: number of times a failed request is repeated
+        backoff: delay in seconds before the first retry; doubles with
+                 every further retry
+        max_backoff: longest delay in seconds
+        jitter: fraction (0..1) of the delay that is randomized, so
+                requests of many clients don't retry in lockstep
+    """
+
+    def __init__(self, retries=2, backoff=0.05, max_backoff=1.0,
+                 jitter=0.5):
+        """ Initialize instance. """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """ Return the number of seconds to wait before retry number
+            attempt (starting at 0).
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+
+class CircuitBreaker:
+    """ Track whether a device responds and reject requests while it
+        doesn't.
+
+        After failure_threshold consecutive failures the breaker opens:
+        allow() returns False until reset_timeout seconds have passed, then
+        a single trial request is allowed (half-open state). Its success
+        closes the breaker, its failure opens it again with the timeout
+        doubled, up to max_reset_timeout.
+
+        probe: optional function returning True if the device responds.
+               While the breaker is open, it is called from a background
+               thread whenever the reset timeout expires, so the breaker
+               closes as soon as the device is back, without a request
+               having to fail first.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=5,
+                 max_reset_timeout=60, probe=None):
+        """ Initialize instance. """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0        # consecutive failures
+        self.opened = 0          # number of times the breaker opened
+        self.rejected = 0        # number of requests rejected
+        self._timeout = reset_timeout
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._prober = None
+        self._closed = False
+
+    def allow(self, now=None):
+        """ Return True if a request may be sent to the device. """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now >= self._retry_at:
+                self.state = HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    @property
+    def is_open(self):
+        """ Return True if requests are currently rejected. """
+        return self.state == OPEN
+
+    def record_success(self):
+        """ Note that the device responded. """
+        with self._lock:
+            self.failures = 0
+            self.state = CLOSED
+            self._timeout = self.reset_timeout
+            self._wakeup.notify_all()
+
+    def record_failure(self, now=None):
+        """ Note that a request to the device failed. """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+            elif self.state == OPEN or \
+                    self.failures < self.failure_threshold:
+                return
+            self.state = OPEN
+            self.opened += 1
+            self._retry_at = now + self._timeout
+            if self.probe is not None and self._prober is None \
+                    and not self._closed:
+                self._prober = threading.Thread(
+                    target=self._probe_loop, daemon=True,
+                    name='CircuitBreakerProbe')
+                self._prober.start()
+
+    def retry_in(self):
+        """ Return the number of seconds until the next trial request is
+            allowed (0 if requests are allowed now).
+        """
+        with self._lock:
+            if self.state != OPEN:
+                return 0
+            return max(0, self._retry_at - time.monotonic())
+
+    def _probe_loop(self):
+        """ Probe the device whenever the reset timeout expires, until it
+            responds or the breaker is closed.
+        """
+        while True:
+            with self._lock:
+                while not self._closed and self.state != CLOSED and \
+                        time.monotonic() < self._retry_at:
+                    self._wakeup.wait(self._retry_at - time.monotonic())
+                if self._closed or self.state == CLOSED:
+                    self._prober = None
+                    return
+                self.state = HALF_OPEN
+            try:
+                responded = self.probe()
+            except Exception:  # pylint: disable=broad-except
+                responded = False
+            if responded:
+                self.record_success()
+            else:
+                self.record_failure()
+
+    def close(self):
+        """ Stop probing the device. """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify_all()
@@ -0,0 +1,236 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains the collection of request metrics: counters and
+latency histograms per device, service and action, which can be exported
+in the Prometheus text format or as JSON, or passed on to a hook.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import json
+import threading
+import time
+from collections import namedtuple
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# A completed request as passed to the hooks:
+# device: host of the device, service: short service name (e.g.
+# 'AVTransport'), action: SOAP action or request type, status: 'ok',
+# 'timeout', 'error', 'http_error' or 'fault', code: HTTP status or UPnP
+# error code (None if not applicable), phases: {phase: seconds} dict with
+# any of 'connect', 'request', 'response', 'parse' and 'total', bytes_out
+# and bytes_in: size of the request and response bodies.
+RequestEvent = namedtuple('RequestEvent', [
+    'device', 'service', 'action', 'status', 'code', 'phases', 'bytes_out',
+    'bytes_in', 'timestamp'])
+
+# Descriptions of the exported metrics
+HELP = {
+    'stream_magic_requests_total': 'Requests by result status.',
+    'stream_magic_request_seconds': 'Request latency by phase.',
+    'stream_magic_soap_faults_total': 'SOAP faults by UPnP error code.',
+    'stream_magic_bytes_sent_total': 'Request body bytes sent.',
+    'stream_magic_bytes_received_total': 'Response body bytes received.',
+    'stream_magic_ssdp_replies_total': 'SSDP replies received.',
+}
+
+
+def service_name(service_type):
+    """ Return the short name of a service type, e.g. 'AVTransport' for
+        urn:schemas-upnp-org:service:AVTransport:1.
+    """
+    parts = service_type.split(':')
+    return parts[-2] if len(parts) > 2 else service_type
+
+
+class Histogram:
+    """ Counts of observed values per bucket, plus their sum. """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """ Initialize instance. """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ Add a value. """
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Return (upper bound, count of values <= bound) tuples,
+            ending with ('+Inf', count).
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append(('+Inf', self.count))
+        return result
+
+
+class Metrics:
+    """ Collects counters and histograms, each identified by a metric
+        name and a tuple of (label, value) pairs.
+
+        Devices record their requests in REGISTRY unless their
+        metrics_registry attribute is set to another Metrics object
+        (or to None to disable recording).
+
+        buckets: upper bounds of the latency histogram buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """ Initialize instance. """
+        self.buckets = buckets
+        self.hooks = []
+        self._lock = threading.Lock()
+        self._counters = dict()    # {(name, labels): value}
+        self._histograms = dict()  # {(name, labels): Histogram}
+
+    def add_hook(self, hook):
+        """ Call hook(event) with a RequestEvent for every request. """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """ Stop calling a hook. """
+        self.hooks.remove(hook)
+
+    def inc(self, name, labels, value=1):
+        """ Increase a counter. """
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        """ Add a value to a histogram. """
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def record(self, event):
+        """ Update the metrics for a RequestEvent and pass it to the
+            hooks.
+        """
+        labels = (('device', event.device), ('service', event.service),
+                  ('action', event.action))
+        self.inc('stream_magic_requests_total',
+                 labels + (('status', event.status),))
+        for phase, seconds in event.phases.items():
+            self.observe('stream_magic_request_seconds',
+                         labels + (('phase', phase),), seconds)
+        if event.status == 'fault':
+            self.inc('stream_magic_soap_faults_total',
+                     labels + (('code', str(event.code)),))
+        if event.bytes_out:
+            self.inc('stream_magic_bytes_sent_total', labels,
+                     event.bytes_out)
+        if event.bytes_in:
+            self.inc('stream_magic_bytes_received_total', labels,
+                     event.bytes_in)
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    def request(self, device, service, action, status, code=None,
+                phases=None, bytes_out=0, bytes_in=0):
+        """ Record a request, see RequestEvent for the parameters. """
+        self.record(RequestEvent(device, service, action, status, code,
+                                 phases or dict(), bytes_out, bytes_in,
+                                 time.time()))
+
+    def reset(self):
+        """ Remove all collected values. """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """ Return the collected values as a dict that can be encoded as
+            JSON: {'counters': [{'name', 'labels', 'value'}, ...],
+            'histograms': [{'name', 'labels', 'buckets', 'sum', 'count'}]}
+            with buckets being a list of [upper bound, cumulative count].
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, hist.cumulative(), hist.sum, hist.count)
+                 for key, hist in self._histograms.items()),
+                key=lambda item: item[0])
+        return {
+            'counters': [{'name': name, 'labels': dict(labels),
+                          'value': value}
+                         for (name, labels), value in counters],
+            'histograms': [{'name': name, 'labels': dict(labels),
+                            'buckets': [list(bucket) for bucket in buckets],
+                            'sum': total, 'count': count}
+                           for (name, labels), buckets, total, count
+                           in histograms]}
+
+    def to_json(self):
+        """ Return snapshot() as JSON string. """
+        return json.dumps(self.snapshot())
+
+    @staticmethod
+    def _labels(labels):
+        """ Return labels in the Prometheus text format. """
+        if not labels:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in labels)
+
+    def to_prometheus(self):
+        """ Return the collected values in the Prometheus text format. """
+        snapshot = self.snapshot()
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in HELP:
+                    lines.append('# HELP %s %s' % (name, HELP[name]))
+                lines.append('# TYPE %s %s' % (name, kind))
+
+        for counter in snapshot['counters']:
+            header(counter['name'], 'counter')
+            lines.append('%s%s %s' % (
+                counter['name'],
+                self._labels(list(counter['labels'].items())),
+                counter['value']))
+        for hist in snapshot['histograms']:
+            name = hist['name']
+            labels = list(hist['labels'].items())
+            header(name, 'histogram')
+            for bound, count in hist['buckets']:
+                lines.append('%s_bucket%s %d' % (
+                    name, self._labels(labels + [('le', bound)]), count))
+            lines.append('%s_sum%s %r' % (name, self._labels(labels),
+                                          hist['sum']))
+            lines.append('%s_count%s %d' % (name, self._labels(labels),
+                                            hist['count']))
+        return '\n'.join(lines) + '\n'
+
+
+# Default Metrics object all requests are recorded in
+REGISTRY = Metrics()
@@ -0,0 +1,156 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains a lightweight XML parser for the responses of a
+device. Instead of building a DOM for every value that is looked up, all
+requested values are extracted in a single (expat based) pass over the
+document, which stops as soon as everything has been found.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+from xml.parsers import expat
+
+
+class _Done(Exception):
+    """ Raised by the parser callbacks to stop parsing early. """
+
+
+def _split(spec):
+    """ Split a 'parent/tag' spec into (tag, parent or None). """
+    parent, _, tag = spec.rpartition('/')
+    return tag, parent or None
+
+
+def extract(data, tags=(), attributes=()):
+    """ Return the text of the first occurrence of each of the tags and
+        the attributes of the first occurrence of each of the attributes
+        tags in one pass over the XML document data (str or bytes).
+
+        Tags are matched by their qualified name (e.g. 'upnp:artist'), and
+        can be restricted to elements with a specific parent element by
+        specifying them as 'parent/tag'.
+
+        Returns a (texts, attrs) tuple of {spec: text} and
+        {spec: {attribute: value}} dicts. Tags that weren't found are
+        missing from the dicts.
+    """
+    text_specs = dict()
+    for spec in tags:
+        text_specs.setdefault(_split(spec)[0], []).append(spec)
+    attr_specs = dict()
+    for spec in attributes:
+        attr_specs.setdefault(_split(spec)[0], []).append(spec)
+
+    texts = dict()
+    attrs = dict()
+    wanted = len(set(tags)) + len(set(attributes))
+    stack = []
+    collecting = []   # [(spec, chunks, depth)] for the open text elements
+
+    def matches(spec, name):
+        parent = _split(spec)[1]
+        return parent is None or (len(stack) > 1 and stack[-2] == parent)
+
+    def start(name, attributes):
+        stack.append(name)
+        for spec in attr_specs.get(name, ()):
+            if spec not in attrs and matches(spec, name):
+                attrs[spec] = attributes
+        for spec in text_specs.get(name, ()):
+            if spec not in texts and matches(spec, name) and \
+                    spec not in [c[0] for c in collecting]:
+                collecting.append((spec, [], len(stack)))
+        if not collecting and len(texts) + len(attrs) == wanted:
+            raise _Done()
+
+    def end(name):
+        depth = len(stack)
+        while collecting and collecting[-1][2] == depth:
+            spec, chunks, _ = collecting.pop()
+            texts[spec] = ''.join(chunks)
+        stack.pop()
+        if not collecting and len(texts) + len(attrs) == wanted:
+            raise _Done()
+
+    def text(data):
+        for _, chunks, _ in collecting:
+            chunks.append(data)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text
+    try:
+        parser.Parse(data, True)
+    except _Done:
+        pass
+    return texts, attrs
+
+
+def get_values(data, tags):
+    """ Return a {tag: text} dict for the first occurrence of the tags
+        in the XML document data. See extract().
+    """
+    return extract(data, tags)[0]
+
+
+def get_value(data, tag, default='n/a'):
+    """ Return the text of the first occurrence of the tag in the XML
+        document data, or default if there is no such tag.
+    """
+    return extract(data, (tag,))[0].get(tag, default)
+
+
+def get_elements(data, tag, child_tags=()):
+    """ Return a list of (attributes, {child tag: text}) tuples for all
+        occurrences of the tag in the XML document data, with the texts of
+        the first occurrence of each of the child_tags within the element.
+    """
+    elements = []
+    current = []     # [attributes, texts, depth] of the open element
+    collecting = []  # [child tag, chunks] of the open child element
+    depth = [0]
+
+    def start(name, attributes):
+        depth[0] += 1
+        if name == tag and not current:
+            current[:] = [attributes, dict(), depth[0]]
+        elif current and name in child_tags and name not in current[1] \
+                and not collecting:
+            collecting[:] = [name, []]
+
+    def end(name):
+        if collecting and name == collecting[0]:
+            current[1][name] = ''.join(collecting[1])
+            collecting[:] = []
+        elif current and depth[0] == current[2]:
+            elements.append((current[0], current[1]))
+            current[:] = []
+        depth[0] -= 1
+
+    def text(data):
+        if collecting:
+            collecting[1].append(data)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text
+    parser.Parse(data, True)
+    return elements
+
+
+def seconds(hms):
+    """ Return the number of seconds of a H:MM:SS time value (as found in
+        responses, e.g. AbsTime) or None if it isn't one.
+    """
+    try:
+        hours, minutes, secs = hms.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(secs)
+    except (AttributeError, ValueError):
+        return None
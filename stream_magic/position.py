@@ -0,0 +1,251 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains a tracker for the playback position of a device:
+the position is sampled once and then extrapolated from a monotonic
+clock while the device is playing, so a progress bar can be updated
+every second without sending requests to the device every second.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import threading
+import time
+from . import parser
+
+# Transport states the position advances in
+ADVANCING_STATES = frozenset(('PLAYING',))
+
+# Minimum number of seconds between samples taken because the end of the
+# track was reached, in case the device's clock is behind
+END_OF_TRACK_INTERVAL = 1
+
+
+def format_time(seconds):
+    """ Return a number of seconds as H:MM:SS string. """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class PositionTracker:
+    """ Track the playback position of a StreamMagicDevice.
+
+        A sample of the transport state and the position info is taken
+        once; the position is then extrapolated while the device is
+        playing and frozen while it is paused or stopped. A new sample is
+        taken when the transport state or the track changes (as reported
+        by update() or handle_event(), or noticed by a verification),
+        after seek(), and when the extrapolated position reaches the end
+        of the track.
+
+        verify_interval: number of seconds between verifications, which
+                         sample the transport state and position without
+                         the audio source (None: never verify)
+        idle_verify_interval: number of seconds between verifications
+                         while there is no position to track (e.g. the
+                         audio source isn't "media player"), which only
+                         sample the audio source and transport state
+                         (None: never verify)
+        drift_threshold: number of seconds the sampled position may differ
+                         from the extrapolated one before it is adopted,
+                         so the position doesn't jump back and forth by
+                         the second-resolution of the device's clock
+        clock: function returning the current time in seconds
+    """
+
+    def __init__(self, device, verify_interval=15, drift_threshold=1.5,
+                 clock=time.monotonic, idle_verify_interval=60):
+        """ Initialize instance. """
+        self.device = device
+        self.verify_interval = verify_interval
+        self.idle_verify_interval = idle_verify_interval
+        self.drift_threshold = drift_threshold
+        self.clock = clock
+        self.audio_source = None
+        self.transport_state = None
+        self.track_uri = None
+        self.length = None      # track length in seconds
+        self.samples = 0        # number of samples taken
+        self.corrections = 0    # number of times drift was corrected
+        self._track_info = None
+        self._position = None   # position in seconds at self._sampled
+        self._sampled = None    # self.clock() of the sample
+        self._verify_at = None
+        self._stale = True      # a new sample is needed
+        self._lock = threading.RLock()
+
+    def _sample_position(self, with_position=True):
+        """ Return (transport state, device.get_position_info(), time)
+            with time being the estimated self.clock() at which the device
+            read its position.
+        """
+        state = self.device.get_transport_state()
+        start = self.clock()
+        info = None
+        if with_position:
+            info = self.device.get_position_info()
+        return state, info, (start + self.clock()) / 2
+
+    def sync(self):
+        """ Take a new sample of the audio source, transport state and
+            position info. Return False if the device didn't respond.
+        """
+        with self._lock:
+            source = self.device.get_audio_source()
+            state, info, sampled = self._sample_position(
+                source == "media player")
+            self.samples += 1
+            if state is None:
+                return False
+            self.audio_source = source
+            self._adopt(state, info or dict(), sampled)
+            self._stale = False
+            return True
+
+    def _adopt(self, state, info, sampled):
+        """ Use a sample as the base of the extrapolation. """
+        self.transport_state = state
+        self.track_uri = info.get('trackURI')
+        self.length = parser.seconds(info.get('trackDuration'))
+        self._track_info = info.get('trackInfo')
+        self._position = parser.seconds(info.get('absTime'))
+        self._sampled = sampled
+        interval = self.verify_interval
+        if self._position is None:
+            interval = self.idle_verify_interval
+        self._verify_at = None
+        if interval is not None:
+            self._verify_at = sampled + interval
+
+    def _verify(self, now):
+        """ Sample the transport state and position and take a full sample
+            if the state or track changed, or adopt the position if it
+            drifted by more than drift_threshold.
+        """
+        if self._position is None:
+            self._verify_idle(now)
+            return
+        state, info, sampled = self._sample_position()
+        self.samples += 1
+        if state is None or info is None:
+            self._verify_at = now + self.verify_interval
+            return
+        if state != self.transport_state or \
+                info['trackURI'] != self.track_uri:
+            self.sync()
+            return
+        position = parser.seconds(info['absTime'])
+        expected = self._extrapolate(sampled)
+        if position is not None and (expected is None or abs(
+                position - expected) > self.drift_threshold):
+            self.corrections += 1
+            self._position = position
+            self._sampled = sampled
+        self._verify_at = sampled + self.verify_interval
+
+    def _verify_idle(self, now):
+        """ Sample the audio source and transport state and take a full
+            sample if either changed; without a position there is no track
+            or drift to check.
+        """
+        source = self.device.get_audio_source()
+        state = self.device.get_transport_state()
+        self.samples += 1
+        if source is not None and state is not None and (
+                source != self.audio_source or
+                state != self.transport_state):
+            self.sync()
+            return
+        self._verify_at = now + self.idle_verify_interval
+
+    def _extrapolate(self, now):
+        """ Return the position in seconds at time now, or None. """
+        if self._position is None:
+            return None
+        position = self._position
+        if self.transport_state in ADVANCING_STATES:
+            position += now - self._sampled
+        if self.length:
+            position = min(position, self.length)
+        return position
+
+    def position(self):
+        """ Return the current position in seconds, or None if it is not
+            known (e.g. the audio source isn't "media player").
+        """
+        with self._lock:
+            now = self.clock()
+            if self._stale:
+                self.sync()
+            elif self.transport_state in ADVANCING_STATES and \
+                    self.length and self._position is not None and \
+                    self._position + now - self._sampled >= self.length \
+                    and now - self._sampled >= END_OF_TRACK_INTERVAL:
+                # the track has ended, so another one may be playing
+                self.sync()
+            elif self._verify_at is not None and now >= self._verify_at:
+                self._verify(now)
+            return self._extrapolate(max(now, self._sampled or now))
+
+    def get_current_track_info(self):
+        """ Return the dict returned by device.get_current_track_info(),
+            with 'currentPos' set to the current position, or None if it
+            is not known (e.g. the audio source isn't "media player").
+        """
+        with self._lock:
+            position = self.position()
+            if self._track_info is None:
+                return None
+            info = dict(self._track_info)
+            if position is not None:
+                info['currentPos'] = format_time(position)
+            return info
+
+    def update(self, transport_state=None, track_uri=None):
+        """ Report a transport state or track uri learned by other means,
+            e.g. from events; the next call of position() takes a new
+            sample if it differs from the known one.
+        """
+        with self._lock:
+            if transport_state is not None and \
+                    transport_state != self.transport_state:
+                self._freeze()
+            elif track_uri is not None and track_uri != self.track_uri:
+                self._stale = True
+
+    def _freeze(self):
+        """ Stop extrapolating until the next sample is taken. """
+        now = self.clock()
+        if self._position is not None:
+            self._position = self._extrapolate(now)
+            self._sampled = now
+        self.transport_state = None
+        self._stale = True
+
+    def handle_event(self, service_type, changes):
+        """ Pass AVTransport changes received by an events.EventSubscriber
+            to update(); can be used as its callback. A lost subscription
+            (changes is None) makes the next call of position() take a new
+            sample.
+        """
+        if changes is None:
+            with self._lock:
+                self._stale = True
+            return
+        self.update(transport_state=changes.get('TransportState'),
+                    track_uri=changes.get('CurrentTrackURI'))
+
+    def seek(self, seek_target):
+        """ Seek to the position seek_target (see device.trnsprt_seek())
+            and take a new sample on the next call of position().
+        """
+        self.device.trnsprt_seek(seek_target)
+        with self._lock:
+            position = parser.seconds(seek_target)
+            if position is not None:
+                self._position = position
+                self._sampled = self.clock()
+            self._stale = True
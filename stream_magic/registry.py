@@ -0,0 +1,171 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains the registry of the actions a device supports, as
+defined by the SCPD documents of its services. The tables are built from
+compact records with interned names, and identical tables (e.g. those of
+devices with the same firmware) are shared between devices.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import sys
+import threading
+import weakref
+from collections.abc import Mapping
+
+# Service tables in use, keyed by their contents
+_tables = weakref.WeakValueDictionary()
+_tables_lock = threading.Lock()
+
+
+class Argument:
+    """ An argument of an action. Supports item access with the keys of
+        the dict returned by as_dict() (e.g. argument['direction']).
+    """
+
+    __slots__ = ('name', 'direction', 'related_state_variable')
+
+    _KEYS = {'direction': 'direction',
+             'relatedStateVariable': 'related_state_variable'}
+
+    def __init__(self, name, direction, related_state_variable):
+        """ Initialize instance. """
+        self.name = sys.intern(name)
+        self.direction = sys.intern(direction)
+        self.related_state_variable = sys.intern(related_state_variable)
+
+    def __getitem__(self, key):
+        if key == 'dataType':
+            return None
+        return getattr(self, self._KEYS[key])
+
+    def as_dict(self):
+        """ Return the argument as {'direction', 'relatedStateVariable',
+            'dataType'} dict.
+        """
+        return {'direction': self.direction,
+                'relatedStateVariable': self.related_state_variable,
+                'dataType': None}
+
+
+class Action(Mapping):
+    """ An action of a service: a read-only {argument name: Argument}
+        mapping in the order of the SCPD document.
+    """
+
+    __slots__ = ('name', 'arguments', 'in_arguments')
+
+    def __init__(self, name, arguments):
+        """ Initialize instance.
+
+            arguments: Argument objects
+        """
+        self.name = sys.intern(name)
+        self.arguments = tuple(arguments)
+        # names of the input arguments, in the order of the request
+        self.in_arguments = tuple(arg.name for arg in self.arguments
+                                  if arg.direction == 'in')
+
+    def __getitem__(self, name):
+        for arg in self.arguments:
+            if arg.name == name:
+                return arg
+        raise KeyError(name)
+
+    def __iter__(self):
+        return (arg.name for arg in self.arguments)
+
+    def __len__(self):
+        return len(self.arguments)
+
+
+class ServiceTable(Mapping):
+    """ The actions of a service: a read-only {action name: Action}
+        mapping. Use service_table() to create tables, so identical tables
+        are shared.
+    """
+
+    __slots__ = ('service_type', '_actions', '__weakref__')
+
+    def __init__(self, service_type, actions):
+        """ Initialize instance.
+
+            actions: Action objects
+        """
+        self.service_type = sys.intern(service_type)
+        self._actions = {action.name: action for action in actions}
+
+    def __getitem__(self, name):
+        return self._actions[name]
+
+    def __iter__(self):
+        return iter(self._actions)
+
+    def __len__(self):
+        return len(self._actions)
+
+
+def service_table(service_type, actions):
+    """ Return the ServiceTable for the actions of a service, given as
+        {action: {argument: {'direction': ..., 'relatedStateVariable': ...}}}
+        dict (or as ServiceTable). A table that is in use already is
+        returned instead of creating an identical one.
+    """
+    key = (service_type,) + tuple(
+        (action, tuple((name, info['direction'],
+                        info['relatedStateVariable'])
+                       for name, info in arguments.items()))
+        for action, arguments in actions.items())
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is None:
+            table = ServiceTable(service_type, (
+                Action(action, (Argument(*argument)
+                                for argument in arguments))
+                for action, arguments in key[1:]))
+            _tables[key] = table
+    return table
+
+
+def shared_tables():
+    """ Return the number of service tables in use. """
+    return len(_tables)
+
+
+class ActionRegistry(Mapping):
+    """ The actions of a device's services: a {service type: ServiceTable}
+        mapping, owned by one device.
+    """
+
+    __slots__ = ('_services',)
+
+    def __init__(self, services=None):
+        """ Initialize instance. """
+        self._services = dict()
+        if services:
+            self.update(services)
+
+    def __getitem__(self, service_type):
+        return self._services[service_type]
+
+    def __iter__(self):
+        return iter(self._services)
+
+    def __len__(self):
+        return len(self._services)
+
+    def update(self, services):
+        """ Add or replace the tables of services, given as {service type:
+            ServiceTable or actions dict} mapping (see service_table()).
+        """
+        for service_type, actions in services.items():
+            if not isinstance(actions, ServiceTable):
+                actions = service_table(service_type, actions)
+            self._services[actions.service_type] = actions
+
+    def clear(self):
+        """ Remove all services. """
+        self._services.clear()
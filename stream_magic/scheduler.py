@@ -0,0 +1,270 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains a polling scheduler that adapts the interval of each
+polled field to the state of the device: fields are polled often while
+the device changes its state or a track is about to end, and rarely while
+the device is idle. Callbacks are only called when a value changed.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import parser
+from .fleet import FIELDS
+
+# Polling intervals in seconds per device state and field
+INTERVALS = {
+    'transitioning': {'power_state': 10, 'transport_state': 0.5,
+                      'volume': 2, 'mute': 5, 'audio_source': 2,
+                      'track_info': 1},
+    'playing': {'power_state': 10, 'transport_state': 3, 'volume': 2,
+                'mute': 5, 'audio_source': 10, 'track_info': 10},
+    'stopped': {'power_state': 10, 'transport_state': 5, 'volume': 3,
+                'mute': 10, 'audio_source': 10, 'track_info': 30},
+    'idle': {'power_state': 10, 'transport_state': 60, 'volume': 60,
+             'mute': 60, 'audio_source': 60, 'track_info': 120},
+}
+
+# Fields that are polled right after the power state or transport state
+# changed, and around the end of the current track
+TRACK_FIELDS = ('transport_state', 'audio_source', 'track_info')
+
+
+def device_state(values):
+    """ Return the INTERVALS key for the {field: value} dict of a device:
+        'idle', 'transitioning', 'playing' or 'stopped'.
+    """
+    power = values.get('power_state')
+    if power is not None and power != 'on':
+        return 'idle'
+    transport = values.get('transport_state')
+    if transport == 'TRANSITIONING':
+        return 'transitioning'
+    if transport == 'PLAYING':
+        return 'playing'
+    return 'stopped'
+
+
+class PollScheduler:
+    """ Poll fields of devices with intervals that depend on the state of
+        each device and call callback(key, field, old, new) whenever a
+        value changed (including the first value retrieved for a field).
+
+        fields: names of the fields to poll (see fleet.FIELDS)
+        intervals: {state: {field: seconds}} dict, see INTERVALS
+        min_interval: shortest interval used near the end of a track
+        max_backoff: longest interval used for fields whose requests
+                     keep failing; the interval doubles with every failure
+        max_workers: number of requests sent concurrently
+    """
+
+    DEFAULT_FIELDS = ('power_state', 'transport_state', 'volume', 'mute',
+                      'audio_source', 'track_info')
+
+    def __init__(self, callback=None, fields=DEFAULT_FIELDS, intervals=None,
+                 min_interval=0.5, max_backoff=60, max_workers=4):
+        """ Initialize instance. Call start() to start polling. """
+        for field in fields:
+            if field not in FIELDS:
+                raise ValueError("Unknown field: %s" % field)
+        self.callback = callback
+        self.fields = tuple(fields)
+        self.intervals = intervals or INTERVALS
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self.max_workers = max_workers
+        self.devices = dict()   # {key: device}
+        self.values = dict()    # {key: {field: value}}
+        self.requests = 0       # number of polls so far
+        self._received = dict()  # {(key, field): time.monotonic()}
+        self._failures = dict()  # {(key, field): consecutive failures}
+        self._generation = dict()  # {(key, field): current schedule}
+        self._inflight = set()   # (key, field) tuples being polled
+        self._queue = []         # heap of (due, seq, key, field, generation)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._running = False
+
+    def add(self, key, dev):
+        """ Add a device; all its fields are polled right away. """
+        with self._cond:
+            self.devices[key] = dev
+            self.values[key] = dict()
+            now = time.monotonic()
+            for field in self.fields:
+                self._schedule(key, field, now)
+            self._cond.notify()
+
+    def remove(self, key):
+        """ Stop polling a device. """
+        with self._cond:
+            self.devices.pop(key, None)
+            self.values.pop(key, None)
+            for field in self.fields:
+                self._generation.pop((key, field), None)
+                self._failures.pop((key, field), None)
+                self._received.pop((key, field), None)
+
+    def _schedule(self, key, field, due):
+        """ (Re)schedule polling a field; replaces a scheduled poll. """
+        generation = self._generation.get((key, field), 0) + 1
+        self._generation[(key, field)] = generation
+        heapq.heappush(self._queue,
+                       (due, next(self._seq), key, field, generation))
+
+    def interval(self, key, field, now=None):
+        """ Return the number of seconds until a field is polled again. """
+        now = time.monotonic() if now is None else now
+        values = self.values.get(key, {})
+        state = device_state(values)
+        interval = self.intervals[state].get(field, 10)
+
+        if state == 'playing' and field in TRACK_FIELDS:
+            # poll right after the current track is expected to end
+            track_info = values.get('track_info') or {}
+            length = parser.seconds(track_info.get('trackLength'))
+            position = parser.seconds(track_info.get('currentPos'))
+            if length and position is not None:
+                left = length - position - \
+                    (now - self._received.get((key, 'track_info'), now))
+                if left > -self.min_interval:
+                    interval = min(interval, max(left + self.min_interval,
+                                                 self.min_interval))
+
+        failures = self._failures.get((key, field), 0)
+        if failures:
+            interval = min(interval * 2 ** failures,
+                           max(self.max_backoff, interval))
+        return interval
+
+    def _due(self, now):
+        """ Remove and return the (key, field) tuples that are due. """
+        due = []
+        with self._cond:
+            while self._queue and self._queue[0][0] <= now:
+                _, _, key, field, generation = heapq.heappop(self._queue)
+                if key not in self.devices or \
+                        self._generation.get((key, field)) != generation:
+                    continue
+                self._generation[(key, field)] = generation + 1
+                self._inflight.add((key, field))
+                due.append((key, field))
+        return due
+
+    def _poll(self, key, field, now=None):
+        """ Retrieve a field's value and process the result. """
+        dev = self.devices.get(key)
+        try:
+            value = getattr(dev, FIELDS[field])()
+        except Exception:  # pylint: disable=broad-except
+            value = None
+        self._handle(key, field, value, now)
+
+    def _handle(self, key, field, value, now=None):
+        """ Record a polled value, call the callback if it changed and
+            schedule the next poll(s).
+        """
+        now = time.monotonic() if now is None else now
+        with self._cond:
+            self.requests += 1
+            self._inflight.discard((key, field))
+            values = self.values.get(key)
+            if values is None:
+                return
+            old = values.get(field)
+            changed = value is not None and value != old
+            if value is None:
+                self._failures[(key, field)] = \
+                    self._failures.get((key, field), 0) + 1
+            else:
+                self._failures.pop((key, field), None)
+                values[field] = value
+                self._received[(key, field)] = now
+
+            if changed and field in ('power_state', 'transport_state') \
+                    and old is not None:
+                # the device changed its state: poll the track related
+                # fields now and adapt the schedule of the others
+                for other in self.fields:
+                    if other == field or (key, other) in self._inflight:
+                        continue
+                    due = now if other in TRACK_FIELDS \
+                        else now + self.interval(key, other, now)
+                    self._schedule(key, other, due)
+            self._schedule(key, field, now + self.interval(key, field, now))
+            self._cond.notify()
+
+        if changed and self.callback:
+            self.callback(key, field, old, value)
+
+    def run_pending(self, now=None):
+        """ Poll all fields that are due in the calling thread and return
+            the number of polls. Can be used instead of start() to drive
+            the scheduler from an own loop.
+        """
+        now = time.monotonic() if now is None else now
+        due = self._due(now)
+        for key, field in due:
+            self._poll(key, field, now)
+        return len(due)
+
+    def next_due(self):
+        """ Return the number of seconds until the next poll is due, or
+            None if nothing is scheduled.
+        """
+        with self._cond:
+            if not self._queue:
+                return None
+            return max(0, self._queue[0][0] - time.monotonic())
+
+    def start(self):
+        """ Start polling in a background thread. """
+        self._running = True
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix='PollScheduler')
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='PollScheduler')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop polling. """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        """ Submit the due polls until stopped. """
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                wait = None
+                if self._queue:
+                    wait = max(0, self._queue[0][0] - time.monotonic())
+                if wait is None or wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            for key, field in self._due(time.monotonic()):
+                self._executor.submit(self._poll, key, field)
@@ -0,0 +1,80 @@
+"""
+DLNA Digital Media Controller implementation for Cambridge Audio
+network audio players that are based on their StreamMagic platform.
+
+This module contains precompiled SOAP requests. The envelope, headers and
+control url of an action call are prepared once, so sending a request
+only requires escaping and splicing in the argument values.
+"""
+
+__version__ = '0.16'
+__author__ = 'Sebastian Kaps (sebk-666)'
+
+from xml.sax.saxutils import escape
+from . import discovery
+
+StreamMagic = discovery.StreamMagic
+
+
+class SoapRequest:
+    """ Precompiled request for calling an action with a fixed set of
+        arguments.
+
+        ctrl_url: control url of the service
+        host: value of the Host header
+        service_type: service type of the action
+        action: name of the action
+        arguments: names of the arguments in the order they are passed
+                   to build()
+        order: names of the arguments in the order they have to appear in
+               the request (e.g. as defined in the SCPD); arguments not
+               listed are appended in the order they are passed
+    """
+
+    __slots__ = ('ctrl_url', 'arguments', '_prefix', '_suffix', '_tags',
+                 '_indexes', '_headers')
+
+    def __init__(self, ctrl_url, host, service_type, action, arguments,
+                 order=()):
+        """ Initialize instance. """
+        self.ctrl_url = ctrl_url
+        self.arguments = tuple(arguments)
+        rank = {name: index for index, name in enumerate(order)}
+        self._indexes = tuple(sorted(
+            range(len(self.arguments)),
+            key=lambda i: (rank.get(self.arguments[i], len(rank)), i)))
+
+        self._prefix = ('<?xml version="1.0" encoding="utf-8"?>\n'
+                        '<s:Envelope xmlns:s="%s" s:encodingStyle="%s">\n'
+                        '<s:Body>\n'
+                        '<u:%s xmlns:u="%s">\n'
+                        % (StreamMagic.SOAP_ENVELOPE,
+                           StreamMagic.SOAP_ENCODING, action,
+                           service_type)).encode('utf-8')
+        self._suffix = ('</u:%s>\n'
+                        '</s:Body>\n'
+                        '</s:Envelope>\n' % action).encode('utf-8')
+        self._tags = tuple(
+            (('<%s>' % self.arguments[i]).encode('utf-8'),
+             ('</%s>\n' % self.arguments[i]).encode('utf-8'))
+            for i in self._indexes)
+        self._headers = {'SOAPACTION': '"%s#%s"' % (service_type, action),
+                         'Host': host,
+                         'Content-Type': 'text/xml; charset="utf-8"',
+                         'Accept': '*/*'}
+
+    def build(self, values):
+        """ Return the (body, headers) of a request with the argument
+            values (in the order of self.arguments). Values are converted
+            to str and XML escaped.
+        """
+        parts = [self._prefix]
+        for index, (start, end) in zip(self._indexes, self._tags):
+            parts.append(start)
+            parts.append(escape(str(values[index])).encode('utf-8'))
+            parts.append(end)
+        parts.append(self._suffix)
+        body = b''.join(parts)
+        headers = dict(self._headers)
+        headers['Content-Length'] = len(body)
+        return body, headers
@@ -1,12 +1,1111 @@
 """ stream_magic remote test suite
     Limit tests to those not requiring access to an actual device.
 """
+import asyncio
+import json
+import os
+import socket
+import ssl
 import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from xml.sax.saxutils import escape
+import pytest
 sys.path.append("..")
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
 from stream_magic import discovery
+from stream_magic import artwork
+from stream_magic import asyncdevice
+from stream_magic import cache
+from stream_magic import commands
+from stream_magic import connection
+from stream_magic import device
+from stream_magic import events
+from stream_magic import fleet
+from stream_magic import health
+from stream_magic import metrics
+from stream_magic import parser
+from stream_magic import position
+from stream_magic import registry
+from stream_magic import scheduler
+from stream_magic import soap
+from emulator import Emulator
+
+
+class FakeDevice:
+    """ Stand-in for a StreamMagicDevice: each method named in values
+        returns that value, or calls it if it is callable, or raises it if
+        it is an exception. Calls are recorded in self.calls.
+    """
+
+    def __init__(self, **values):
+        self.values = values
+        self.calls = []
+
+    def __getattr__(self, name):
+        try:
+            value = self.__dict__['values'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+        def method(*args):
+            self.calls.append((name,) + args)
+            if isinstance(value, BaseException):
+                raise value
+            return value(*args) if callable(value) else value
+        return method
+
+
+@pytest.fixture
+def local_server():
+    """ Return a function that starts a local HTTP/1.1 server, which
+        passes GET requests to handle(request_handler), and returns the
+        server's base url. The servers are stopped after the test.
+    """
+    servers = []
+
+    def start(handle):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                handle(self)
+
+        httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return 'http://127.0.0.1:%d' % httpd.server_address[1]
+
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def emulator():
+    """ Return a function that starts an emulated player (see
+        benchmarks/emulator.py) with the given options. The players are
+        stopped after the test.
+    """
+    players = []
+
+    def start(**options):
+        emu = Emulator(**options)
+        emu.start()
+        players.append(emu)
+        return emu
+
+    yield start
+    for emu in players:
+        emu.stop()
+
+
+def reply(handler, status, body=b'', headers=()):
+    """ Send a response from a request handler of local_server. """
+    handler.send_response(status)
+    for name, value in headers:
+        handler.send_header(name, value)
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def unused_port():
+    """ Return a local TCP port nothing is listening on. """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
 
 
 def test_object_instance():
     # test object creation
     sm_object = discovery.StreamMagic()
     assert isinstance(sm_object, discovery.StreamMagic)
+
+
+def test_connection_pool_reconnects_stale_connection(local_server):
+    """ A keep-alive connection closed by the server is replaced
+        transparently on the next request.
+    """
+    def handle(request):
+        reply(request, 200, b'ok')
+        # close without announcing it, leaving a stale socket behind
+        request.close_connection = True
+
+    url = local_server(handle) + '/'
+    pool = connection.ConnectionPool(maxsize=1, timeout=2)
+    try:
+        for _ in range(3):
+            response = pool.request('GET', url)
+            assert response.status == 200
+            assert response.data == b'ok'
+    finally:
+        pool.close()
+
+
+def test_connection_pool_schemes(monkeypatch):
+    """ https URLs are requested over TLS, by default on port 443; other
+        schemes are rejected.
+    """
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(2)
+    https_url = 'https://127.0.0.1:%d/' % listener.getsockname()[1]
+
+    def serve():
+        # answer the TLS handshakes in plain HTTP
+        for _ in range(2):
+            conn = listener.accept()[0]
+            conn.recv(4096)
+            conn.sendall(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+            conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    pool = connection.ConnectionPool(timeout=2)
+    with pytest.raises(ssl.SSLError):
+        pool.request('GET', https_url)
+    with pytest.raises(ValueError):
+        pool.request('GET', 'ftp://127.0.0.1/')
+
+    ports = []
+
+    def create_socket(host, port, timeout):
+        ports.append(port)
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr(pool, '_create_socket', create_socket)
+    with pytest.raises(ConnectionRefusedError):
+        pool.request('GET', 'https://127.0.0.1/')
+    assert ports == [443]
+    pool.close()
+
+    async def fetch(url):
+        pool = connection.AsyncConnectionPool(timeout=2)
+        try:
+            return await pool.request('GET', url)
+        finally:
+            pool.close()
+
+    with pytest.raises(ssl.SSLError):
+        asyncio.run(fetch(https_url))
+    with pytest.raises(ValueError):
+        asyncio.run(fetch('ftp://127.0.0.1/'))
+    listener.close()
+
+
+def test_async_connection_pool_keep_alive(local_server):
+    """ The asyncio connection pool reuses its connection and decodes
+        chunked responses.
+    """
+    peers = set()
+
+    def handle(request):
+        peers.add(request.client_address)
+        request.send_response(200)
+        request.send_header('Transfer-Encoding', 'chunked')
+        request.end_headers()
+        request.wfile.write(b'2\r\nok\r\n0\r\n\r\n')
+
+    url = local_server(handle) + '/'
+
+    async def fetch():
+        pool = connection.AsyncConnectionPool(maxsize=1, timeout=2)
+        try:
+            return [await pool.request('GET', url) for _ in range(3)]
+        finally:
+            pool.close()
+
+    responses = asyncio.run(fetch())
+    assert [r.data for r in responses] == [b'ok'] * 3
+    assert len(peers) == 1
+
+
+def test_iter_discover_stops_at_requested_host(monkeypatch):
+    """ iter_discover() yields a reply as soon as it arrives and stops
+        once the requested host has been found.
+    """
+
+    responder = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    responder.bind(('127.0.0.1', 0))
+    reply = (b'HTTP/1.1 200 OK\r\n'
+             b'CACHE-CONTROL: max-age=1800\r\n'
+             b'EXT:\r\n'
+             b'LOCATION: http://127.0.0.1:8080/description.xml\r\n'
+             b'SERVER: StreamMagic/1.0 UPnP/1.0\r\n'
+             b'USN: uuid:1234::upnp:rootdevice\r\n\r\n')
+
+    def respond():
+        data, addr = responder.recvfrom(65507)
+        if data.startswith(b'M-SEARCH'):
+            # answer twice to check the deduplication
+            responder.sendto(reply, addr)
+            responder.sendto(reply, addr)
+
+    threading.Thread(target=respond, daemon=True).start()
+    monkeypatch.setattr(discovery.StreamMagic, 'SSDP_GROUP',
+                        responder.getsockname())
+    start = time.monotonic()
+    try:
+        found = list(discovery.StreamMagic().iter_discover(host='127.0.0.1',
+                                                           timeout=5))
+    finally:
+        responder.close()
+    assert time.monotonic() - start < 2
+    assert len(found) == 1
+    assert found[0][1]['location'] == \
+        'http://127.0.0.1:8080/description.xml'
+    assert found[0][1]['ext'] == ''
+
+
+def test_ssdp_listener_registry(caplog):
+    """ NOTIFY messages add, rebind, expire and remove registry entries. """
+    seen = []
+    dev = FakeDevice(rebind=None)
+
+    def notify(nts, location, server=b'StreamMagic/1.0 UPnP/1.0'):
+        return (b'NOTIFY * HTTP/1.1\r\n'
+                b'HOST: 239.255.255.250:1900\r\n'
+                b'CACHE-CONTROL: max-age=100\r\n'
+                b'LOCATION: ' + location + b'\r\n'
+                b'NT: upnp:rootdevice\r\n'
+                b'NTS: ' + nts + b'\r\n'
+                b'SERVER: ' + server + b'\r\n'
+                b'USN: uuid:abcd::upnp:rootdevice\r\n\r\n')
+
+    listener = discovery.SSDPListener(
+        on_added=lambda *args: seen.append(('added',) + args),
+        on_removed=lambda *args: seen.append(('removed',) + args),
+        on_address_changed=lambda *args: seen.append(('moved',) + args))
+    listener.watch('uuid:abcd', dev)
+
+    addr = ('10.0.0.5', 1900)
+    listener.handle_message(addr, notify(b'ssdp:alive', b'http://10.0.0.5/d.xml'),
+                            now=0)
+    listener.handle_message(addr, notify(b'ssdp:alive', b'http://10.0.0.5/d.xml'),
+                            now=10)
+    listener.handle_message(('10.0.0.6', 1900),
+                            notify(b'ssdp:alive', b'http://10.0.0.6/d.xml'),
+                            now=20)
+    assert [e[0] for e in seen] == ['added', 'moved']
+    assert dev.calls == [('rebind', 'http://10.0.0.6/d.xml')]
+
+    listener.expire(now=119)
+    assert 'uuid:abcd' in listener.devices
+    listener.expire(now=120)
+    assert 'uuid:abcd' not in listener.devices
+    assert seen[-1][0] == 'removed'
+
+    listener.handle_message(addr, notify(b'ssdp:alive', b'http://10.0.0.5/d.xml'))
+    listener.handle_message(addr, notify(b'ssdp:byebye', b'', b''))
+    assert not listener.devices
+    assert [e[0] for e in seen] == ['added', 'moved', 'removed',
+                                    'added', 'removed']
+
+    # a failing callback doesn't stop the listener thread
+    messages = [notify(b'ssdp:alive', b'http://10.0.0.5/d.xml'),
+                socket.timeout(), notify(b'ssdp:byebye', b'', b''),
+                OSError()]
+
+    class Socket:
+        def recvfrom(self, size):
+            message = messages.pop(0)
+            if isinstance(message, Exception):
+                raise message
+            return message, addr
+
+    def fail(*args):
+        raise RuntimeError('callback failed')
+
+    listener.on_added = fail
+    listener._sock = Socket()
+    listener._running = True
+    listener._run()
+    assert listener.errors == 1 and not messages
+    assert not listener.devices and seen[-1][0] == 'removed'
+    assert 'callback failed' in caplog.text
+
+
+def test_rebind(emulator):
+    """ A rebound device sends its requests to the new host and port. """
+
+    old, new = emulator(), emulator()
+    dev = device.StreamMagicDevice(old.host, old.port, old.server,
+                                   old.location)
+    new.state.volume = 30
+    dev.rebind(new.location)
+    assert (dev.host, dev.port) == (new.host, new.port)
+    assert dev.get_volume() == '30'
+    headers = dev._build_request('GetVolume', 0,
+                                 discovery.StreamMagic.URN_RenderingControl,
+                                 False, {'Channel': 'Master'})[2]
+    assert headers['Host'] == '%s:%d' % (new.host, new.port)
+    dev.rebind('http://192.168.1.2/description.xml')
+    assert dev.port == 80
+    dev.close()
+
+
+def test_discovery_cache(tmp_path):
+    """ Cached discovery results expire and are dropped when the cached
+        location can't be reached anymore.
+    """
+
+    dcache = cache.DiscoveryCache(str(tmp_path / 'discovery.json'),
+                                  probe_timeout=0.2)
+    data = {'cache-control': 'max-age=60',
+            'location': 'http://127.0.0.1:9/description.xml',
+            'server': 'StreamMagic/1.0',
+            'usn': 'uuid:abcd::upnp:rootdevice'}
+    dcache.store([(('127.0.0.1', 1900), data)], now=1000)
+
+    assert dcache.get(now=1059) == [(('127.0.0.1', 1900), data)]
+    assert dcache.get(host='127.0.0.2', now=1059) == []
+    assert dcache.get(now=1060) == []
+
+    dcache.store([(('127.0.0.1', 1900), data)])
+    # nothing listens on the discard port, so the entry is stale
+    assert dcache.lookup() is None
+    assert dcache.get() == []
+
+
+def test_description_cache(tmp_path):
+    """ The description cache restores services and actions and uses a
+        new key when the firmware (BOOTID/CONFIGID) changes.
+    """
+
+    dcache = cache.DescriptionCache(str(tmp_path))
+    location = 'http://10.0.0.5:8080/description.xml'
+    key = dcache.key(location, udn='uuid:abcd', bootid='1', configid='7')
+    assert key != dcache.key(location, udn='uuid:abcd', bootid='2',
+                             configid='7')
+    assert dcache.get(key) is None
+
+    svc = 'urn:schemas-upnp-org:service:AVTransport:1'
+    services = {svc: {'scpdUrl': 'http://10.0.0.5:8080/AVT/scpd.xml',
+                      'ctrlUrl': 'http://10.0.0.5:8080/AVT/control'}}
+    dcache.put(key, services)
+    assert dcache.get(key) == (services, None)
+
+    actions = {svc: {'Play': {'InstanceID': {
+        'direction': 'in',
+        'relatedStateVariable': 'A_ARG_TYPE_InstanceID',
+        'dataType': None}}}}
+    dcache.put(key, services, actions)
+    assert dcache.get(key) == (services, actions)
+
+
+def test_description_cache_firmware_update(emulator, tmp_path):
+    """ Without BOOTID/CONFIGID headers, cached descriptions are keyed by
+        the root description, so they are read again after a firmware
+        update.
+    """
+
+    emu = emulator()
+    dcache = cache.DescriptionCache(str(tmp_path))
+    headers = {'usn': '%s::upnp:rootdevice' % emu.udn}
+    svc = discovery.StreamMagic.URN_RenderingControl
+
+    def actions():
+        dev = device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                       emu.location, scpd_cache=dcache,
+                                       ssdp_headers=headers)
+        dev.get_services()
+        dev.close()
+        return set(dev.get_actions(svc))
+
+    assert 'GetMute' in actions()
+    docs = emu._documents
+    docs['/RenderingControl/scpd.xml'] = docs[
+        '/RenderingControl/scpd.xml'].replace(b'GetMute', b'GetMuted')
+    assert 'GetMute' in actions()       # same firmware: cached
+    docs['/description.xml'] = docs['/description.xml'].replace(
+        b'</manufacturer>', b'</manufacturer><modelNumber>2</modelNumber>')
+    assert 'GetMuted' in actions()
+    assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_action_registry():
+    """ Devices have their own action registry, and identical service
+        tables are shared between them.
+    """
+
+    svc = 'urn:schemas-upnp-org:service:AVTransport:1'
+    actions = {svc: {'Seek': {
+        'InstanceID': {'direction': 'in',
+                       'relatedStateVariable': 'A_ARG_TYPE_InstanceID',
+                       'dataType': None},
+        'Unit': {'direction': 'in',
+                 'relatedStateVariable': 'A_ARG_TYPE_SeekMode',
+                 'dataType': None},
+        'Target': {'direction': 'in',
+                   'relatedStateVariable': 'A_ARG_TYPE_SeekTarget',
+                   'dataType': None}}}}
+    devs = [device.StreamMagicDevice(
+        '127.0.0.1', 1, 'StreamMagic', 'http://127.0.0.1:1/desc.xml',
+        lazy=True, circuit_breaker=False) for _ in range(2)]
+    devs[0].actions.update(actions)
+    assert not devs[1].actions
+    devs[1].actions.update(actions)
+    assert devs[0].actions[svc] is devs[1].actions[svc]
+    assert devs[0].actions[svc]['Seek'].in_arguments == \
+        ('InstanceID', 'Unit', 'Target')
+    assert devs[1].get_parameter_info(svc, 'Seek', 'Unit') == \
+        actions[svc]['Seek']['Unit']
+    assert registry.ActionRegistry(devs[0].actions)[svc] is \
+        devs[0].actions[svc]
+    for dev in devs:
+        dev.close()
+
+
+def test_update_actions(emulator, monkeypatch):
+    """ The SCPD documents are downloaded concurrently by up to
+        SCPD_WORKERS threads, skipping services whose download failed.
+    """
+
+    emu = emulator()
+    del emu._documents['/PlaylistExtension/scpd.xml']
+    monkeypatch.setattr(device, 'SCPD_WORKERS', 2)
+    dev = device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                   emu.location)
+    lock = threading.Lock()
+    active = []
+    peak = [0]
+    threads = set()
+    get_scpd = dev._get_scpd
+
+    def slow_get_scpd(scpd_url):
+        with lock:
+            active.append(scpd_url)
+            peak[0] = max(peak[0], len(active))
+            threads.add(threading.current_thread().name)
+        time.sleep(0.05)
+        try:
+            return get_scpd(scpd_url)
+        finally:
+            with lock:
+                active.remove(scpd_url)
+
+    dev._get_scpd = slow_get_scpd
+    services = set(dev.get_services())
+    assert peak[0] == 2 and len(threads) == 2
+    assert services == set(dev.services) - {
+        'urn:UuVol-com:service:PlaylistExtension:1'}
+    assert 'GetVolume' in dev.get_actions(
+        discovery.StreamMagic.URN_RenderingControl)
+    dev.close()
+
+
+def test_read_cache():
+    """ Cached responses expire after their action's TTL and can be
+        invalidated; protocol info is indexed by mime type and codec.
+    """
+
+    rcache = cache.ReadCache({'GetVolumeMax': 10})
+    rcache.put('GetVolumeMax', 'key', b'<r/>', now=100)
+    rcache.put('GetVolume', 'key', b'<r/>', now=100)
+    assert rcache.get('GetVolumeMax', 'key', now=109) == b'<r/>'
+    assert rcache.get('GetVolumeMax', 'key', now=110) is None
+    assert rcache.get('GetVolume', 'key', now=100) is None
+    rcache.put('GetVolumeMax', 'key', b'<r/>')
+    rcache.invalidate('GetVolumeMax')
+    assert rcache.get('GetVolumeMax', 'key') is None
+    assert (rcache.hits, rcache.misses) == (1, 2)
+
+    info = device.ProtocolInfo(['http-get:*:audio/x-flac:*',
+                                'http-get:*:audio/L16;rate=44100:*',
+                                'http-get:*:audio/mpeg:DLNA.ORG_PN=MP3'])
+    assert 'flac' in info and 'audio/x-flac' in info and 'MP3' in info
+    assert 'audio/l16' in info and 'pcm' in info and 'aac' not in info
+
+
+def test_album_art_cache(local_server, tmp_path):
+    """ Album art is fetched once for concurrent callers, revalidated
+        with a conditional request and evicted by size.
+    """
+    requests = []
+
+    def handle(request):
+        requests.append(request.headers.get('If-None-Match'))
+        time.sleep(0.05)
+        if request.headers.get('If-None-Match') == '"1"':
+            reply(request, 304)
+        else:
+            reply(request, 200, b'x' * 600, (('Content-Type', 'image/jpeg'),
+                                             ('ETag', '"1"')))
+
+    url = local_server(handle) + '/art/%d.jpg'
+    art = artwork.AlbumArtCache(max_bytes=1000, directory=str(tmp_path),
+                                max_age=60)
+    try:
+        threads = [threading.Thread(target=art.get, args=(url % 1,))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert requests == [None] and art.coalesced == 9
+        image = art.get(url % 1)
+        assert image.data == b'x' * 600 and image.content_type == 'image/jpeg'
+        assert art.get(url % 1, now=time.time() + 120) is image
+        assert requests == [None, '"1"'] and art.revalidated == 1
+
+        art.get(url % 2)
+        assert art.evictions == 1 and art.size == 600
+        # the evicted image is still on disk
+        assert art.get(url % 1) == image and art.disk_hits == 1
+        assert len(requests) == 3
+    finally:
+        art.close()
+
+
+def test_last_change_parser():
+    """ Only variables that changed since the last event are reported. """
+
+    def propertyset(event):
+        return ('<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">'
+                '<e:property><LastChange>%s</LastChange></e:property>'
+                '</e:propertyset>' % escape(event)).encode('utf-8')
+
+    svc = 'urn:schemas-upnp-org:service:RenderingControl:1'
+    last_change = events.LastChangeParser()
+    changes = last_change.parse(svc, propertyset(
+        '<Event><InstanceID val="0"><Volume channel="Master" val="10"/>'
+        '<Volume channel="LF" val="9"/><Mute channel="Master" val="0"/>'
+        '</InstanceID></Event>'))
+    assert changes == {'Volume': '10', 'Volume:LF': '9', 'Mute': '0'}
+
+    changes = last_change.parse(svc, propertyset(
+        '<Event><InstanceID val="0"><Volume channel="Master" val="11"/>'
+        '<Mute channel="Master" val="0"/></InstanceID></Event>'))
+    assert changes == {'Volume': '11'}
+
+
+def test_event_subscription_loss(emulator):
+    """ A subscription that can't be renewed is reported as lost and
+        made again once the device responds.
+    """
+
+    emu = emulator()
+    dev = device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                   emu.location)
+    svc = discovery.StreamMagic.URN_RenderingControl
+    sub = events.EventSubscriber(
+        dev, services=(svc,), address=('127.0.0.1', 0),
+        retry=health.RetryPolicy(backoff=0.05, max_backoff=0.1))
+    offline = threading.Event()
+    request = sub._request
+    sub._request = lambda *args: None if offline.is_set() else request(*args)
+    with sub:
+        assert sub.queue.get(timeout=2) == (svc, {'Volume': '12',
+                                                  'Mute': '0'})
+        lost = next(iter(sub.subscriptions))
+        offline.set()
+        sub.renew(lost)
+        assert sub.queue.get(timeout=2) == (svc, None)
+        assert not sub.subscriptions
+        offline.clear()
+        assert sub.queue.get(timeout=2) == (svc, {'Volume': '12',
+                                                  'Mute': '0'})
+        assert len(sub.subscriptions) == 1
+    # the lost subscription times out on the device
+    assert list(emu.subscriptions) == [lost]
+    dev.close()
+
+    with pytest.raises(TypeError):
+        events.EventSubscriber(asyncdevice.AsyncStreamMagicDevice(
+            emu.host, emu.port, emu.server, emu.location))
+
+
+def test_parser_extract():
+    """ Texts and attributes are extracted in one pass, including nested
+        (escaped) documents and parent/tag specs.
+    """
+
+    xml = ('<reply><playback-details><stream><title>R &amp; B</title>'
+           '</stream><state>Playing</state><format codec="MP3"/>'
+           '<title>ignored</title></playback-details></reply>')
+    texts, attrs = parser.extract(xml, ('state', 'stream/title', 'missing'),
+                                  ('format',))
+    assert texts == {'state': 'Playing', 'stream/title': 'R & B'}
+    assert attrs == {'format': {'codec': 'MP3'}}
+
+    response = ('<s:Envelope><s:Body><u:R><Meta>%s</Meta></u:R></s:Body>'
+                '</s:Envelope>' % '&lt;a&gt;&lt;b x="1"&gt;v&lt;/b&gt;&lt;/a&gt;')
+    assert parser.get_value(response, 'Meta') == '<a><b x="1">v</b></a>'
+    assert parser.get_value(parser.get_value(response, 'Meta'), 'b') == 'v'
+    assert parser.get_value(response, 'Nope') == 'n/a'
+
+    presets = parser.get_elements(
+        '<presets><preset id="1"><title>One</title></preset>'
+        '<preset id="2" isPlaying="true"><title>Two</title></preset>'
+        '</presets>', 'preset', ('title',))
+    assert presets == [({'id': '1'}, {'title': 'One'}),
+                       ({'id': '2', 'isPlaying': 'true'}, {'title': 'Two'})]
+
+
+def test_soap_request():
+    """ Arguments are ordered as defined, and their values are escaped. """
+
+    request = soap.SoapRequest('http://host/ctrl', 'host:80', 'urn:svc:1',
+                               'SetURI', ('URI', 'InstanceID'),
+                               ('InstanceID', 'URI'))
+    body, headers = request.build(('http://a/?x=1&y=<2>', 0))
+    assert b'<u:SetURI xmlns:u="urn:svc:1">\n<InstanceID>0</InstanceID>\n' \
+           b'<URI>http://a/?x=1&amp;y=&lt;2&gt;</URI>\n</u:SetURI>' in body
+    assert headers['SOAPACTION'] == '"urn:svc:1#SetURI"'
+    assert headers['Content-Length'] == len(body)
+
+
+def test_lazy_device():
+    """ A lazily created device isn't contacted until it is used. """
+
+    port = unused_port()
+    dev = device.StreamMagicDevice(
+        '127.0.0.1', port, 'StreamMagic',
+        'http://127.0.0.1:%d/description.xml' % port, lazy=True)
+    assert dev.get_power_state() is None
+    assert dev.warm_up(background=False) is False
+    dev.close()
+
+    dev = device.StreamMagicDevice(
+        '127.0.0.1', port, 'StreamMagic',
+        'http://127.0.0.1:%d/description.xml' % port, lazy=True,
+        command_interval=0.25)
+    assert dev.commands.min_interval == 0.25
+    dev.close()
+
+
+def test_offline_device():
+    """ The getters of a device that couldn't be reached return None. """
+
+    port = unused_port()
+    args = ('127.0.0.1', port, 'StreamMagic',
+            'http://127.0.0.1:%d/description.xml' % port)
+    dev = device.StreamMagicDevice(*args, circuit_breaker=False)
+    assert dev.services == {}
+    assert dev.get_volume() is None
+    assert dev.get_preset_list() is None
+    assert dev.get_current_preset() is None
+    assert dev.find_preset('Jazz') is None
+    assert dev.get_preset_list(refresh=True) is None
+    dev.close()
+
+    async def use():
+        dev = asyncdevice.AsyncStreamMagicDevice(*args, circuit_breaker=False)
+        assert await dev.get_preset_list() is None
+        assert await dev.get_current_preset() is None
+        assert await dev.find_preset(1) is None
+        await dev.aclose()
+
+    asyncio.run(use())
+
+
+def test_lazy_device_playback_details(emulator):
+    """ The power state of a lazily created device is retrieved before
+        the playback details.
+    """
+
+    emu = emulator()
+    dev = device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                   emu.location, lazy=True)
+    assert emu.requests == 0
+    details = dev.get_playback_details()
+    assert details is not None and details['state']
+    dev.close()
+
+
+def test_async_device(emulator):
+    """ The asyncio device is set up by create() or on first use, and
+        releases its navigator id in aclose().
+    """
+
+    emu = emulator()
+
+    async def use():
+        dev = await asyncdevice.AsyncStreamMagicDevice.create(
+            emu.host, emu.port, emu.server, emu.location)
+        assert dev.services and await dev.get_volume() == '12'
+        details = await dev.get_playback_details()
+        assert details is not None and details['state']
+        assert emu.state.navigators
+        svc = discovery.StreamMagic.URN_AVTransport
+        response = await dev.send_event_request('SUBSCRIBE', svc, {
+            'CALLBACK': '<http://127.0.0.1:%d/>' % unused_port(),
+            'NT': 'upnp:event', 'TIMEOUT': 'Second-60'})
+        assert list(emu.subscriptions) == [response.headers['SID']]
+        assert await dev.send_event_request(
+            'UNSUBSCRIBE', svc, {'SID': response.headers['SID']})
+        assert not emu.subscriptions
+        await dev.aclose()
+        assert not emu.state.navigators
+
+        lazy = asyncdevice.AsyncStreamMagicDevice(
+            emu.host, emu.port, emu.server, emu.location)
+        assert await lazy.get_power_state() == 'on'
+        assert await lazy.warm_up() is True
+        assert lazy.commands is None
+        await lazy.aclose()
+
+        port = unused_port()
+        offline = asyncdevice.AsyncStreamMagicDevice(
+            '127.0.0.1', port, 'StreamMagic',
+            'http://127.0.0.1:%d/description.xml' % port)
+        assert await offline.setup() is False
+        assert await offline.get_volume() is None
+        await offline.aclose()
+
+    asyncio.run(use())
+
+
+def test_navigator_lease(emulator):
+    """ The navigator id is registered once, registered again when the
+        device forgot it and released by close().
+    """
+
+    emu = emulator()
+    dev = device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                   emu.location)
+    requests = emu.requests
+    assert dev.get_playback_details()['state']
+    assert emu.requests - requests == 2     # register, details
+    assert dev.get_playback_details()['state']
+    assert emu.requests - requests == 3
+    assert len(emu.state.navigators) == 1
+
+    emu.state.navigators.clear()            # e.g. after a restart
+    assert dev.get_playback_details()['state']
+    assert emu.requests - requests == 7     # details, check, register, details
+    assert emu.state.navigators == {dev._navigator_id}
+    dev.close()
+    assert not emu.state.navigators
+
+
+def test_fleet_isolates_slow_devices():
+    """ A slow device doesn't delay the updates of the other devices. """
+
+    release = threading.Event()
+    players = fleet.Fleet(fields=('power_state', 'volume'), max_workers=4)
+    players.add('slow', FakeDevice(
+        get_power_state=lambda: release.wait(5) and 'on', get_volume=10,
+        close=None))
+    for num in range(5):
+        players.add(num, FakeDevice(get_power_state='on', get_volume=10,
+                                    close=None))
+    updates = list(players.sweep(timeout=0.5))
+    assert {u.key for u in updates[:5]} == {0, 1, 2, 3, 4}
+    assert updates[5].key == 'slow'
+    assert updates[5].errors == ('power_state', 'volume')
+    assert updates[0].values == {'power_state': 'on', 'volume': 10}
+
+    # the slow device is skipped while its request is still running
+    assert {u.key for u in players.sweep(timeout=0.5)} == {0, 1, 2, 3, 4}
+    stats = players.stats()
+    assert stats.sweeps == 2 and stats.busy == 1
+    assert stats.staleness['slow'] is None
+    release.set()
+    players.close()
+
+
+def test_command_channel_coalesces():
+    """ Commands queued while one is in flight are replaced by the latest
+        one of the same kind.
+    """
+
+    entered = threading.Event()
+    release = threading.Event()
+
+    def set_volume(volume):
+        entered.set()
+        release.wait(5)
+        return volume
+
+    dev = FakeDevice(set_volume=set_volume)
+    channel = commands.CommandChannel(dev, min_interval=0)
+    futures = [channel.set_volume(0)]
+    assert entered.wait(5)
+    futures += [channel.set_volume(volume) for volume in range(1, 10)]
+    assert channel.pending() == ['volume']
+    release.set()
+    assert channel.flush(timeout=5)
+    assert dev.calls == [('set_volume', 0), ('set_volume', 9)]
+    assert futures[-1].result() == 9 and futures[5].result() == 9
+    assert channel.sent + channel.coalesced == 10
+    channel.close()
+
+
+def test_circuit_breaker():
+    """ The breaker opens after consecutive failures, allows a trial
+        request after the reset timeout and closes when a probe succeeds.
+    """
+
+    assert health.is_idempotent('GetVolume')
+    assert health.is_idempotent('Shuffle')
+    assert not health.is_idempotent('SetVolume')
+    assert 0.05 <= health.RetryPolicy(backoff=0.1, jitter=0.5).delay(0) <= 0.1
+
+    breaker = health.CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure(now=0)
+    assert breaker.allow(now=1)
+    breaker.record_failure(now=1)
+    assert breaker.is_open and not breaker.allow(now=2)
+    assert breaker.allow(now=11) and breaker.state == health.HALF_OPEN
+    assert not breaker.allow(now=11)
+    breaker.record_failure(now=11)
+    assert not breaker.allow(now=25)   # reset timeout doubled
+    assert breaker.allow(now=31)
+    breaker.record_success()
+    assert breaker.state == health.CLOSED and breaker.rejected == 3
+
+    answers = [False, True]
+    breaker = health.CircuitBreaker(failure_threshold=1, reset_timeout=0.05,
+                                    probe=lambda: answers.pop(0))
+    breaker.record_failure()
+    deadline = time.monotonic() + 5
+    while breaker.state != health.CLOSED and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert breaker.state == health.CLOSED and not answers
+    breaker.close()
+
+
+def test_position_tracker():
+    """ The position is extrapolated while playing, frozen while paused
+        and only sampled again on a state change, drift or seek.
+    """
+    meta = escape('<DIDL-Lite><item><dc:title>Splitter</dc:title>'
+                  '<res duration="0:03:30.000">x</res></item></DIDL-Lite>')
+    abs_time = ['0:00:47']
+    # parses the responses without being set up
+    parsing = device.StreamMagicDevice.__new__(device.StreamMagicDevice)
+
+    def get_position_info():
+        return parsing._parse_position_info((
+            '<r><TrackURI>http://a/2.flac</TrackURI>'
+            '<TrackDuration>0:03:30</TrackDuration>'
+            '<TrackMetaData>%s</TrackMetaData>'
+            '<AbsTime>%s</AbsTime></r>' % (meta, abs_time[0])
+        ).encode('utf-8'))
+
+    clock = [100.0]
+    dev = FakeDevice(
+        get_audio_source='media player', get_transport_state='PLAYING',
+        get_position_info=get_position_info,
+        trnsprt_seek=lambda target: abs_time.__setitem__(0, target))
+    tracker = position.PositionTracker(dev, verify_interval=15,
+                                       clock=lambda: clock[0])
+    assert tracker.position() == 47
+    for _ in range(10):
+        clock[0] += 1
+        info = tracker.get_current_track_info()
+    assert info['currentPos'] == '0:00:57' and info['trackTitle'] == 'Splitter'
+    assert len(dev.calls) == 3 and tracker.length == 210
+
+    # the device's position is within drift_threshold: not adopted
+    abs_time[0] = '0:01:03'
+    clock[0] += 5
+    assert tracker.position() == 62 and tracker.corrections == 0
+    assert len(dev.calls) == 5
+
+    tracker.update(transport_state='PAUSED_PLAYBACK')
+    dev.values['get_transport_state'] = 'PAUSED_PLAYBACK'
+    abs_time[0] = '0:01:05'
+    assert tracker.position() == 65
+    clock[0] += 10
+    assert tracker.position() == 65 and len(dev.calls) == 8
+
+    tracker.seek('0:02:00')
+    assert tracker.position() == 120 and tracker.samples == 4
+
+    # a track without meta data
+    meta = ''
+    tracker.update(track_uri='http://a/3.flac')
+    assert tracker.position() == 120
+    assert tracker.get_current_track_info() is None
+
+
+def test_position_tracker_without_position():
+    """ Without a position to track, verifications only sample the audio
+        source and transport state, and take a full sample when they change.
+    """
+    clock = [100.0]
+    dev = FakeDevice(
+        get_audio_source='internet radio', get_transport_state='PLAYING',
+        get_position_info=dict)
+    tracker = position.PositionTracker(dev, verify_interval=15,
+                                       idle_verify_interval=60,
+                                       clock=lambda: clock[0])
+    assert tracker.position() is None and len(dev.calls) == 2
+    for _ in range(3):
+        clock[0] += 16
+        assert tracker.position() is None
+    assert len(dev.calls) == 2
+
+    clock[0] += 16
+    assert tracker.position() is None and len(dev.calls) == 4
+    assert tracker.samples == 2 and tracker.audio_source == 'internet radio'
+
+    dev.values['get_audio_source'] = 'media player'
+    clock[0] += 60
+    assert tracker.position() is None and len(dev.calls) == 9
+    assert tracker.samples == 4 and tracker.audio_source == 'media player'
+
+
+def test_get_state(emulator, monkeypatch):
+    """ get_state() sends its requests concurrently, over no more
+        connections than the pool keeps open.
+    """
+
+    emu = emulator(latency=0.05)
+    for pool_size in (1, None):
+        connections = emu.connections
+        dev = device.StreamMagicDevice(
+            emu.host, emu.port, emu.server, emu.location,
+            **({} if pool_size is None else {'pool_size': pool_size}))
+        state = dev.get_state()
+        assert state.power_state == 'on' and state.volume == '12'
+        assert state.transport_state == 'PLAYING' and state.mute is False
+        assert state.audio_source == 'media player'
+        assert state.track_info['trackTitle'] != 'NOT_IMPLEMENTED'
+        assert set(state.timestamps) == set(state._fields) - {'timestamps'}
+        start = time.monotonic()
+        dev.get_state()
+        elapsed = time.monotonic() - start
+        if pool_size is None:
+            # about one round trip with the default pool size
+            assert elapsed < 0.25
+            assert emu.connections - connections <= device.STATE_REQUESTS
+        else:
+            assert elapsed >= 0.35
+            assert emu.connections - connections <= pool_size
+        dev.close()
+
+    # concurrent callers share the device's thread pool
+    executors = []
+    executor = device.ThreadPoolExecutor
+    monkeypatch.setattr(device, 'ThreadPoolExecutor', lambda **kwargs:
+                        executors.append(executor(**kwargs)) or executors[-1])
+    dev = device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                   emu.location)
+    callers = [threading.Thread(target=dev.get_state) for _ in range(4)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert len(executors) == 1
+    dev.close()
+
+    async def use():
+        connections = emu.connections
+        dev = await asyncdevice.AsyncStreamMagicDevice.create(
+            emu.host, emu.port, emu.server, emu.location, pool_size=1)
+        assert (await dev.get_state()).volume == '12'
+        await dev.get_state()
+        assert emu.connections - connections == 1
+        dev.close()
+
+    asyncio.run(use())
+
+
+def test_preset_table():
+    """ Cached presets can be looked up by number and name. """
+
+    table = device.PresetTable(3, [['1', 'Radio One', False],
+                                   ['2', 'Jazz', True],
+                                   ['3', 'Radio One', False]])
+    assert table.playing == '2'
+    assert table.find(2) == {'num': '2', 'name': 'Jazz'}
+    assert table.find('Radio One') == {'num': '1', 'name': 'Radio One'}
+    assert table.find('Nope') is None
+    assert table.as_list()[1] == ['2', 'Jazz', True]
+
+
+def test_preset_cache(emulator):
+    """ Cached presets are used whether or not one of them is playing,
+        and a preset that stopped playing is noticed with a single request.
+    """
+
+    emu = emulator(presets=100)
+    dev = device.StreamMagicDevice(emu.host, emu.port, emu.server,
+                                   emu.location)
+    requests = emu.requests
+    assert len(dev.get_preset_list()) == 100
+    assert emu.requests - requests == 6      # count + 5 pages
+    assert dev.get_current_preset() == {'num': '1', 'name': 'Preset 1'}
+    assert emu.requests - requests == 7      # the playing preset
+    emu.state.preset = 0
+    assert dev.get_current_preset() is None
+    assert emu.requests - requests == 8
+    assert dev.get_current_preset() is None
+    assert dev.find_preset('Preset 42') == {'num': '42',
+                                            'name': 'Preset 42'}
+    assert len(dev.get_preset_list()) == 100
+    assert emu.requests - requests == 8
+    assert len(dev.get_preset_list(refresh=True)) == 100
+    assert emu.requests - requests == 14
+    dev.close()
+
+
+def test_poll_scheduler():
+    """ Fields are polled according to the device state, failing fields
+        back off and callbacks are only called for changes.
+    """
+
+    changes = []
+    dev = FakeDevice(get_power_state='on', get_transport_state='STOPPED',
+                     get_volume=OSError())
+    polls = scheduler.PollScheduler(
+        lambda *args: changes.append(args),
+        fields=('power_state', 'transport_state', 'volume'))
+    polls.add('dev', dev)
+    now = time.monotonic()
+    assert polls.run_pending(now) == 3
+    assert changes == [('dev', 'power_state', None, 'on'),
+                       ('dev', 'transport_state', None, 'STOPPED')]
+    assert polls.interval('dev', 'transport_state', now) == 5
+    assert polls.interval('dev', 'volume', now) == 6   # backed off
+
+    # nothing changed: no callback
+    assert polls.run_pending(now + 5) == 1
+    assert len(changes) == 2
+
+    dev.values['get_transport_state'] = 'TRANSITIONING'
+    polls.run_pending(now + 10)
+    assert changes[-1] == ('dev', 'transport_state', 'STOPPED',
+                           'TRANSITIONING')
+    assert polls.interval('dev', 'transport_state', now + 10) == 0.5
+
+
+def test_metrics_export():
+    """ Requests are counted per device, service and action and exported
+        in the Prometheus text format and as JSON.
+    """
+
+    hooked = []
+    recorder = metrics.Metrics(buckets=(0.01, 0.1))
+    recorder.add_hook(hooked.append)
+    recorder.request('10.0.0.2', 'RenderingControl', 'GetVolume', 'ok',
+                     phases={'total': 0.05}, bytes_out=300, bytes_in=200)
+    recorder.request('10.0.0.2', 'UuVolControl', 'GetPlaybackDetails',
+                     'fault', code='401', phases={'total': 0.002})
+    assert len(hooked) == 2 and hooked[1].code == '401'
+
+    text = recorder.to_prometheus()
+    assert '# TYPE stream_magic_request_seconds histogram' in text
+    assert 'stream_magic_request_seconds_bucket{device="10.0.0.2",' \
+           'service="RenderingControl",action="GetVolume",phase="total",' \
+           'le="0.1"} 1' in text
+    assert 'stream_magic_soap_faults_total{device="10.0.0.2",' \
+           'service="UuVolControl",action="GetPlaybackDetails",' \
+           'code="401"} 1' in text
+
+    snapshot = json.loads(recorder.to_json())
+    counters = {(c['name'], c['labels'].get('action')): c['value']
+                for c in snapshot['counters']}
+    assert counters[('stream_magic_bytes_sent_total', 'GetVolume')] == 300
+    assert snapshot['histograms'][0]['buckets'] == [[0.01, 0], [0.1, 1],
+                                                    ['+Inf', 1]]